@@ -1,8 +1,31 @@
 from django.contrib import admin
-from .models import Video
+from django.db.models import Q
+from .models import Video, TranscodeJob, UploadSession
+from .search import search_filter
 
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
     list_display = ('title', 'uploaded_at', 'hls_master_playlist')
     search_fields = ('title',)
     list_filter = ('uploaded_at',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Substrings such as "atri" keep matching through icontains; the search filter adds typos and
+        # words from the description and genre. Every branch is served by a GIN index.
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(Q(title__icontains=search_term) | search_filter(search_term)), False
+
+
+@admin.register(TranscodeJob)
+class TranscodeJobAdmin(admin.ModelAdmin):
+    list_display = ('video', 'task_id', 'state', 'created_at', 'finished_at')
+    list_filter = ('state',)
+    readonly_fields = ('stage_timings', 'error')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'created_by', 'offset', 'size', 'updated_at')
+    readonly_fields = ('offset',)
@@ -0,0 +1,131 @@
+import base64
+import json
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class VideoCursorPagination(BasePagination):
+    """Keyset pagination over (uploaded_at, id), newest first.
+
+    Each page continues from the last row of the previous one with a WHERE on the composite index,
+    so page 1000 costs the same as page 1. Cursors are opaque and never carry an OFFSET.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        if cursor is None:
+            reverse, position = False, None
+            queryset = queryset.order_by('-uploaded_at', '-id')
+        else:
+            reverse, position = cursor
+            uploaded_at, pk = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(uploaded_at__gte=uploaded_at) & (Q(uploaded_at__gt=uploaded_at) | Q(id__gt=pk))
+                ).order_by('uploaded_at', 'id')
+            else:
+                # The first condition alone is what lets the database seek into the index.
+                queryset = queryset.filter(
+                    Q(uploaded_at__lte=uploaded_at) & (Q(uploaded_at__lt=uploaded_at) | Q(id__lt=pk))
+                ).order_by('-uploaded_at', '-id')
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = self.get_position(results[-1])
+            if position is not None and (has_more or not reverse):
+                self.previous_position = self.get_position(results[0])
+        return results
+
+    @staticmethod
+    def get_position(row):
+        # Pages are model instances or, on the catalog fast path, .values() rows.
+        if isinstance(row, dict):
+            return row['uploaded_at'], row['id']
+        return row.uploaded_at, row.id
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.VIDEO_CATALOG_PAGE_SIZE
+        return max(1, min(page_size, settings.VIDEO_CATALOG_MAX_PAGE_SIZE))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            return bool(data['r']), (datetime.fromisoformat(data['t']), int(data['id']))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def encode_position(reverse, position):
+        uploaded_at, pk = position
+        data = json.dumps({'r': int(reverse), 't': uploaded_at.isoformat(), 'id': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+
+    def encode_cursor(self, reverse, position):
+        encoded = self.encode_position(reverse, position)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(False, self.next_position)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(True, self.previous_position)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class VideoSearchPagination(PageNumberPagination):
+    """Page numbers for ranked search results.
+
+    Relevance is computed per query, so there is no stable column to continue from; search results
+    are only ever read a few pages deep.
+    """
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        self.page_size = settings.VIDEO_CATALOG_PAGE_SIZE
+        self.max_page_size = settings.VIDEO_CATALOG_MAX_PAGE_SIZE
+        return super().get_page_size(request)
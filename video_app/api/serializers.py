@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from django.conf import settings
-from video_app.models import Video, UserVideoProgress
-from django.utils.encoding import iri_to_uri
+from video_app.models import Video, UserVideoProgress, TranscodeJob, UploadSession
+from video_app.tasks import get_transcode_progress
+from video_app.media_signing import signed_media_url
+from django.utils.encoding import iri_to_uri, filepath_to_uri
+from django.utils import timezone
+from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 
 
@@ -10,7 +14,25 @@ class UserVideoProgressSerializer(serializers.ModelSerializer):
         model = UserVideoProgress
         fields = ['last_viewed_position', 'viewed', 'last_viewed_at']
 
+def get_viewer_progress(video, request):
+    """Return the progress of the requesting user on a video.
+
+    Costs one query per video; the catalog views serialize with omit_user_progress and fill in a whole
+    page with overlay_user_progress instead.
+    """
+    if not request or not request.user.is_authenticated:
+        return None
+    return UserVideoProgress.objects.filter(user=request.user, video=video).first()
+
+class SignedMediaField(serializers.FileField):
+    """A file field rendered as a signed URL, since /media/ only serves video files to signed or logged-in requests."""
+
+    def to_representation(self, value):
+        return signed_media_url(value.name) if value else None
+
 class VideoListSerializer(serializers.ModelSerializer):
+    file = SignedMediaField()
+    hls_master_playlist = SignedMediaField(required=False, allow_null=True)
     user_progress = serializers.SerializerMethodField()
 
     class Meta:
@@ -18,39 +40,110 @@ class VideoListSerializer(serializers.ModelSerializer):
         fields = ['title', 'file', 'thumbnail', 'description', 'hls_master_playlist', 'uploaded_at', 'user_progress', 'id', 'genre']
 
     def get_user_progress(self, obj):
-        request = self.context.get('request')
-        if request:
-            print(f"Request user: {request.user}, Authenticated: {request.user.is_authenticated}")
-        if request and request.user.is_authenticated:
-            progress = UserVideoProgress.objects.filter(user=request.user, video=obj).first()
-            print(f"Progress found: {progress}")
-            if progress:
-                return UserVideoProgressSerializer(progress).data
+        # Cached catalog responses leave this empty and get it filled in per request.
+        if self.context.get('omit_user_progress'):
+            return None
+        progress = get_viewer_progress(obj, self.context.get('request'))
+        if progress:
+            return UserVideoProgressSerializer(progress).data
         return None
+
+VIDEO_LIST_VALUES = ['title', 'file', 'thumbnail', 'description', 'hls_master_playlist', 'uploaded_at', 'id', 'genre']
+# Thumbnails are public, so only these fields need a signed URL.
+SIGNED_MEDIA_FIELDS = ('file', 'hls_master_playlist')
+
+def media_url_builder(request, field_name):
+    """Return a function turning a stored file name into the URL the serializer field would give it."""
+    if field_name in SIGNED_MEDIA_FIELDS:
+        return signed_media_url
+    storage = Video._meta.get_field(field_name).storage
+    if request is None:
+        return storage.url
+    if isinstance(storage, FileSystemStorage):
+        # Same result as build_absolute_uri(storage.url(name)), with the host and base URL resolved once.
+        prefix = request.build_absolute_uri(storage.base_url)
+        return lambda name: prefix + filepath_to_uri(name).lstrip('/')
+    return lambda name: request.build_absolute_uri(storage.url(name))
+
+def video_list_data(rows, request):
+    """Build the VideoListSerializer payload from .values(*VIDEO_LIST_VALUES) rows.
+
+    Renders to the same bytes as VideoListSerializer with omit_user_progress, without creating
+    model instances or running a field serializer per value.
+    """
+    uploaded_at = serializers.DateTimeField(default_timezone=timezone.get_current_timezone())
+    file_url = media_url_builder(request, 'file')
+    thumbnail_url = media_url_builder(request, 'thumbnail')
+    playlist_url = media_url_builder(request, 'hls_master_playlist')
+    return [
+        {
+            'title': row['title'],
+            'file': file_url(row['file']) if row['file'] else None,
+            'thumbnail': thumbnail_url(row['thumbnail']) if row['thumbnail'] else None,
+            'description': row['description'],
+            'hls_master_playlist': playlist_url(row['hls_master_playlist']) if row['hls_master_playlist'] else None,
+            'uploaded_at': uploaded_at.to_representation(row['uploaded_at']),
+            'user_progress': None,
+            'id': row['id'],
+            'genre': row['genre'],
+        }
+        for row in rows
+    ]
     
     
 class VideoDetailSerializer(serializers.ModelSerializer):
+    file = SignedMediaField()
     user_progress = serializers.SerializerMethodField()
     hls_master_playlist_url = serializers.SerializerMethodField()
+    storyboard_vtt_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Video
-        fields = ['title', 'file', 'thumbnail', 'description', 'hls_master_playlist_url', 'uploaded_at', 'user_progress', 'id', 'genre', 'user_progress'] 
+        fields = ['title', 'file', 'thumbnail', 'description', 'hls_master_playlist_url', 'storyboard_vtt_url', 'uploaded_at', 'user_progress', 'id', 'genre', 'user_progress'] 
 
     def get_hls_master_playlist_url(self, obj):
         if obj.hls_master_playlist:
-            return f"http://127.0.0.1:8000/media/videos/hls/{obj.id}/master.m3u8"
+            return signed_media_url(f"videos/hls/{obj.id}/master.m3u8")
         return None
 
+    def get_storyboard_vtt_url(self, obj):
+        if not obj.storyboard_vtt:
+            return None
+        return signed_media_url(obj.storyboard_vtt.name)
+
     def get_user_progress(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            progress = UserVideoProgress.objects.filter(user=request.user, video=obj).first()
-            if progress:
-                return UserVideoProgressSerializer(progress).data
+        # Cached catalog responses leave this empty and get it filled in per request.
+        if self.context.get('omit_user_progress'):
+            return None
+        progress = get_viewer_progress(obj, self.context.get('request'))
+        if progress:
+            return UserVideoProgressSerializer(progress).data
         return None
 
 class UserVideoProgressSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserVideoProgress
         fields = ['last_viewed_position', 'viewed',]
+
+class TranscodeJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TranscodeJob
+        fields = ['video', 'task_id', 'state', 'progress', 'stage_timings', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def get_progress(self, obj):
+        if obj.state == TranscodeJob.SUCCESS:
+            return 100
+        return get_transcode_progress(obj.task_id) or 0
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'title', 'description', 'genre', 'filename', 'size', 'offset', 'finalizing', 'video', 'created_at']
+        read_only_fields = ['id', 'offset', 'finalizing', 'video', 'created_at']
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Upload size must be positive.")
+        return value
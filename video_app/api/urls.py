@@ -1,9 +1,21 @@
 from django.urls import path
-from .views import AdminVideoUploadView, UserVideoListView, UserVideoDetailView, UserVideoProgressUpdateView
+from .views import AdminVideoUploadView, UserVideoListView, UserVideoDetailView, UserVideoProgressUpdateView, \
+  TranscodeStatusView, UploadSessionCreateView, UploadSessionView, UploadSessionCompleteView, \
+  CatalogCacheStatsView, HomeRailsView, VideoSearchView, ContinueWatchingView, SegmentCacheStatsView
 
 urlpatterns = [
     path('videos/upload/', AdminVideoUploadView.as_view(), name='upload_video'),
+    path('videos/uploads/', UploadSessionCreateView.as_view(), name='upload_session_create'),
+    path('videos/uploads/<uuid:upload_id>/', UploadSessionView.as_view(), name='upload_session'),
+    path('videos/uploads/<uuid:upload_id>/complete/', UploadSessionCompleteView.as_view(), name='upload_session_complete'),
+    path('videos/rails/', HomeRailsView.as_view(), name='video_rails'),
+    path('videos/search/', VideoSearchView.as_view(), name='video_search'),
+    path('videos/continue-watching/', ContinueWatchingView.as_view(), name='continue_watching'),
     path('videos/', UserVideoListView.as_view(), name='video_list'),
     path('videos/<int:video_id>/', UserVideoDetailView.as_view(), name='single_video'),
     path('video/<int:video_id>/progress/', UserVideoProgressUpdateView.as_view(), name='video-progress'),
+    path('videos/<int:video_id>/status/', TranscodeStatusView.as_view(), name='video_transcode_status'),
+    path('catalog/cache-stats/', CatalogCacheStatsView.as_view(), name='catalog_cache_stats'),
+    path('media/cache-stats/', SegmentCacheStatsView.as_view(), name='segment_cache_stats'),
+    path('transcode/<str:task_id>/', TranscodeStatusView.as_view(), name='transcode_status'),
 ]
\ No newline at end of file
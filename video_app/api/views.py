@@ -1,11 +1,35 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from video_app.models import Video, UserVideoProgress
+from rest_framework.fields import DateTimeField
+from video_app.models import Video, UserVideoProgress, TranscodeJob, UploadSession
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
-from ..tasks import convert_to_hls
-from .serializers import VideoListSerializer, VideoDetailSerializer, UserVideoProgressSerializer
+from .serializers import VideoListSerializer, VideoDetailSerializer, UserVideoProgressSerializer, TranscodeJobSerializer, \
+    UploadSessionSerializer, VIDEO_LIST_VALUES, video_list_data
+from .pagination import VideoCursorPagination, VideoSearchPagination
+from video_app.catalog_cache import (
+    catalog_cache_key, get_cache_stats, get_cached_response, get_catalog_stamp, set_cached_response,
+)
+from video_app.progress_buffer import (
+    buffer_progress, continue_watching, get_buffered_stamp, get_progress, read_buffered_progress,
+)
+from video_app.media_signing import media_url_window
+from video_app.rails import RAIL_FLAGS, get_home_rails
+from video_app.search import SEARCH_MAX_LENGTH, search_videos
+from video_app.segment_cache import get_segment_cache_stats
+from video_app.tasks import store_upload
+from video_app.uploads import (
+    UploadBusy, UploadOffsetMismatch, UploadTooLarge, claim_finalize, claim_upload, discard_upload, write_chunk,
+)
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import UnreadablePostError
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from datetime import datetime, timezone
+import hashlib
 import logging
 logger = logging.getLogger(__name__)
 
@@ -16,35 +40,298 @@ class AdminVideoUploadView(APIView):
         serializer = VideoListSerializer(data=request.data)
         if serializer.is_valid():
             video = serializer.save()
-            logger.info(f"[View] Upload successful, triggering HLS for id {video.id}")
-            task = convert_to_hls.delay(video.id)
+            logger.info(f"[View] Upload successful, HLS conversion queued for id {video.id}")
             return Response({
                 'message': 'Video uploaded successfully and conversion started.',
                 'video_id': video.id,
-                'task_id': task.id,
+                'task_id': video.transcode_task_id,
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+class UploadSessionCreateView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = UploadSessionSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(created_by=request.user)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class UploadSessionView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, upload_id, *args, **kwargs):
+        session = get_object_or_404(UploadSession, id=upload_id)
+        serializer = UploadSessionSerializer(session)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def put(self, request, upload_id, *args, **kwargs):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return Response({"error": "Upload-Offset header is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The row is locked only to claim the chunk; the body streams outside the transaction.
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), id=upload_id)
+            try:
+                claim_upload(session, offset)
+            except UploadOffsetMismatch:
+                return Response({"error": "Offset does not match the uploaded size.", "offset": session.offset},
+                                status=status.HTTP_409_CONFLICT)
+            except UploadBusy:
+                return self.busy(session)
+        try:
+            write_chunk(session, request.stream or request._request)
+        except UploadTooLarge:
+            return Response({"error": "Chunk exceeds the declared upload size.", "offset": session.offset},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except UploadBusy:
+            return self.busy(session)
+        except UnreadablePostError:
+            logger.warning(f"[View] Upload {upload_id} interrupted at byte {session.offset}")
+            return Response({"error": "Chunk was interrupted.", "offset": session.offset},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({"offset": session.offset, "size": session.size}, status=status.HTTP_200_OK)
+
+    def busy(self, session):
+        return Response({"error": "Another chunk of this upload is still being written.", "offset": session.offset},
+                        status=status.HTTP_409_CONFLICT)
+
+    def delete(self, request, upload_id, *args, **kwargs):
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), id=upload_id)
+            if session.finalizing:
+                return Response({"error": "Upload is being stored and cannot be aborted."},
+                                status=status.HTTP_409_CONFLICT)
+            discard_upload(session)
+            session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadSessionCompleteView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, upload_id, *args, **kwargs):
+        # The row is locked only to mark the upload as finalizing; a worker stores the file after commit.
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), id=upload_id)
+            try:
+                content_hash = claim_finalize(session)
+            except UploadOffsetMismatch:
+                return Response({"error": "Upload is not complete.", "offset": session.offset, "size": session.size},
+                                status=status.HTTP_409_CONFLICT)
+            except UploadBusy:
+                return Response({"error": "Upload is already being finalized or still receiving a chunk."},
+                                status=status.HTTP_409_CONFLICT)
+            transaction.on_commit(lambda: store_upload.delay(str(session.id), content_hash))
+        logger.info(f"[View] Upload {upload_id} complete, queued for storage")
+        return Response({
+            'message': 'Upload complete. The video is created and converted once the file is stored.',
+            'upload_id': session.id,
+        }, status=status.HTTP_202_ACCEPTED)
+
+class TranscodeStatusView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, video_id=None, task_id=None, *args, **kwargs):
+        if task_id:
+            job = get_object_or_404(TranscodeJob, task_id=task_id)
+        else:
+            job = TranscodeJob.objects.filter(video_id=video_id).order_by('-created_at').first()
+            if job is None:
+                return Response({"error": "No transcode job for this video."}, status=status.HTTP_404_NOT_FOUND)
+        serializer = TranscodeJobSerializer(job)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+def overlay_user_progress(items, user):
+    """Fill in user_progress of cached, user-independent video data with one query for the whole page.
+
+    Progress still waiting in the write-behind buffer is newer than the stored rows and wins.
+    """
+    video_ids = [item['id'] for item in items]
+    progress = {p.video_id: p for p in UserVideoProgress.objects.filter(user=user, video_id__in=video_ids)}
+    if settings.PROGRESS_WRITE_BEHIND:
+        for video_id, state in read_buffered_progress(user.id, video_ids).items():
+            progress[video_id] = UserVideoProgress(
+                video_id=video_id, last_viewed_position=state['last_viewed_position'], viewed=state['viewed']
+            )
+    for item in items:
+        item_progress = progress.get(item['id'])
+        item['user_progress'] = UserVideoProgressSerializer(item_progress).data if item_progress else None
+    return items
+
+def catalog_validators(request, video_id=None):
+    """Return a strong ETag and Last-Modified for the catalog as this user sees it.
+
+    Built from the cached catalog stamp, one aggregate over the user's progress and the time of the
+    last buffered heartbeat, so a 304 costs a single query and no serialization.
+    """
+    version, modified = get_catalog_stamp()
+    progress = UserVideoProgress.objects.filter(user=request.user)
+    if video_id is not None:
+        progress = progress.filter(video_id=video_id)
+    last_viewed = progress.aggregate(last_viewed=Max('last_viewed_at'))['last_viewed']
+    last_viewed = last_viewed.timestamp() if last_viewed else 0
+    if settings.PROGRESS_WRITE_BEHIND:
+        last_viewed = max(last_viewed, get_buffered_stamp(request.user.id, video_id))
+    # Responses carry signed media URLs, which are renewed every signing window, so a new window makes
+    # both validators change, for clients that only send If-Modified-Since too.
+    window = media_url_window()
+    tag = f'{version}:{request.user.pk}:{last_viewed}:{window}:{request.accepted_renderer.format}'
+    return f'"{hashlib.sha1(tag.encode()).hexdigest()}"', int(max(modified, last_viewed, window * settings.MEDIA_URL_TTL))
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # The body differs per user, so only the client may keep it, and it has to revalidate before reuse.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 class UserVideoListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        videos = Video.objects.all()
-        serializer = VideoListSerializer(videos, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        etag, last_modified = catalog_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, last_modified)
+
+        key = catalog_cache_key('list', request)
+        data = get_cached_response(key)
+        if data is None:
+            paginator = VideoCursorPagination()
+            rows = paginator.paginate_queryset(Video.objects.values(*VIDEO_LIST_VALUES), request, self)
+            data = paginator.get_paginated_response(video_list_data(rows, request)).data
+            set_cached_response(key, data)
+        overlay_user_progress(data['results'], request.user)
+        return set_validators(Response(data, status=status.HTTP_200_OK), etag, last_modified)
+
+class VideoSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        terms = request.query_params.get('q', '').strip()
+        if not terms:
+            return Response({"error": "Query parameter q is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(terms) > SEARCH_MAX_LENGTH:
+            return Response({"error": f"Search terms are limited to {SEARCH_MAX_LENGTH} characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        etag, last_modified = catalog_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, last_modified)
+
+        key = catalog_cache_key('search', request)
+        data = get_cached_response(key)
+        if data is None:
+            paginator = VideoSearchPagination()
+            rows = paginator.paginate_queryset(search_videos(Video.objects.all(), terms).values(*VIDEO_LIST_VALUES),
+                                               request, self)
+            data = paginator.get_paginated_response(video_list_data(rows, request)).data
+            set_cached_response(key, data)
+        overlay_user_progress(data['results'], request.user)
+        return set_validators(Response(data, status=status.HTTP_200_OK), etag, last_modified)
 
 class UserVideoDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, video_id, *args, **kwargs):
-        video = get_object_or_404(Video, id=video_id)
-        serializer = VideoDetailSerializer(video, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        etag, last_modified = catalog_validators(request, video_id)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, last_modified)
+
+        key = catalog_cache_key('detail', request)
+        data = get_cached_response(key)
+        if data is None:
+            video = get_object_or_404(Video, id=video_id)
+            serializer = VideoDetailSerializer(video, context={'request': request, 'omit_user_progress': True})
+            data = serializer.data
+            set_cached_response(key, data)
+        overlay_user_progress([data], request.user)
+        return set_validators(Response(data, status=status.HTTP_200_OK), etag, last_modified)
+
+class HomeRailsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = catalog_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, last_modified)
+
+        key = catalog_cache_key('rails', request)
+        data = get_cached_response(key)
+        if data is None:
+            rails = get_home_rails()
+            ids = {video_id for flag in RAIL_FLAGS for video_id in rails[flag]}
+            ids.update(video_id for _, genre_ids in rails['genres'] for video_id in genre_ids)
+            rows = Video.objects.filter(id__in=ids).values(*VIDEO_LIST_VALUES)
+            videos = {item['id']: item for item in video_list_data(rows, request)}
+            data = {flag: [videos[i] for i in rails[flag] if i in videos] for flag in RAIL_FLAGS}
+            data['genres'] = [
+                {'genre': genre, 'videos': [videos[i] for i in genre_ids if i in videos]}
+                for genre, genre_ids in rails['genres']
+            ]
+            set_cached_response(key, data)
+        items = [item for flag in RAIL_FLAGS for item in data[flag]]
+        items += [item for row in data['genres'] for item in row['videos']]
+        overlay_user_progress(items, request.user)
+        return set_validators(Response(data, status=status.HTTP_200_OK), etag, last_modified)
+
+def percent_watched(position, duration):
+    if not duration:
+        return None
+    return round(min(position / duration, 1) * 100, 1)
+
+class ContinueWatchingView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = catalog_validators(request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, last_modified)
+
+        entries = continue_watching(request.user.id, settings.CONTINUE_WATCHING_SIZE)
+        rows = list(Video.objects.filter(id__in=[video_id for video_id, _ in entries]).values(*VIDEO_LIST_VALUES, 'duration'))
+        durations = {row['id']: row['duration'] for row in rows}
+        videos = {item['id']: item for item in video_list_data(rows, request)}
+        last_viewed_at = DateTimeField()
+        results = []
+        for video_id, state in entries:
+            item = videos.get(video_id)
+            if item is None:
+                continue
+            progress = UserVideoProgress(last_viewed_position=state['last_viewed_position'], viewed=state['viewed'])
+            item['user_progress'] = UserVideoProgressSerializer(progress).data
+            item['percent_watched'] = percent_watched(state['last_viewed_position'], durations[video_id])
+            item['last_viewed_at'] = last_viewed_at.to_representation(
+                datetime.fromtimestamp(state['last_viewed_at'], tz=timezone.utc)
+            )
+            results.append(item)
+        return set_validators(Response({'results': results}, status=status.HTTP_200_OK), etag, last_modified)
+
+class CatalogCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_cache_stats(), status=status.HTTP_200_OK)
+
+class SegmentCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_segment_cache_stats(), status=status.HTTP_200_OK)
     
 class UserVideoProgressUpdateView(APIView):
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, video_id):
+        if settings.PROGRESS_WRITE_BEHIND:
+            return self.buffer(request, video_id)
         try:
             progress, created = UserVideoProgress.objects.get_or_create(
                 user=request.user,
@@ -52,9 +339,24 @@ class UserVideoProgressUpdateView(APIView):
             )
             serializer = UserVideoProgressSerializer(progress, data=request.data, partial=True)
             if serializer.is_valid():
-                serializer.save()
+                serializer.save(last_viewed_at=datetime.now(timezone.utc))
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         except Video.DoesNotExist:
-            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    def buffer(self, request, video_id):
+        # Heartbeats only touch Redis; flush_progress writes them to the database in bulk.
+        serializer = UserVideoProgressSerializer(data=request.data, partial=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        state = get_progress(request.user.id, video_id)
+        if state is None:
+            if not Video.objects.filter(id=video_id).exists():
+                return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+            state = {'last_viewed_position': 0.0, 'viewed': False}
+        state.update(serializer.validated_data)
+        state = buffer_progress(request.user.id, video_id, state)
+        progress = UserVideoProgress(last_viewed_position=state['last_viewed_position'], viewed=state['viewed'])
+        return Response(UserVideoProgressSerializer(progress).data, status=status.HTTP_200_OK)
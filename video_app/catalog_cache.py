@@ -0,0 +1,77 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from video_app.media_signing import media_url_window
+
+CATALOG_VERSION_KEY = 'catalog-version'
+CATALOG_MODIFIED_KEY = 'catalog-modified'
+CATALOG_ENTRY_KEY = 'catalog:{}:{}:{}:{}'
+CATALOG_HITS_KEY = 'catalog-cache:hits'
+CATALOG_MISSES_KEY = 'catalog-cache:misses'
+
+
+def get_catalog_version():
+    # Start from the clock rather than 1 so an evicted version key cannot bring old entries back.
+    cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+    return cache.get(CATALOG_VERSION_KEY)
+
+
+def get_catalog_modified():
+    cache.add(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+    return cache.get(CATALOG_MODIFIED_KEY)
+
+
+def get_catalog_stamp():
+    """Return the catalog version and the time it last changed, usually in one cache round trip."""
+    stamp = cache.get_many([CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY])
+    if len(stamp) < 2:
+        return get_catalog_version(), get_catalog_modified()
+    return stamp[CATALOG_VERSION_KEY], stamp[CATALOG_MODIFIED_KEY]
+
+
+def bump_catalog_version():
+    """Make every cached catalog response stale at once; old entries simply expire."""
+    cache.set(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        return get_catalog_version()
+
+
+def catalog_cache_key(kind, request):
+    """Key a response by catalog version and the absolute URL, since links and file URLs in it are absolute.
+
+    The signing window is part of the key too, so a cached response never hands out expired media URLs.
+    """
+    url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+    return CATALOG_ENTRY_KEY.format(kind, get_catalog_version(), media_url_window(), url)
+
+
+def count(key, delta=1):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key, delta)
+
+
+def get_cached_response(key):
+    data = cache.get(key)
+    count(CATALOG_MISSES_KEY if data is None else CATALOG_HITS_KEY)
+    return data
+
+
+def set_cached_response(key, data):
+    cache.set(key, data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+
+def get_cache_stats():
+    hits = cache.get(CATALOG_HITS_KEY) or 0
+    misses = cache.get(CATALOG_MISSES_KEY) or 0
+    return {
+        'version': get_catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+    }
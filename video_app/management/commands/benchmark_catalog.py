@@ -0,0 +1,87 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from video_app.api.pagination import VideoCursorPagination
+from video_app.models import Video
+
+
+class Command(BaseCommand):
+    help = ('Compare keyset and OFFSET pagination of the catalog at increasing page depths on a generated '
+            'catalog. The generated rows are rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of videos to generate.')
+        parser.add_argument('--page-size', type=int, default=24)
+        parser.add_argument('--pages', nargs='+', type=int, default=[1, 10, 100, 1000, 4000],
+                            help='Page numbers to time.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement; the median is reported.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options['rows'])
+            page_size = options['page_size']
+            ordered = Video.objects.order_by('-uploaded_at', '-id')
+            for page in options['pages']:
+                offset = (page - 1) * page_size
+                if offset >= options['rows']:
+                    continue
+                keyset = self.time(self.keyset_page(ordered, offset, page_size), options['repeat'])
+                by_offset = self.time(lambda: list(ordered[offset:offset + page_size]), options['repeat'])
+                self.stdout.write(f'page {page:6d}   keyset {keyset * 1000:8.2f} ms   offset {by_offset * 1000:8.2f} ms')
+            transaction.set_rollback(True)
+
+    def populate(self, rows):
+        """Insert the catalog in one statement with upload times already spread out.
+
+        Rewriting uploaded_at afterwards would leave a dead index entry per row at the newest end of
+        the index until the next VACUUM, which is not what a live catalog looks like.
+        """
+        start = time.perf_counter()
+        template = Video(file='videos/originals/benchmark.mp4')
+        columns, values, params = [], [], []
+        for field in Video._meta.concrete_fields:
+            if field.primary_key or field.generated:
+                continue
+            columns.append(connection.ops.quote_name(field.column))
+            if field.name == 'title':
+                values.append("'Benchmark ' || n")
+            elif field.name == 'uploaded_at':
+                # Three videos per minute, so the id tie-break is exercised.
+                values.append("%s - (n / 3) * INTERVAL '1 minute'")
+                params.append(timezone.now())
+            else:
+                values.append('%s')
+                params.append(field.get_db_prep_save(field.pre_save(template, True), connection))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {Video._meta.db_table} ({', '.join(columns)}) "
+                f"SELECT {', '.join(values)} FROM generate_series(1, %s) AS n",
+                params + [rows],
+            )
+            cursor.execute(f'ANALYZE {Video._meta.db_table}')
+        self.stdout.write(f'generated {rows} videos in {time.perf_counter() - start:.1f}s')
+
+    def keyset_page(self, ordered, offset, page_size):
+        """Build the cursor request for the page at offset up front so only the page query is timed."""
+        params = {'page_size': page_size}
+        if offset:
+            last = ordered.values_list('uploaded_at', 'id')[offset - 1]
+            params['cursor'] = VideoCursorPagination.encode_position(False, last)
+        request = Request(APIRequestFactory().get('/', params))
+        paginator = VideoCursorPagination()
+
+        def fetch():
+            return paginator.paginate_queryset(Video.objects.all(), request)
+        return fetch
+
+    def time(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
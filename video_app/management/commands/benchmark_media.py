@@ -0,0 +1,113 @@
+import os
+import shutil
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.views.static import serve
+from video_app.views import file_response
+
+MIB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of django.views.static.serve with the Range-aware media response, read in '
+            'Python and sent with os.sendfile as a wsgi.file_wrapper does, over a local socket.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=64, help='Size of the test file in MiB.')
+        parser.add_argument('--range', type=int, default=1, help='Size of the Range request in MiB.')
+        parser.add_argument('--repeat', type=int, default=10, help='Runs per measurement; the median is reported.')
+
+    def handle(self, *args, **options):
+        size = options['size'] * MIB
+        range_size = min(options['range'] * MIB, size)
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, 'segment.ts'), 'wb') as f:
+                f.write(os.urandom(size))
+            with override_settings(MEDIA_ROOT=root, MEDIA_DELIVERY='django'):
+                self.run(root, size, range_size, options['repeat'])
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    def run(self, root, size, range_size, repeat):
+        factory = RequestFactory()
+        full_path = os.path.join(root, 'segment.ts')
+        ranged = {'HTTP_RANGE': f'bytes={size - range_size}-'}
+
+        def static(**headers):
+            return serve(factory.get('/media/segment.ts', **headers), 'segment.ts', document_root=root)
+
+        def media(**headers):
+            return file_response(factory.get('/media/segment.ts', **headers), full_path, 'video/mp2t')
+
+        sink, source = socket.socketpair()
+        drain = threading.Thread(target=self.drain, args=(sink,), daemon=True)
+        drain.start()
+        try:
+            for label, build, send, expected in [
+                ('static.serve', static, self.send_iter, size),
+                ('media, read', media, self.send_iter, size),
+                ('media, sendfile', media, self.send_file, size),
+            ]:
+                seconds = self.time(lambda: self.expect(send(source, build()), expected), repeat)
+                self.stdout.write(f'{label:16} {size / MIB / seconds:9.1f} MiB/s')
+
+            self.stdout.write(f'Last {range_size // MIB} MiB of the file:')
+            for label, build, send, expected in [
+                ('static.serve', static, self.send_iter, size),
+                ('media, sendfile', media, self.send_file, range_size),
+            ]:
+                seconds = self.time(lambda: self.expect(send(source, build(**ranged)), expected), repeat)
+                self.stdout.write(f'{label:16} {seconds * 1000:9.2f} ms, {expected // MIB} MiB sent')
+        finally:
+            source.close()
+            drain.join()
+            sink.close()
+
+    @staticmethod
+    def drain(sink):
+        buffer = bytearray(MIB)
+        while sink.recv_into(buffer):
+            pass
+
+    @staticmethod
+    def send_iter(sock, response):
+        sent = 0
+        for chunk in response.streaming_content:
+            sock.sendall(chunk)
+            sent += len(chunk)
+        response.close()
+        return sent
+
+    @staticmethod
+    def send_file(sock, response):
+        # What gunicorn's wsgi.file_wrapper does: send from the file offset up to Content-Length.
+        fileno = response.file_to_stream.fileno()
+        offset = os.lseek(fileno, 0, os.SEEK_CUR)
+        remaining = int(response['Content-Length'])
+        sent = 0
+        while sent < remaining:
+            count = os.sendfile(sock.fileno(), fileno, offset + sent, remaining - sent)
+            if not count:
+                break
+            sent += count
+        response.close()
+        return sent
+
+    @staticmethod
+    def expect(sent, expected):
+        if sent != expected:
+            raise CommandError(f'Sent {sent} bytes, expected {expected}.')
+
+    def time(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
@@ -0,0 +1,69 @@
+import statistics
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from video_app.api.serializers import VIDEO_LIST_VALUES, VideoListSerializer, video_list_data
+from video_app.models import Video
+
+
+class Command(BaseCommand):
+    help = ('Compare the cost of building the catalog list payload with VideoListSerializer and with the '
+            'values() fast path, per 1000 videos. Works on in-memory rows, so no database rows are needed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--videos', type=int, default=1000, help='Number of videos per run.')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement; the median is reported.')
+
+    def handle(self, *args, **options):
+        count = options['videos']
+        request = Request(APIRequestFactory().get('/videoflix/api/videos/', HTTP_HOST=settings.ALLOWED_HOSTS[0]))
+        instances = self.make_videos(count)
+        rows = [{name: getattr(video, name) for name in VIDEO_LIST_VALUES} for video in instances]
+        for row, video in zip(rows, instances):
+            for name in ('file', 'thumbnail', 'hls_master_playlist'):
+                row[name] = getattr(video, name).name
+
+        def serializer():
+            return VideoListSerializer(instances, many=True,
+                                       context={'request': request, 'omit_user_progress': True}).data
+
+        def fast_path():
+            return video_list_data(rows, request)
+
+        if JSONRenderer().render(serializer()) != JSONRenderer().render(fast_path()):
+            raise CommandError('The fast path output differs from VideoListSerializer.')
+
+        per_thousand = 1000 / count
+        slow = self.time(serializer, options['repeat']) * per_thousand
+        fast = self.time(fast_path, options['repeat']) * per_thousand
+        self.stdout.write(f'serializer {slow * 1000:8.2f} ms / 1k videos')
+        self.stdout.write(f'fast path  {fast * 1000:8.2f} ms / 1k videos   ({slow / fast:.1f}x)')
+
+    def make_videos(self, count):
+        now = timezone.now()
+        return [
+            Video(
+                id=n,
+                title=f'Benchmark {n}',
+                file=f'videos/originals/benchmark_{n}.mp4',
+                thumbnail=f'thumbnails/{n}_thumb.jpg',
+                description='A generated video for the serialization benchmark.',
+                hls_master_playlist=f'videos/hls/{n}/master.m3u8' if n % 10 else None,
+                genre='Action',
+                uploaded_at=now - timedelta(minutes=n),
+            )
+            for n in range(1, count + 1)
+        ]
+
+    def time(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
@@ -0,0 +1,89 @@
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from video_app.transcoding import ENCODERS, get_ffmpeg_path, probe_source, storyboard_tile_size
+
+
+class Command(BaseCommand):
+    help = ('Compare wall-clock time, CPU seconds and on-disk layout (file count, bytes, delete time) '
+            'of the HLS encode modes on a generated test clip.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=int, default=30, help='Length of the test clip in seconds.')
+        parser.add_argument('--size', default='1920x1080', help='Resolution of the test clip.')
+        parser.add_argument('--modes', nargs='+', default=list(ENCODERS), choices=list(ENCODERS))
+        parser.add_argument('--segment-formats', nargs='+', choices=['ts', 'fmp4'],
+                            default=[settings.HLS_SEGMENT_FORMAT])
+        parser.add_argument('--input', help='Benchmark an existing file instead of a generated clip.')
+        parser.add_argument('--workers', nargs='+', type=int, default=[1, os.cpu_count()],
+                            help='Worker counts to try in chunked mode.')
+        parser.add_argument('--chunk-duration', type=int, help='Chunk length in seconds for chunked mode.')
+
+    def handle(self, *args, **options):
+        work_dir = tempfile.mkdtemp(prefix='videoflix-bench-')
+        try:
+            input_file = options['input'] or self.generate_clip(work_dir, options['duration'], options['size'])
+            source = probe_source(input_file)
+            self.tile_size = storyboard_tile_size(source['width'], source['height'])
+            for segment_format in options['segment_formats']:
+                with override_settings(HLS_SEGMENT_FORMAT=segment_format):
+                    for mode in options['modes']:
+                        if mode == 'chunked':
+                            self.run_chunked(input_file, work_dir, options['workers'], options['chunk_duration'])
+                            continue
+                        self.report(f'{mode} {segment_format}', *self.run_mode(mode, input_file, work_dir))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def generate_clip(self, work_dir, duration, size):
+        clip = os.path.join(work_dir, 'clip.mp4')
+        subprocess.run([
+            get_ffmpeg_path(), '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30',
+            '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+            '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac',
+            clip
+        ], check=True)
+        return clip
+
+    def run_chunked(self, input_file, work_dir, worker_counts, chunk_duration):
+        baseline = None
+        for workers in sorted(set(worker_counts)):
+            result = self.run_mode('chunked', input_file, work_dir, workers=workers, chunk_duration=chunk_duration)
+            baseline = baseline or result[0]
+            self.report(f'chunked x{workers}', *result, speedup=baseline / result[0])
+
+    def run_mode(self, mode, input_file, work_dir, **kwargs):
+        output_dir = tempfile.mkdtemp(prefix=f'{mode}-', dir=work_dir)
+        thumbnail_path = os.path.join(work_dir, f'{os.path.basename(output_dir)}.jpg')
+
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        ENCODERS[mode](input_file, output_dir, thumbnail_path, tile_size=self.tile_size, **kwargs)
+        wall = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+        return (wall, cpu) + self.measure_layout(output_dir)
+
+    def measure_layout(self, output_dir):
+        """Count and size the output files, then time deleting them the way a video delete does."""
+        files = size = 0
+        for entry in os.scandir(output_dir):
+            files += 1
+            size += entry.stat().st_size
+        start = time.perf_counter()
+        shutil.rmtree(output_dir)
+        return files, size, time.perf_counter() - start
+
+    def report(self, label, wall, cpu, files, size, delete, speedup=None):
+        line = (f'{label:<18} wall {wall:8.2f}s   cpu {cpu:8.2f}s   files {files:6d}   '
+                f'disk {size / 1e6:9.2f} MB   delete {delete * 1000:8.2f} ms')
+        if speedup is not None:
+            line += f'   speedup {speedup:5.2f}x'
+        self.stdout.write(line)
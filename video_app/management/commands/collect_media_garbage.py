@@ -0,0 +1,81 @@
+import re
+import time
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from video_app.models import Video
+
+MIB = 1024 * 1024
+HLS_FOLDER = re.compile(r'^videos/hls/(\d+)/')
+
+
+class Command(BaseCommand):
+    help = ('Delete media files under videos/hls, videos/originals and thumbnails that no Video refers to. '
+            'Files are listed as a stream and checked and deleted in batches, so memory does not grow with '
+            'the size of the media store.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted, delete nothing.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Files checked and deleted per batch.')
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='Hours a file must be untouched before it is collected; younger files may '
+                                 'belong to an upload or transcode whose row is not committed yet.')
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options['min_age'] * 60 * 60
+        total_files = total_bytes = 0
+        for prefix, find_orphans in [
+            ('videos/hls/', self.orphaned_hls_files),
+            ('videos/originals/', self.orphaned_originals),
+            ('thumbnails/', self.orphaned_thumbnails),
+        ]:
+            files = size = 0
+            for batch in self.batches(default_storage.iter_files(prefix), cutoff, options['batch_size']):
+                orphans = find_orphans(batch)
+                if orphans and not options['dry_run']:
+                    default_storage.delete_many(list(orphans))
+                files += len(orphans)
+                size += sum(orphans.values())
+            self.stdout.write(f'{prefix:18} {files:8} files {size / MIB:10.1f} MiB')
+            total_files += files
+            total_bytes += size
+
+        verb = 'Would free' if options['dry_run'] else 'Freed'
+        self.stdout.write(f'{verb} {total_bytes} bytes in {total_files} files.')
+
+    @staticmethod
+    def batches(files, cutoff, batch_size):
+        batch = {}
+        for name, size, modified in files:
+            if modified < cutoff:
+                batch[name] = size
+            if len(batch) == batch_size:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+
+    @staticmethod
+    def orphans(batch, referenced):
+        return {name: size for name, size in batch.items() if name not in referenced}
+
+    def orphaned_hls_files(self, batch):
+        """HLS output belongs to the video of its folder; files uploaded straight into videos/hls/ by name."""
+        folders = {name: int(match.group(1)) for name in batch if (match := HLS_FOLDER.match(name))}
+        existing = set(Video.objects.filter(id__in=set(folders.values())).values_list('id', flat=True))
+        loose = [name for name in batch if name not in folders]
+        referenced = {name for name, video_id in folders.items() if video_id in existing}
+        if loose:
+            for playlist, storyboard in Video.objects.filter(
+                Q(hls_master_playlist__in=loose) | Q(storyboard_vtt__in=loose)
+            ).values_list('hls_master_playlist', 'storyboard_vtt'):
+                referenced.update((playlist, storyboard))
+        return self.orphans(batch, referenced)
+
+    def orphaned_originals(self, batch):
+        return self.orphans(batch, set(Video.objects.filter(file__in=list(batch)).values_list('file', flat=True)))
+
+    def orphaned_thumbnails(self, batch):
+        return self.orphans(batch, set(
+            Video.objects.filter(thumbnail__in=list(batch)).values_list('thumbnail', flat=True)
+        ))
@@ -0,0 +1,152 @@
+import mimetypes
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+import logging
+logger = logging.getLogger(__name__)
+
+# mimetypes maps .ts to Qt Linguist files.
+MEDIA_CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.mpd': 'application/dash+xml',
+    '.vtt': 'text/vtt',
+}
+
+
+def media_content_type(path):
+    extension = os.path.splitext(path)[1].lower()
+    return MEDIA_CONTENT_TYPES.get(extension) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst so reused output costs no extra disk, copying when linking is not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class LocalMediaStorage(FileSystemStorage):
+    """Media under MEDIA_ROOT, on one node or on a volume every web and worker node mounts.
+
+    Besides the Storage API it offers the calls workers need to store whole directories of encoder
+    output, which the S3 backend in video_app.s3_storage implements against a bucket.
+    """
+
+    def save_local_file(self, local_path, name):
+        """Store a local file under exactly name, replacing what is there, and remove the local file."""
+        path = self.path(name)
+        if os.path.abspath(local_path) != path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.move(local_path, path)
+        return name
+
+    def copy(self, source_name, name):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_or_copy(self.path(source_name), path)
+
+    def copy_prefix(self, source_prefix, prefix):
+        shutil.copytree(self.path(source_prefix), self.path(prefix), copy_function=link_or_copy, dirs_exist_ok=True)
+
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self.path(prefix), ignore_errors=True)
+
+    def iter_files(self, prefix):
+        """Yield (name, size, modified timestamp) of every file below prefix, one directory at a time."""
+        pending = [self.path(prefix)]
+        while pending:
+            try:
+                entries = os.scandir(pending.pop())
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        name = os.path.relpath(entry.path, self.location).replace(os.sep, '/')
+                        yield name, stat.st_size, stat.st_mtime
+
+    def delete_many(self, names):
+        """Delete files and then every directory they leave empty."""
+        directories = set()
+        for name in names:
+            self.delete(name)
+            directories.add(os.path.dirname(self.path(name)))
+        # Deepest first, so a parent is only tried once its children are gone.
+        for directory in sorted(directories, key=len, reverse=True):
+            while directory != self.location:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
+
+
+def is_local_storage():
+    return isinstance(default_storage, FileSystemStorage)
+
+
+def media_work_root():
+    """Return where workers write encoder output: MEDIA_ROOT itself when media is stored locally."""
+    return settings.MEDIA_ROOT if is_local_storage() else settings.MEDIA_WORK_ROOT
+
+
+def media_location(name):
+    """Return a path or URL ffprobe and ffmpeg can read a stored file from without copying it first."""
+    return default_storage.path(name) if is_local_storage() else default_storage.url(name)
+
+
+def local_media_path(name):
+    """Return a local path of a stored file, downloading it into MEDIA_WORK_ROOT if storage is remote.
+
+    A copy that is already there is reused, so retries and the tasks of one chord download a source once.
+    Tasks that start together each download into their own partial file, and the last one to finish
+    replaces the others' identical copy.
+    """
+    if is_local_storage():
+        return default_storage.path(name)
+    path = os.path.join(settings.MEDIA_WORK_ROOT, name)
+    if not os.path.isfile(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.download'
+        try:
+            default_storage.download(name, partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    return path
+
+
+def discard_local_copy(name):
+    if not is_local_storage():
+        try:
+            os.remove(os.path.join(settings.MEDIA_WORK_ROOT, name))
+        except FileNotFoundError:
+            pass
+
+
+def run_bounded(function, items):
+    """Call function on every item with at most MEDIA_UPLOAD_WORKERS calls in flight, re-raising the first error."""
+    with ThreadPoolExecutor(max_workers=settings.MEDIA_UPLOAD_WORKERS) as pool:
+        return list(pool.map(function, items))
+
+
+def store_directory(local_dir, prefix):
+    """Move every file below local_dir into storage under prefix and return how many there were."""
+    files = []
+    for root, _, names in os.walk(local_dir):
+        for file_name in names:
+            path = os.path.join(root, file_name)
+            files.append((path, prefix + os.path.relpath(path, local_dir).replace(os.sep, '/')))
+    run_bounded(lambda item: default_storage.save_local_file(*item), files)
+    return len(files)
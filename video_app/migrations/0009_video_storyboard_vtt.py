@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0008_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='storyboard_vtt',
+            field=models.FileField(blank=True, null=True, upload_to='videos/hls/'),
+        ),
+    ]
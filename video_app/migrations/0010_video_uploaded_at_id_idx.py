@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0009_video_storyboard_vtt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['uploaded_at', 'id'], name='video_uploaded_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0010_video_uploaded_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(('is_featured', True)), fields=['uploaded_at', 'id'], name='video_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(('is_trending', True)), fields=['uploaded_at', 'id'], name='video_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(('is_new', True)), fields=['uploaded_at', 'id'], name='video_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(('genre', ''), _negated=True), fields=['genre', 'uploaded_at', 'id'], name='video_genre_uploaded_at_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def delete_duplicate_progress(apps, schema_editor):
+    """Keep only the most recently updated progress row of each user and video."""
+    UserVideoProgress = apps.get_model('video_app', 'UserVideoProgress')
+    latest = UserVideoProgress.objects.filter(
+        user_id=OuterRef('user_id'), video_id=OuterRef('video_id')
+    ).order_by('-last_viewed_at', '-id').values('id')[:1]
+    UserVideoProgress.objects.exclude(id=Subquery(latest)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0012_video_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_progress, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='uservideoprogress',
+            constraint=models.UniqueConstraint(fields=('user', 'video'), name='unique_user_video_progress'),
+        ),
+    ]
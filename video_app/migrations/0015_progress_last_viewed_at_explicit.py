@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 21:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0014_progress_continue_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uservideoprogress',
+            name='last_viewed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
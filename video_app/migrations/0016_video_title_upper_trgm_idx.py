@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 21:10
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0015_progress_last_viewed_at_explicit'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='gin_trgm_ops'), name='video_title_upper_trgm_idx'),
+        ),
+    ]
@@ -1,5 +1,12 @@
 from django.db import models
+import uuid
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+SEARCH_CONFIG = 'english'
 
 
 class Video(models.Model):
@@ -8,23 +15,123 @@ class Video(models.Model):
     thumbnail = models.FileField(upload_to='thumbnails/', blank=True, null=True)  
     description = models.TextField(blank=True)
     hls_master_playlist = models.FileField(upload_to='videos/hls/', blank=True, null=True)
+    storyboard_vtt = models.FileField(upload_to='videos/hls/', blank=True, null=True)
     genre = models.CharField(max_length=50, blank=True)
     is_featured = models.BooleanField(default=False)  
     is_trending = models.BooleanField(default=False)  
     is_new = models.BooleanField(default=False)       
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    frame_rate = models.FloatField(blank=True, null=True)
+    duration = models.FloatField(blank=True, null=True)
+    audio_channels = models.PositiveSmallIntegerField(blank=True, null=True)
+    audio_layout = models.CharField(max_length=50, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # Kept up to date by Postgres on every write, so searches never build a tsvector per row.
+    search_vector = models.GeneratedField(
+        expression=SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('genre', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the catalog walks this index in (uploaded_at, id) order.
+            models.Index(fields=['uploaded_at', 'id'], name='video_uploaded_at_id_idx'),
+            # Home-screen rails only ever read the few flagged rows, newest first.
+            models.Index(fields=['uploaded_at', 'id'], condition=models.Q(is_featured=True),
+                         name='video_featured_idx'),
+            models.Index(fields=['uploaded_at', 'id'], condition=models.Q(is_trending=True),
+                         name='video_trending_idx'),
+            models.Index(fields=['uploaded_at', 'id'], condition=models.Q(is_new=True),
+                         name='video_new_idx'),
+            models.Index(fields=['genre', 'uploaded_at', 'id'], condition=~models.Q(genre=''),
+                         name='video_genre_uploaded_at_idx'),
+            GinIndex(fields=['search_vector'], name='video_search_vector_idx'),
+            # Typo-tolerant title matches (%> and <%).
+            GinIndex(OpClass('title', name='gin_trgm_ops'), name='video_title_trgm_idx'),
+            # The admin's title__icontains, which Django writes as UPPER(title) LIKE UPPER('%...%').
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='video_title_upper_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def is_probed(self):
+        return self.duration is not None
+
 class UserVideoProgress(models.Model):
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='video_progress')
     video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='user_progress')
     last_viewed_position = models.FloatField(default=0.0) 
     viewed = models.BooleanField(default=False)
-    last_viewed_at = models.DateTimeField(auto_now=True)
+    # Set by whoever writes the row: buffered heartbeats are flushed later with the time they arrived.
+    last_viewed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # Progress is upserted in bulk from the Redis buffer, which needs a conflict target.
+            models.UniqueConstraint(fields=['user', 'video'], name='unique_user_video_progress'),
+        ]
+        indexes = [
+            # "Continue watching" reads a user's unfinished rows newest first straight off this index.
+            models.Index(fields=['user', 'viewed', '-last_viewed_at'], name='progress_continue_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.video.title}"
 
+class TranscodeJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILURE = 'failure'
+    STATE_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCESS, 'Success'),
+        (FAILURE, 'Failure'),
+    ]
+
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='transcode_jobs')
+    task_id = models.CharField(max_length=255, unique=True)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=PENDING)
+    stage_timings = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        get_latest_by = 'created_at'
+
+    def __str__(self):
+        return f"{self.video.title} - {self.state}"
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    title = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    genre = models.CharField(max_length=50, blank=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    # Lease of the chunk being streamed, so the row is locked only to claim it and not for the whole body.
+    writing_until = models.DateTimeField(null=True, blank=True)
+    # Set while a worker stores the finished file; video is the result, for clients polling the session.
+    finalizing = models.BooleanField(default=False)
+    video = models.OneToOneField(Video, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} - {self.offset}/{self.size}"
 
+    @property
+    def is_complete(self):
+        return self.offset == self.size
@@ -0,0 +1,159 @@
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.contrib.auth.models import User
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+from video_app.models import UserVideoProgress, Video
+import logging
+logger = logging.getLogger(__name__)
+
+PROGRESS_KEY = 'progress:{}:{}'
+PROGRESS_RECENT_KEY = 'progress-recent:{}'
+PROGRESS_DIRTY_KEY = 'progress:dirty'
+PROGRESS_FLUSHING_KEY = 'progress:flushing'
+FLUSH_BATCH_SIZE = 1000
+
+
+def get_redis():
+    return get_redis_connection('default')
+
+
+def decode_progress(raw):
+    if not raw:
+        return None
+    return {
+        'last_viewed_position': float(raw[b'last_viewed_position']),
+        'viewed': raw[b'viewed'] == b'1',
+        'last_viewed_at': float(raw[b'last_viewed_at']),
+    }
+
+
+def get_progress(user_id, video_id):
+    """Return the progress of a user on a video, buffered state first, or None if there is none yet."""
+    state = decode_progress(get_redis().hgetall(PROGRESS_KEY.format(user_id, video_id)))
+    if state is not None:
+        return state
+    row = UserVideoProgress.objects.filter(user_id=user_id, video_id=video_id).first()
+    if row is None:
+        return None
+    return {
+        'last_viewed_position': row.last_viewed_position,
+        'viewed': row.viewed,
+        'last_viewed_at': row.last_viewed_at.timestamp(),
+    }
+
+
+def buffer_progress(user_id, video_id, state):
+    """Record the full progress state of a user on a video in Redis and mark it for the next flush."""
+    now = time.time()
+    key = PROGRESS_KEY.format(user_id, video_id)
+    with get_redis().pipeline() as pipe:
+        pipe.hset(key, mapping={
+            'last_viewed_position': repr(float(state['last_viewed_position'])),
+            'viewed': int(state['viewed']),
+            'last_viewed_at': repr(now),
+        })
+        pipe.expire(key, settings.PROGRESS_BUFFER_TTL)
+        # The videos of a user still in the buffer, by time of the last heartbeat.
+        recent = PROGRESS_RECENT_KEY.format(user_id)
+        pipe.zadd(recent, {video_id: now})
+        pipe.zremrangebyscore(recent, '-inf', now - settings.PROGRESS_BUFFER_TTL)
+        pipe.expire(recent, settings.PROGRESS_BUFFER_TTL)
+        pipe.sadd(PROGRESS_DIRTY_KEY, f'{user_id}:{video_id}')
+        pipe.execute()
+    return dict(state, last_viewed_at=now)
+
+
+def read_buffered_progress(user_id, video_ids):
+    """Return {video_id: state} for the entries of a user still in the buffer, in one round trip."""
+    with get_redis().pipeline(transaction=False) as pipe:
+        for video_id in video_ids:
+            pipe.hgetall(PROGRESS_KEY.format(user_id, video_id))
+        results = pipe.execute()
+    return {
+        video_id: decode_progress(raw) for video_id, raw in zip(video_ids, results) if raw
+    }
+
+
+def read_recent_progress(user_id):
+    """Return {video_id: state} for every video the user sent progress for within the buffer TTL."""
+    video_ids = [int(video_id) for video_id in get_redis().zrange(PROGRESS_RECENT_KEY.format(user_id), 0, -1)]
+    return read_buffered_progress(user_id, video_ids) if video_ids else {}
+
+
+def get_buffered_stamp(user_id, video_id=None):
+    """Return when the user last sent progress, for one video or any, as a timestamp, or 0."""
+    redis = get_redis()
+    if video_id is None:
+        latest = redis.zrevrange(PROGRESS_RECENT_KEY.format(user_id), 0, 0, withscores=True)
+        return latest[0][1] if latest else 0
+    stamp = redis.hget(PROGRESS_KEY.format(user_id, video_id), 'last_viewed_at')
+    return float(stamp) if stamp else 0
+
+
+def flush_progress_buffer():
+    """Upsert every entry that changed since the last flush into Postgres and return how many were written.
+
+    The dirty set is renamed before it is read, so a heartbeat arriving mid-flush marks its entry for
+    the next run. A flush that fails leaves its set in place and the next run picks it up again. The
+    entries themselves stay in Redis until they expire, so reads keep being served from the buffer.
+    """
+    redis = get_redis()
+    if not redis.exists(PROGRESS_FLUSHING_KEY):
+        try:
+            redis.rename(PROGRESS_DIRTY_KEY, PROGRESS_FLUSHING_KEY)
+        except ResponseError:
+            return 0
+
+    pairs = [tuple(int(part) for part in member.split(b':')) for member in redis.smembers(PROGRESS_FLUSHING_KEY)]
+    with redis.pipeline(transaction=False) as pipe:
+        for user_id, video_id in pairs:
+            pipe.hgetall(PROGRESS_KEY.format(user_id, video_id))
+        states = [decode_progress(raw) for raw in pipe.execute()]
+
+    # Videos and users deleted since their heartbeat would fail the whole batch on the foreign keys.
+    video_ids = set(Video.objects.filter(id__in={v for _, v in pairs}).values_list('id', flat=True))
+    user_ids = set(User.objects.filter(id__in={u for u, _ in pairs}).values_list('id', flat=True))
+    rows = [
+        UserVideoProgress(user_id=user_id, video_id=video_id, last_viewed_position=state['last_viewed_position'],
+                          viewed=state['viewed'],
+                          last_viewed_at=datetime.fromtimestamp(state['last_viewed_at'], tz=timezone.utc))
+        for (user_id, video_id), state in zip(pairs, states)
+        if state is not None and user_id in user_ids and video_id in video_ids
+    ]
+    UserVideoProgress.objects.bulk_create(
+        rows,
+        batch_size=FLUSH_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user', 'video'],
+        update_fields=['last_viewed_position', 'viewed', 'last_viewed_at'],
+    )
+    redis.delete(PROGRESS_FLUSHING_KEY)
+    return len(rows)
+
+
+def continue_watching(user_id, limit):
+    """Return [(video_id, state)] of the videos the user started but has not finished, most recent first.
+
+    Stored rows are read newest first from the (user, viewed, last_viewed_at) index, so the cost depends
+    on limit and not on the size of the catalog or the user's history. Buffered entries are newer and
+    replace them, including entries that were just marked viewed, which is why a few extra rows are read.
+    """
+    buffered = read_recent_progress(user_id) if settings.PROGRESS_WRITE_BEHIND else {}
+    rows = (
+        UserVideoProgress.objects.filter(user_id=user_id, viewed=False, last_viewed_position__gt=0)
+        .order_by('-last_viewed_at')
+        .values_list('video_id', 'last_viewed_position', 'last_viewed_at')[:limit + len(buffered)]
+    )
+    progress = {
+        video_id: {'last_viewed_position': position, 'viewed': False, 'last_viewed_at': last_viewed_at.timestamp()}
+        for video_id, position, last_viewed_at in rows
+    }
+    progress.update(buffered)
+    started = [
+        (video_id, state) for video_id, state in progress.items()
+        if not state['viewed'] and state['last_viewed_position'] > 0
+    ]
+    started.sort(key=lambda entry: entry[1]['last_viewed_at'], reverse=True)
+    return started[:limit]
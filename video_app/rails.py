@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from video_app.catalog_cache import get_catalog_version
+from video_app.models import Video
+
+HOME_RAILS_KEY = 'home-rails:{}'
+RAIL_FLAGS = ['featured', 'trending', 'new']
+
+
+def build_home_rails(limit):
+    """Return the video ids of every home-screen rail, newest first and at most limit per rail.
+
+    The flag rails read the partial indexes on is_featured/is_trending/is_new, the genre rails rank
+    the rows of each genre in one window query over the (genre, uploaded_at, id) index.
+    """
+    newest_first = [F('uploaded_at').desc(), F('id').desc()]
+    rails = {
+        flag: list(Video.objects.filter(**{f'is_{flag}': True}).order_by(*newest_first)
+                   .values_list('id', flat=True)[:limit])
+        for flag in RAIL_FLAGS
+    }
+    ranked = (
+        Video.objects.exclude(genre='')
+        .annotate(rank=Window(RowNumber(), partition_by=F('genre'), order_by=newest_first))
+        .filter(rank__lte=limit)
+        .order_by('genre', 'rank')
+        .values_list('genre', 'id')
+    )
+    genres = {}
+    for genre, video_id in ranked:
+        genres.setdefault(genre, []).append(video_id)
+    rails['genres'] = list(genres.items())
+    return rails
+
+
+def materialize_home_rails():
+    version = get_catalog_version()
+    rails = build_home_rails(settings.HOME_RAIL_SIZE)
+    cache.set(HOME_RAILS_KEY.format(version), rails, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return rails
+
+
+def get_home_rails():
+    """Return the rails materialized for the current catalog version, building them if the task has not yet."""
+    rails = cache.get(HOME_RAILS_KEY.format(get_catalog_version()))
+    if rails is None:
+        rails = materialize_home_rails()
+    return rails
@@ -0,0 +1,81 @@
+import os
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+from video_app.media_storage import media_content_type, run_bounded
+
+# The most keys S3 deletes in one request.
+DELETE_BATCH_SIZE = 1000
+
+
+class S3MediaStorage(S3Storage):
+    """Media in an S3-compatible bucket (AWS, MinIO, Ceph), so web and worker nodes share no disk.
+
+    Files above MEDIA_MULTIPART_THRESHOLD go up and down as multipart transfers. The calls run on
+    the boto3 client of the calling thread, which, unlike the bucket resource, is safe to use from
+    the threads of store_directory.
+    """
+
+    def get_default_settings(self):
+        return {
+            **super().get_default_settings(),
+            # An upload with the name of an existing original gets a new name instead of replacing it.
+            'file_overwrite': False,
+            'transfer_config': TransferConfig(
+                multipart_threshold=settings.MEDIA_MULTIPART_THRESHOLD,
+                multipart_chunksize=settings.MEDIA_MULTIPART_CHUNK_SIZE,
+                max_concurrency=settings.MEDIA_MULTIPART_CONCURRENCY,
+            ),
+        }
+
+    @property
+    def client(self):
+        return self.connection.meta.client
+
+    def key(self, name):
+        return self._normalize_name(clean_name(name))
+
+    def prefix_key(self, prefix):
+        return self.key(prefix).rstrip('/') + '/'
+
+    def save_local_file(self, local_path, name):
+        """Upload a local file under exactly name, replacing what is there, and remove the local file."""
+        extra_args = {**self._get_write_parameters(name), 'ContentType': media_content_type(name)}
+        self.client.upload_file(local_path, self.bucket_name, self.key(name), ExtraArgs=extra_args,
+                                Config=self.transfer_config)
+        os.remove(local_path)
+        return name
+
+    def download(self, name, local_path):
+        self.client.download_file(self.bucket_name, self.key(name), local_path, Config=self.transfer_config)
+
+    def copy_key(self, source_key, key):
+        self.client.copy({'Bucket': self.bucket_name, 'Key': source_key}, self.bucket_name, key,
+                         Config=self.transfer_config)
+
+    def copy(self, source_name, name):
+        self.copy_key(self.key(source_name), self.key(name))
+
+    def copy_prefix(self, source_prefix, prefix):
+        """Copy every object below source_prefix inside the bucket, without sending the bytes through the worker."""
+        source, destination = self.prefix_key(source_prefix), self.prefix_key(prefix)
+        keys = [obj.key for obj in self.bucket.objects.filter(Prefix=source)]
+        run_bounded(lambda key: self.copy_key(key, destination + key[len(source):]), keys)
+
+    def iter_files(self, prefix):
+        """Yield (name, size, modified timestamp) of every object below prefix, one listing page at a time."""
+        location = self.prefix_key('') if self.location else ''
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket_name,
+                                                                         Prefix=self.prefix_key(prefix)):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(location):], obj['Size'], obj['LastModified'].timestamp()
+
+    def delete_many(self, names):
+        for start in range(0, len(names), DELETE_BATCH_SIZE):
+            keys = [{'Key': self.key(name)} for name in names[start:start + DELETE_BATCH_SIZE]]
+            self.client.delete_objects(Bucket=self.bucket_name, Delete={'Objects': keys, 'Quiet': True})
+
+    def delete_prefix(self, prefix):
+        # Deletes in batches of up to 1000 keys per request.
+        self.bucket.objects.filter(Prefix=self.prefix_key(prefix)).delete()
@@ -0,0 +1,25 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import F, Q
+from video_app.models import SEARCH_CONFIG
+
+SEARCH_MAX_LENGTH = 200
+
+
+def search_filter(terms):
+    """Match the stored search vector, or a title that is a close trigram match for typos like "matrx".
+
+    Both sides are served by a GIN index, so Postgres combines two bitmap index scans instead of
+    scanning the table.
+    """
+    query = SearchQuery(terms, search_type='websearch', config=SEARCH_CONFIG)
+    return Q(search_vector=query) | Q(title__trigram_word_similar=terms)
+
+
+def search_videos(queryset, terms):
+    """Return the videos matching terms, best match first."""
+    query = SearchQuery(terms, search_type='websearch', config=SEARCH_CONFIG)
+    return (
+        queryset.filter(search_filter(terms))
+        .annotate(score=SearchRank(F('search_vector'), query) + TrigramWordSimilarity(terms, 'title'))
+        .order_by('-score', '-id')
+    )
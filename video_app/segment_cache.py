@@ -0,0 +1,195 @@
+import hashlib
+import os
+import shutil
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from video_app.catalog_cache import count
+from video_app.media_storage import is_local_storage
+
+SEGMENT_CACHE_PREFIX = 'videos/hls/'
+PINNED_EXTENSIONS = ('.m3u8',)
+SEGMENT_CACHE_HITS_KEY = 'segment-cache:hits'
+SEGMENT_CACHE_MISSES_KEY = 'segment-cache:misses'
+SEGMENT_CACHE_EVICTIONS_KEY = 'segment-cache:evictions'
+SEGMENT_CACHE_SERVED_KEY = 'segment-cache:bytes-served'
+# The copies live in the shared memory of one node, so their size is counted per node.
+SEGMENT_CACHE_SIZE_KEY = 'segment-cache:{}:bytes'
+SEGMENT_CACHE_EVICT_LOCK_KEY = 'segment-cache:{}:evicting'
+# Evict down to this share of SEGMENT_CACHE_SIZE, so not every miss starts an eviction.
+EVICT_TO = 0.9
+COPY_SIZE = 1024 * 1024
+
+# Hits, misses and bytes served are added up in each process and sent to the cache every
+# SEGMENT_CACHE_STATS_INTERVAL seconds, so a hit costs no round trip to Redis.
+_pending_stats = {}
+_pending_stats_lock = threading.Lock()
+_stats_flushed_at = 0.0
+
+
+def node_key(key):
+    return key.format(socket.gethostname())
+
+
+def source_version(name):
+    """Return (version, size, mtime in ns) of the stored file behind name, or None if it does not exist.
+
+    Local files are checked on every request, since a stat costs no disk read. A bucket has no cheap
+    stat: segments never change under their name, and playlists get a new version every
+    SEGMENT_CACHE_PLAYLIST_TTL seconds, which covers a video being transcoded again.
+    """
+    if is_local_storage():
+        try:
+            stat = os.stat(default_storage.path(name))
+        except FileNotFoundError:
+            return None
+        return f'{stat.st_mtime_ns}:{stat.st_size}', stat.st_size, stat.st_mtime_ns
+    if name.endswith(PINNED_EXTENSIONS):
+        return str(int(time.time()) // settings.SEGMENT_CACHE_PLAYLIST_TTL), None, None
+    return '', None, None
+
+
+def entry_path(name, version):
+    source = f'{default_storage.location}:{getattr(default_storage, "bucket_name", "")}:{name}:{version}'
+    digest = hashlib.sha1(source.encode()).hexdigest()
+    return os.path.join(settings.SEGMENT_CACHE_DIR, digest + os.path.splitext(name)[1].lower())
+
+
+def cached_media_path(name):
+    """Return the path of a copy of the HLS file name in this node's shared memory, or None to skip the cache.
+
+    SEGMENT_CACHE_DIR is meant to be a tmpfs such as /dev/shm, so every worker process on the node
+    shares one copy and sendfile sends it straight from memory. A hit marks the copy as recently used
+    through its access time; the modification time stays that of the source, for Last-Modified. A
+    miss copies the file in and evicts the least recently used copies once the node holds more than
+    SEGMENT_CACHE_SIZE bytes. Files that are missing or larger than SEGMENT_CACHE_MAX_FILE_SIZE are
+    not cached. Segments only go through here with MEDIA_DELIVERY 'django'; with the default
+    'x-accel' only signed playlists do.
+    """
+    if settings.SEGMENT_CACHE_SIZE <= 0 or not name.startswith(SEGMENT_CACHE_PREFIX):
+        return None
+    source = source_version(name)
+    if source is None:
+        return None
+    version, size, modified = source
+    path = entry_path(name, version)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        pass
+    else:
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        count_stat(SEGMENT_CACHE_HITS_KEY)
+        return path
+
+    count_stat(SEGMENT_CACHE_MISSES_KEY)
+    if size is None:
+        try:
+            size = default_storage.size(name)
+        except FileNotFoundError:
+            return None
+    if size > settings.SEGMENT_CACHE_MAX_FILE_SIZE:
+        return None
+    os.makedirs(settings.SEGMENT_CACHE_DIR, exist_ok=True)
+    partial = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        with default_storage.open(name) as source_file, open(partial, 'wb') as f:
+            shutil.copyfileobj(source_file, f, COPY_SIZE)
+        if modified is not None:
+            os.utime(partial, ns=(time.time_ns(), modified))
+        os.replace(partial, path)
+    except FileNotFoundError:
+        return None
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    if count(node_key(SEGMENT_CACHE_SIZE_KEY), size) > settings.SEGMENT_CACHE_SIZE:
+        evict_segments()
+    return path
+
+
+def evict_segments():
+    """Delete the least recently used copies until the node is below EVICT_TO of SEGMENT_CACHE_SIZE.
+
+    Small playlists are pinned: they are only evicted once no segment is left. The directory is
+    measured while evicting and the size counter reset from it, so copies two processes added at
+    once, or a tmpfs cleared by a reboot, do not leave the counter wrong.
+    """
+    lock = node_key(SEGMENT_CACHE_EVICT_LOCK_KEY)
+    if not cache.add(lock, 1, timeout=60):
+        return 0
+    try:
+        entries = []
+        with os.scandir(settings.SEGMENT_CACHE_DIR) as it:
+            for entry in it:
+                # Copies still being written end in .<pid>.<thread>.
+                if entry.name.count('.') > 1:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                pinned = entry.name.endswith(PINNED_EXTENSIONS) and stat.st_size <= settings.SEGMENT_CACHE_PIN_SIZE
+                entries.append((pinned, stat.st_atime, stat.st_size, entry.path))
+
+        total = sum(size for _, _, size, _ in entries)
+        evicted = 0
+        for _, _, size, path in sorted(entries):
+            if total <= settings.SEGMENT_CACHE_SIZE * EVICT_TO:
+                break
+            try:
+                # A process still sending the copy keeps its open file.
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        cache.set(node_key(SEGMENT_CACHE_SIZE_KEY), total, timeout=None)
+        if evicted:
+            count(SEGMENT_CACHE_EVICTIONS_KEY, evicted)
+        return evicted
+    finally:
+        cache.delete(lock)
+
+
+def count_stat(key, delta=1):
+    with _pending_stats_lock:
+        _pending_stats[key] = _pending_stats.get(key, 0) + delta
+    flush_segment_cache_stats()
+
+
+def flush_segment_cache_stats(force=False):
+    """Add this process's pending counts to the shared counters, at most every SEGMENT_CACHE_STATS_INTERVAL."""
+    global _stats_flushed_at
+    with _pending_stats_lock:
+        now = time.monotonic()
+        if not _pending_stats or (not force and now - _stats_flushed_at < settings.SEGMENT_CACHE_STATS_INTERVAL):
+            return
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+        _stats_flushed_at = now
+    for key, delta in pending.items():
+        count(key, delta)
+
+
+def count_served(response):
+    count_stat(SEGMENT_CACHE_SERVED_KEY, int(response.get('Content-Length') or 0))
+
+
+def get_segment_cache_stats():
+    """Return the shared counters; other processes' latest counts arrive within SEGMENT_CACHE_STATS_INTERVAL."""
+    flush_segment_cache_stats(force=True)
+    hits = cache.get(SEGMENT_CACHE_HITS_KEY) or 0
+    misses = cache.get(SEGMENT_CACHE_MISSES_KEY) or 0
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        'evictions': cache.get(SEGMENT_CACHE_EVICTIONS_KEY) or 0,
+        'bytes_served': cache.get(SEGMENT_CACHE_SERVED_KEY) or 0,
+        'bytes_cached': cache.get(node_key(SEGMENT_CACHE_SIZE_KEY)) or 0,
+        'size': settings.SEGMENT_CACHE_SIZE,
+    }
@@ -1,28 +1,34 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from .models import Video
-import os
-import shutil
 from django.conf import settings
-from .tasks import convert_to_hls
+from django.db import transaction
+from .tasks import delete_media_files, rebuild_home_rails, submit_transcode
+from .catalog_cache import bump_catalog_version
 import logging
+import uuid
 logger = logging.getLogger(__name__)
 
+def catalog_changed():
+    bump_catalog_version()
+    rebuild_home_rails.delay()
+
 @receiver(post_save, sender=Video)
 def trigger_hls_conversion(sender, instance, created, **kwargs):
+    # Bumping before commit would let a concurrent request cache the old row under the new version.
+    transaction.on_commit(catalog_changed)
     if created:
         logger.info(f"[Signal] Triggering HLS conversion for video id: {instance.id}")
-        convert_to_hls.delay(instance.id)
+        # Queued after commit, so the worker finds the row and the lock and job row are not part of a
+        # transaction that may still roll back; the task id is picked now so callers can report it.
+        task_id = instance.transcode_task_id = str(uuid.uuid4())
+        transaction.on_commit(lambda: submit_transcode(instance.id, task_id))
 
 @receiver(post_delete, sender=Video)       
 def auto_delete_files_on_video_delete(sender, instance, **kwargs):
-   
-    if instance.file and os.path.isfile(instance.file.path):
-        os.remove(instance.file.path)
-
-    hls_dir = os.path.join(instance.file.storage.location, 'videos', 'hls', str(instance.id))
-    if os.path.isdir(hls_dir):
-        shutil.rmtree(hls_dir)
+    transaction.on_commit(catalog_changed)
 
-    if instance.thumbnail and os.path.isfile(instance.thumbnail.path):
-        os.remove(instance.thumbnail.path)
\ No newline at end of file
+    # Thousands of segments are removed by a worker once the delete has committed, not inside it.
+    names = [field.name for field in (instance.file, instance.thumbnail) if field]
+    prefixes = [f'videos/hls/{instance.id}/']
+    transaction.on_commit(lambda: delete_media_files.delay(names, prefixes))
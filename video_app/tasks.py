@@ -1,85 +1,386 @@
-from celery import shared_task
+from celery import shared_task, chord, group
+from celery.utils.time import get_exponential_backoff_interval
+from botocore.exceptions import BotoCoreError, ClientError
 import subprocess
-from video_app.models import Video
+from video_app.media_storage import (
+    discard_local_copy, is_local_storage, local_media_path, media_location, store_directory,
+)
+from video_app.models import Video, TranscodeJob, UploadSession
+from video_app.progress_buffer import flush_progress_buffer
+from video_app.rails import materialize_home_rails
+from video_app.uploads import finalize_upload
+from video_app.transcoding import (
+    ENCODERS, Progress, encode_thumbnail, encode_variant, file_sha256, hls_output_dir, probe_source,
+    select_variants, storyboard_tile_size, thumbnail_output_path, write_dash_manifest, write_master_playlist,
+    write_storyboard_vtt,
+)
 import os
+import shutil
 import time
+import traceback
+import uuid
+from contextlib import contextmanager
 import logging
 logger = logging.getLogger(__name__)
-import shutil
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.utils import timezone
 
-@shared_task
-def convert_to_hls(video_id):
+TRANSCODE_LOCK_KEY = 'transcode-lock:{}'
+TRANSCODE_PROGRESS_KEY = 'transcode-progress:{}'
+# Seconds dispatch_transcode waits for ffprobe before queueing the encode with the maximum time limit.
+PROBE_TIME_LIMIT = 60
+# What local storage and the bucket raise when a file vanishes or a copy fails.
+STORAGE_ERRORS = (OSError, BotoCoreError, ClientError)
+
+
+def submit_transcode(video_id, task_id=None):
+    """Queue the transcode of a video, under task_id if given, unless a job for it is already queued or running.
+
+    Nothing is probed here: dispatch_transcode probes the source on a worker and then queues
+    convert_to_hls, so a slow ffprobe never holds up the request that saved the video. Returns the
+    id of the task that owns the video's transcode lock.
+    """
+    key = TRANSCODE_LOCK_KEY.format(video_id)
+    task_id = task_id or str(uuid.uuid4())
+    if not cache.add(key, task_id, timeout=settings.TRANSCODE_LOCK_TIMEOUT):
+        existing = cache.get(key)
+        logger.info(f"HLS conversion for video ID {video_id} already queued as {existing}")
+        return existing
+    TranscodeJob.objects.create(video_id=video_id, task_id=task_id)
+    dispatch_transcode.delay(video_id, task_id)
+    return task_id
+
+
+@shared_task(acks_late=True, soft_time_limit=PROBE_TIME_LIMIT)
+def dispatch_transcode(video_id, task_id):
+    """Queue convert_to_hls under task_id with time limits that fit the length of the source."""
+    try:
+        duration = probe_for_time_limits(video_id)
+    except Video.DoesNotExist:
+        logger.info(f"Video ID {video_id} was deleted before its transcode was dispatched")
+        TranscodeJob.objects.filter(task_id=task_id).delete()
+        release_transcode_lock(video_id)
+        return
+    soft_limit, hard_limit = transcode_time_limits(duration)
+    cache.touch(TRANSCODE_LOCK_KEY.format(video_id), max(settings.TRANSCODE_LOCK_TIMEOUT, hard_limit))
+    convert_to_hls.apply_async((video_id,), task_id=task_id, soft_time_limit=soft_limit, time_limit=hard_limit)
+
+
+def probe_for_time_limits(video_id):
+    """Probe the source before queueing so its time limits fit its length; the task then skips the probe.
+
+    A probe that fails, or runs past PROBE_TIME_LIMIT, leaves the duration unknown and the job gets
+    the maximum time limit.
+    """
+    video = Video.objects.get(id=video_id)
+    try:
+        probe_video(video)
+    except Exception as e:
+        logger.warning(f"Could not probe video ID {video_id} before queueing, using the maximum time limit: {e}")
+    return video.duration
+
+
+def transcode_time_limits(duration):
+    """Return the (soft, hard) Celery time limits in seconds for encoding a source of the given length."""
+    soft_limit = settings.TRANSCODE_TIME_LIMIT_MAX
+    if duration:
+        soft_limit = min(soft_limit, settings.TRANSCODE_TIME_LIMIT_BASE + duration * settings.TRANSCODE_TIME_LIMIT_FACTOR)
+    soft_limit = round(soft_limit)
+    return soft_limit, soft_limit + settings.TRANSCODE_TIME_LIMIT_GRACE
+
+
+def retry_countdown(retries):
+    return get_exponential_backoff_interval(factor=30, retries=retries, maximum=600, full_jitter=True)
+
+
+def release_transcode_lock(video_id):
+    cache.delete(TRANSCODE_LOCK_KEY.format(video_id))
+
+
+def get_transcode_progress(task_id):
+    return cache.get(TRANSCODE_PROGRESS_KEY.format(task_id))
+
+
+def progress_reporter(task_id):
+    """Return a callback that stores the percent complete of a job in the cache, not the database."""
+    key = TRANSCODE_PROGRESS_KEY.format(task_id)
+
+    def report(percent):
+        cache.set(key, percent, timeout=settings.TRANSCODE_LOCK_TIMEOUT)
+    return report
+
+
+def start_job(video, task_id):
+    job, _ = TranscodeJob.objects.update_or_create(
+        task_id=task_id or str(uuid.uuid4()),
+        defaults={'video': video, 'state': TranscodeJob.RUNNING, 'started_at': timezone.now()},
+    )
+    return job
+
+
+def finish_job(job, state, error=''):
+    job.state = state
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save()
+
+
+@contextmanager
+def timed_stage(job, name):
+    start = time.monotonic()
+    yield
+    job.stage_timings[name] = round(time.monotonic() - start, 3)
+
+
+@shared_task(bind=True, acks_late=True, max_retries=settings.TRANSCODE_MAX_RETRIES)
+def convert_to_hls(self, video_id):
     logger.info(f"Starting HLS conversion for video ID: {video_id}")
+    release_lock = True
+    job = None
 
     try:
         video = Video.objects.get(id=video_id)
-        input_file = video.file.path
-        output_dir = os.path.join(settings.MEDIA_ROOT, 'videos', 'hls', str(video.id))
+        job = start_job(video, self.request.id)
+
+        if not video.content_hash:
+            with timed_stage(job, 'hash'):
+                video.content_hash = file_sha256(local_media_path(video.file.name))
+                video.save(update_fields=['content_hash'])
+
+        source = find_transcoded_duplicate(video)
+        if source:
+            with timed_stage(job, 'reuse'):
+                reused = reuse_hls_output(source, video)
+            if reused:
+                discard_work_files(video)
+                finish_job(job, TranscodeJob.SUCCESS)
+                logger.info(f"Reused HLS output of video ID {source.id} for video ID: {video_id}")
+                return
+
+        # Created after a failed reuse, which removes what it copied into the output directory.
+        output_dir = hls_output_dir(video.id)
         os.makedirs(output_dir, exist_ok=True)
+        thumbnail_path = thumbnail_output_path(video.id)
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
 
-        variants = [
-            {'scale': '426x240', 'bitrate': '500k', 'variant': '0'},
-            {'scale': '640x360', 'bitrate': '1000k', 'variant': '1'},
-            {'scale': '1280x720', 'bitrate': '2500k', 'variant': '2'},
-            {'scale': '1920x1080', 'bitrate': '5000k', 'variant': '3'}
-        ]
-
-        ffmpeg_path = shutil.which("ffmpeg") or "ffmpeg"
-
-        for v in variants:
-            cmd = [
-                ffmpeg_path,
-                '-i', input_file,
-                '-vf', f'scale={v["scale"]}',
-                '-b:v', v['bitrate'], '-c:v', 'h264', '-preset', 'fast',
-                '-c:a', 'aac', '-b:a', '128k',
-                '-f', 'hls',
-                '-hls_time', '5',
-                '-hls_list_size', '0',
-                '-hls_segment_filename', os.path.join(output_dir, f'segment_{v["variant"]}_%03d.ts'),
-                os.path.join(output_dir, f'variant_{v["variant"]}.m3u8')
-            ]
-            logger.info(f"Running command: {' '.join(cmd)}")
-            subprocess.run(cmd, check=True)
-
-        master_playlist = os.path.join(output_dir, 'master.m3u8')
-        master_content = """
-            #EXTM3U
-            #EXT-X-STREAM-INF:BANDWIDTH=500000,RESOLUTION=426x240
-            variant_0.m3u8
-            #EXT-X-STREAM-INF:BANDWIDTH=1000000,RESOLUTION=640x360
-            variant_1.m3u8
-            #EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720
-            variant_2.m3u8
-            #EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080
-            variant_3.m3u8
-        """
-        with open(master_playlist, 'w') as f:
-            f.write(master_content.strip())
-        video.hls_master_playlist = f"videos/hls/{video.id}/master.m3u8"
-
-        thumbnail_dir = os.path.join(settings.MEDIA_ROOT, 'thumbnails')
-        os.makedirs(thumbnail_dir, exist_ok=True)
-        thumbnail_path = os.path.join(thumbnail_dir, f"{video.id}_thumb.jpg")
-
-        thumb_cmd = [
-            ffmpeg_path,
-            '-ss', '00:00:05',
-            '-i', input_file,
-            '-vframes', '1',
-            '-q:v', '2',
-            thumbnail_path
-        ]
-        subprocess.run(thumb_cmd, check=True)
-
-        video.thumbnail = f'thumbnails/{video.id}_thumb.jpg'
+        with timed_stage(job, 'probe'):
+            probe_video(video)
+        variants = select_variants(video.width, video.height)
 
-        video.save()
+        if settings.HLS_ENCODE_MODE == 'chord':
+            job.save(update_fields=['stage_timings'])
+            soft_limit, hard_limit = transcode_time_limits(video.duration)
+            limits = {'soft_time_limit': soft_limit, 'time_limit': hard_limit}
+            renditions = [encode_rendition.s(video.id, v).set(**limits) for v in variants]
+            thumbnail = generate_thumbnail.s(video.id).set(**limits)
+            callback = finalize_hls.s(video.id, job.task_id).on_error(mark_transcode_failed.s(video.id, job.task_id))
+            chord(group(renditions + [thumbnail]))(callback)
+            release_lock = False
+            logger.info(f"Dispatched {len(renditions)} renditions for video ID: {video_id}")
+            return
+
+        encode = ENCODERS[settings.HLS_ENCODE_MODE]
+        input_file = local_media_path(video.file.name)
+        with timed_stage(job, 'encode'):
+            progress = Progress(video.duration, progress_reporter(job.task_id))
+            encode(input_file, output_dir, thumbnail_path, variants=variants, progress=progress,
+                   tile_size=storyboard_tile_size(video.width, video.height))
+
+        with timed_stage(job, 'playlist'):
+            finish_hls(video)
+        finish_job(job, TranscodeJob.SUCCESS)
         logger.info(f"Successfully completed HLS conversion for video ID: {video_id}")
 
+    except subprocess.CalledProcessError as e:
+        if self.request.retries < self.max_retries:
+            # Keep the lock so the same video cannot be queued again while the retry waits.
+            release_lock = False
+            logger.warning(f"ffmpeg failed for video ID {video_id}, retry {self.request.retries + 1}: {e}")
+            raise self.retry(exc=e, countdown=retry_countdown(self.request.retries))
+        logger.error(f"Error in HLS conversion task: {e}")
+        if job:
+            finish_job(job, TranscodeJob.FAILURE, traceback.format_exc())
+            discard_work_files(video)
+        raise
+
+    except Exception as e:
+        logger.error(f"Error in HLS conversion task: {e}")
+        if job:
+            finish_job(job, TranscodeJob.FAILURE, traceback.format_exc())
+            discard_work_files(video)
+        raise
+
+    finally:
+        if release_lock:
+            release_transcode_lock(video_id)
+
+
+def find_transcoded_duplicate(video):
+    """Return an already converted video with byte-identical source, if there is one."""
+    return (
+        Video.objects.filter(content_hash=video.content_hash)
+        .exclude(id=video.id)
+        .exclude(hls_master_playlist__isnull=True)
+        .exclude(hls_master_playlist='')
+        .first()
+    )
+
+
+def reuse_hls_output(source, video):
+    """Copy the HLS output of a byte-identical video and return whether it could be reused.
+
+    The source row is not proof that its files are there: they may be missing, still being stored or
+    being deleted. In those cases nothing is kept and the caller encodes as usual.
+    """
+    prefix = f'videos/hls/{video.id}/'
+    if not default_storage.exists(f'videos/hls/{source.id}/master.m3u8'):
+        logger.warning(f"HLS output of video ID {source.id} is missing, encoding video ID {video.id} instead")
+        return False
+    try:
+        # Local storage hard-links the files, S3 copies them inside the bucket.
+        default_storage.copy_prefix(f'videos/hls/{source.id}/', prefix)
+        if source.thumbnail and default_storage.exists(source.thumbnail.name):
+            default_storage.copy(source.thumbnail.name, f'thumbnails/{video.id}_thumb.jpg')
+            video.thumbnail = f'thumbnails/{video.id}_thumb.jpg'
+    except STORAGE_ERRORS as e:
+        logger.warning(f"Could not reuse HLS output of video ID {source.id} for video ID {video.id}: {e}")
+        default_storage.delete_prefix(prefix)
+        return False
+    for field in PROBE_FIELDS:
+        setattr(video, field, getattr(source, field))
+    video.hls_master_playlist = f"videos/hls/{video.id}/master.m3u8"
+    if source.storyboard_vtt:
+        video.storyboard_vtt = f"videos/hls/{video.id}/storyboard.vtt"
+    video.save()
+    return True
+
+
+PROBE_FIELDS = ['width', 'height', 'frame_rate', 'duration', 'audio_channels', 'audio_layout']
+
+
+def probe_video(video):
+    """Store the source properties on the video so later jobs can skip ffprobe."""
+    if video.is_probed:
+        return
+    for field, value in probe_source(media_location(video.file.name)).items():
+        setattr(video, field, value)
+    video.save(update_fields=PROBE_FIELDS)
+
+
+def finish_hls(video):
+    output_dir = hls_output_dir(video.id)
+    variants = select_variants(video.width, video.height)
+    has_audio = bool(video.audio_channels)
+    write_master_playlist(output_dir, variants, frame_rate=video.frame_rate, has_audio=has_audio)
+    if settings.HLS_SEGMENT_FORMAT == 'fmp4':
+        write_dash_manifest(output_dir, variants, video.duration, video.frame_rate, has_audio)
+    video.hls_master_playlist = f"videos/hls/{video.id}/master.m3u8"
+    tile_size = storyboard_tile_size(video.width, video.height)
+    if tile_size and video.duration:
+        write_storyboard_vtt(output_dir, video.duration, tile_size)
+        video.storyboard_vtt = f"videos/hls/{video.id}/storyboard.vtt"
+    video.thumbnail = f'thumbnails/{video.id}_thumb.jpg'
+    store_hls_output(video)
+    video.save()
+
+
+def store_hls_output(video):
+    """Move the output of a finished encode from MEDIA_WORK_ROOT into remote storage.
+
+    With local storage the encoder already wrote to MEDIA_ROOT and there is nothing to do. The video
+    row is saved afterwards, so it never points at files that are not stored yet.
+    """
+    if is_local_storage():
+        return
+    stored = store_directory(hls_output_dir(video.id), f'videos/hls/{video.id}/')
+    thumbnail_path = thumbnail_output_path(video.id)
+    if os.path.isfile(thumbnail_path):
+        default_storage.save_local_file(thumbnail_path, video.thumbnail.name)
+    logger.info(f"Stored {stored} HLS files of video ID {video.id}")
+    discard_work_files(video)
+
+
+def discard_work_files(video):
+    """Remove what a job left in MEDIA_WORK_ROOT; with local storage that is the stored output itself."""
+    if is_local_storage():
+        return
+    shutil.rmtree(hls_output_dir(video.id), ignore_errors=True)
+    discard_local_copy(video.file.name)
+
+
+@shared_task(acks_late=True, autoretry_for=(subprocess.CalledProcessError,), retry_backoff=30,
+             retry_backoff_max=600, max_retries=settings.TRANSCODE_MAX_RETRIES)
+def encode_rendition(video_id, variant):
+    video = Video.objects.get(id=video_id)
+    encode_variant(local_media_path(video.file.name), hls_output_dir(video_id), variant)
+    return variant['variant']
+
+
+@shared_task(acks_late=True, autoretry_for=(subprocess.CalledProcessError,), retry_backoff=30,
+             retry_backoff_max=600, max_retries=settings.TRANSCODE_MAX_RETRIES)
+def generate_thumbnail(video_id):
+    video = Video.objects.get(id=video_id)
+    encode_thumbnail(local_media_path(video.file.name), thumbnail_output_path(video_id), hls_output_dir(video_id),
+                     storyboard_tile_size(video.width, video.height))
+
+
+@shared_task
+def finalize_hls(results, video_id, task_id):
+    try:
+        job = TranscodeJob.objects.get(task_id=task_id)
+        job.stage_timings['encode'] = round((timezone.now() - job.started_at).total_seconds()
+                                            - sum(job.stage_timings.values()), 3)
+        video = Video.objects.get(id=video_id)
+        with timed_stage(job, 'playlist'):
+            finish_hls(video)
+        finish_job(job, TranscodeJob.SUCCESS)
+        progress_reporter(task_id)(100)
+        logger.info(f"Successfully completed HLS conversion for video ID: {video_id}")
     except Exception as e:
         logger.error(f"Error in HLS conversion task: {e}")
+        TranscodeJob.objects.filter(task_id=task_id).update(
+            state=TranscodeJob.FAILURE, error=traceback.format_exc(), finished_at=timezone.now()
+        )
+        raise
+    finally:
+        release_transcode_lock(video_id)
+
+
+@shared_task
+def mark_transcode_failed(request, exc, tb, video_id, task_id):
+    logger.error(f"Error in HLS conversion task: {exc}")
+    TranscodeJob.objects.filter(task_id=task_id).update(
+        state=TranscodeJob.FAILURE, error=f"{request.id}: {exc!r}", finished_at=timezone.now()
+    )
+    video = Video.objects.filter(id=video_id).first()
+    if video:
+        discard_work_files(video)
+    release_transcode_lock(video_id)
+
+
+@shared_task(acks_late=True, autoretry_for=(Exception,), retry_backoff=30, retry_backoff_max=600, max_retries=3)
+def delete_media_files(names, prefixes):
+    """Delete the files and folders of a deleted video; whatever is missed is left to collect_media_garbage."""
+    for name in names:
+        default_storage.delete(name)
+    for prefix in prefixes:
+        default_storage.delete_prefix(prefix)
+    logger.info(f"Deleted {len(names)} media files and {len(prefixes)} media folders")
+
+
+@shared_task
+def rebuild_home_rails():
+    materialize_home_rails()
+
+
+@shared_task
+def flush_progress():
+    flushed = flush_progress_buffer()
+    if flushed:
+        logger.info(f"Flushed {flushed} buffered progress updates")
+    return flushed
 
 
 @shared_task(queue='default')
@@ -88,3 +389,23 @@ def test_celery_task():
     time.sleep(1)
     print("Task completed!")
     return "Task completed"
+
+
+@shared_task(acks_late=True)
+def store_upload(upload_id, content_hash=None):
+    """Store a finished resumable upload as an original and create its video, which queues the transcode.
+
+    Runs on a worker so that moving a multi-gigabyte file into the bucket holds neither a web worker
+    nor a database transaction. A failure clears the finalizing mark, so the client can complete again.
+    """
+    session = UploadSession.objects.get(id=upload_id)
+    try:
+        video = finalize_upload(session, content_hash)
+        video.save()
+    except Exception as e:
+        logger.error(f"Storing upload {upload_id} failed: {e}")
+        UploadSession.objects.filter(id=upload_id).update(finalizing=False)
+        raise
+    UploadSession.objects.filter(id=upload_id).update(video=video, finalizing=False)
+    logger.info(f"Stored upload {upload_id} as video ID {video.id}")
+    return video.id
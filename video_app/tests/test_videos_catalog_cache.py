@@ -0,0 +1,87 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from unittest.mock import patch
+from video_app.models import Video, UserVideoProgress
+from video_app.catalog_cache import CATALOG_HITS_KEY, CATALOG_MISSES_KEY, get_catalog_version
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, PROGRESS_WRITE_BEHIND=False)
+class CatalogCacheTestCase(APITestCase):
+    def setUp(self):
+        """Set up two viewers with different progress on the same video"""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other = User.objects.create_user(username='otheruser', password='testpassword')
+        with patch("video_app.signals.submit_transcode"), self.captureOnCommitCallbacks(execute=True):
+            self.video = Video.objects.create(title="Test Video", file="videos/originals/test.mp4", genre="Action")
+        UserVideoProgress.objects.create(user=self.user, video=self.video, last_viewed_position=30)
+        UserVideoProgress.objects.create(user=self.other, video=self.video, last_viewed_position=90)
+        self.list_url = "/videoflix/api/videos/"
+        self.detail_url = f"/videoflix/api/videos/{self.video.id}/"
+
+    def get_as(self, user, url):
+        self.client.force_authenticate(user=user)
+        return self.client.get(url)
+
+    def test_second_request_is_served_from_cache(self):
+        """Test a repeated list request only queries the viewer's progress and counts a hit"""
+        self.get_as(self.user, self.list_url)
+        with self.assertNumQueries(2):
+            response = self.get_as(self.user, self.list_url)
+
+        self.assertEqual(response.data["results"][0]["title"], "Test Video")
+        self.assertEqual(cache.get(CATALOG_MISSES_KEY), 1)
+        self.assertEqual(cache.get(CATALOG_HITS_KEY), 1)
+
+    def test_cached_entry_gets_each_viewers_progress(self):
+        """Test the cached list and detail are shared while user_progress is per viewer"""
+        for url in (self.list_url, self.detail_url):
+            first = self.get_as(self.user, url).data
+            second = self.get_as(self.other, url).data
+            first = first["results"][0] if "results" in first else first
+            second = second["results"][0] if "results" in second else second
+            self.assertEqual(first["user_progress"]["last_viewed_position"], 30)
+            self.assertEqual(second["user_progress"]["last_viewed_position"], 90)
+        self.assertEqual(cache.get(CATALOG_HITS_KEY), 2)
+
+    def test_save_and_delete_invalidate(self):
+        """Test saving or deleting a video bumps the version so the next request sees the change"""
+        self.get_as(self.user, self.detail_url)
+        version = get_catalog_version()
+
+        self.video.title = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.video.save()
+        self.assertGreater(get_catalog_version(), version)
+        self.assertEqual(self.get_as(self.user, self.detail_url).data["title"], "Renamed")
+
+        self.get_as(self.user, self.list_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.video.delete()
+        self.assertEqual(self.get_as(self.user, self.list_url).data["results"], [])
+        self.assertEqual(self.get_as(self.user, self.detail_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_version_is_bumped_only_after_commit(self):
+        """Test the version does not change before the saving transaction commits"""
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.video.save()
+            self.assertEqual(get_catalog_version(), version)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_cache_stats_for_admins(self):
+        """Test admins can read the hit and miss counters"""
+        self.get_as(self.user, self.list_url)
+        self.get_as(self.user, self.list_url)
+        self.assertEqual(self.get_as(self.user, "/videoflix/api/catalog/cache-stats/").status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        admin = User.objects.create_superuser(username='adminuser', password='adminpassword')
+        response = self.get_as(admin, "/videoflix/api/catalog/cache-stats/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data["hits"], response.data["misses"], response.data["hit_ratio"]), (1, 1, 0.5))
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+from video_app.models import Video
+
+DAY = 24 * 60 * 60
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MediaCleanupTestCase(TestCase):
+    def setUp(self):
+        """Set up a temporary media root with one video and its HLS output"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        with patch("video_app.signals.submit_transcode", return_value="task"):
+            self.video = Video.objects.create(
+                title="Kept Video",
+                file=SimpleUploadedFile("kept.mp4", b"original", content_type="video/mp4"),
+                thumbnail=SimpleUploadedFile("kept.jpg", b"jpeg", content_type="image/jpeg"),
+            )
+        self.write(f"videos/hls/{self.video.id}/master.m3u8", b"#EXTM3U\n")
+        self.write(f"videos/hls/{self.video.id}/segment_0_000.ts", b"\x47" * 188)
+        for name in (self.video.file.name, self.video.thumbnail.name):
+            self.age(name)
+
+    def path(self, name):
+        return os.path.join(self.media_root, name)
+
+    def write(self, name, content, age=2 * DAY):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        with open(self.path(name), 'wb') as f:
+            f.write(content)
+        self.age(name, age)
+
+    def age(self, name, age=2 * DAY):
+        modified = time.time() - age
+        os.utime(self.path(name), (modified, modified))
+
+    def test_delete_removes_files_after_commit(self):
+        """Test deleting a video leaves its files alone until the transaction commits, then removes them"""
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.video.delete()
+        self.assertTrue(os.path.exists(self.path(self.video.file.name)))
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(os.path.exists(self.path(self.video.file.name)))
+        self.assertFalse(os.path.exists(self.path(self.video.thumbnail.name)))
+        self.assertFalse(os.path.exists(self.path(f"videos/hls/{self.video.id}")))
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command("collect_media_garbage", *args, stdout=out)
+        return out.getvalue()
+
+    def test_collect_media_garbage(self):
+        """Test files without a video are reported in a dry run and deleted in batches otherwise"""
+        orphan_id = self.video.id + 1000
+        self.write(f"videos/hls/{orphan_id}/master.m3u8", b"#EXTM3U\n")
+        self.write(f"videos/hls/{orphan_id}/segment_0_000.ts", b"\x47" * 188)
+        self.write("videos/originals/orphan.mp4", b"x" * 1000)
+        self.write("thumbnails/orphan.jpg", b"jpeg")
+        self.write("videos/originals/just_uploaded.mp4", b"new", age=60)
+
+        output = self.collect("--dry-run")
+        self.assertIn("Would free 1200 bytes in 4 files.", output)
+        self.assertTrue(os.path.exists(self.path("videos/originals/orphan.mp4")))
+
+        output = self.collect("--batch-size", "1")
+        self.assertIn("Freed 1200 bytes in 4 files.", output)
+        self.assertFalse(os.path.exists(self.path(f"videos/hls/{orphan_id}")))
+        self.assertFalse(os.path.exists(self.path("videos/originals/orphan.mp4")))
+        self.assertFalse(os.path.exists(self.path("thumbnails/orphan.jpg")))
+        self.assertTrue(os.path.exists(self.path("videos/originals/just_uploaded.mp4")))
+        for name in (self.video.file.name, self.video.thumbnail.name, f"videos/hls/{self.video.id}/master.m3u8"):
+            self.assertTrue(os.path.exists(self.path(name)), name)
+
+        self.assertIn("Freed 0 bytes in 0 files.", self.collect())
@@ -0,0 +1,83 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from unittest.mock import patch
+from video_app.models import Video, UserVideoProgress
+import time
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, PROGRESS_WRITE_BEHIND=False)
+class ConditionalCatalogTestCase(APITestCase):
+    def setUp(self):
+        """Set up a video with progress for the requesting user"""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        with patch("video_app.signals.submit_transcode"), self.captureOnCommitCallbacks(execute=True):
+            self.video = Video.objects.create(title="Test Video", file="videos/originals/test.mp4")
+        UserVideoProgress.objects.create(user=self.user, video=self.video, last_viewed_position=30)
+        self.urls = ["/videoflix/api/videos/", f"/videoflix/api/videos/{self.video.id}/"]
+
+    def test_responses_carry_validators(self):
+        """Test list and detail responses have a strong ETag, Last-Modified and private revalidation"""
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertTrue(response["ETag"].startswith('"'))
+            self.assertIn("Last-Modified", response)
+            self.assertIn("private", response["Cache-Control"])
+
+    def test_matching_etag_returns_304_without_serializing(self):
+        """Test If-None-Match with the current ETag answers 304 from one aggregate query"""
+        for url in self.urls:
+            etag = self.client.get(url)["ETag"]
+            with patch("video_app.api.views.VideoListSerializer") as list_serializer, \
+                    patch("video_app.api.views.VideoDetailSerializer") as detail_serializer, \
+                    self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response["ETag"], etag)
+            list_serializer.assert_not_called()
+            detail_serializer.assert_not_called()
+
+    def test_if_modified_since(self):
+        """Test If-Modified-Since with the current Last-Modified answers 304"""
+        last_modified = self.client.get(self.urls[0])["Last-Modified"]
+        response = self.client.get(self.urls[0], HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_modified_since_expires_with_the_signing_window(self):
+        """Test If-Modified-Since alone gets fresh signed URLs once the signing window has rolled over"""
+        for url in self.urls:
+            response = self.client.get(url)
+            later = time.time() + 2 * settings.MEDIA_URL_TTL
+            with patch("video_app.media_signing.time.time", return_value=later):
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_changes_with_catalog_and_progress(self):
+        """Test the ETag changes when a video is saved or the user's progress moves"""
+        for url in self.urls:
+            first = self.client.get(url)["ETag"]
+
+            self.client.patch(f"/videoflix/api/video/{self.video.id}/progress/", {"last_viewed_position": 60},
+                              format="json")
+            after_progress = self.client.get(url, HTTP_IF_NONE_MATCH=first)
+            self.assertEqual(after_progress.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(after_progress["ETag"], first)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.video.save()
+            after_save = self.client.get(url, HTTP_IF_NONE_MATCH=after_progress["ETag"])
+            self.assertEqual(after_save.status_code, status.HTTP_200_OK)
+
+    def test_etag_differs_per_user(self):
+        """Test two users never share an ETag for the same URL"""
+        etag = self.client.get(self.urls[0])["ETag"]
+        self.client.force_authenticate(user=User.objects.create_user(username='other', password='pw'))
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -0,0 +1,260 @@
+import os
+import shutil
+import tempfile
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+from video_app.media_signing import sign_dash_manifest, sign_media_path, sign_playlist, signed_media_url
+from video_app.models import Video
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_DELIVERY='x-accel', MEDIA_ACCEL_PREFIX='/protected-media/',
+                   SEGMENT_CACHE_DIR=os.path.join(MEDIA_ROOT, 'segment-cache'))
+class MediaViewTestCase(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name, content in [
+            ('videos/hls/1/master.m3u8', b'#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nvariant_0.m3u8\n'),
+            ('videos/hls/1/storyboard.vtt', b'WEBVTT\n\n00:00:00.000 --> 00:00:10.000\nstoryboard_001.jpg#xywh=0,0,160,90\n'),
+            ('videos/hls/1/manifest.mpd', b'<MPD><Period><Representation><BaseURL>variant_0.mp4</BaseURL>'
+                                          b'</Representation></Period></MPD>\n'),
+            ('videos/hls/2/master.m3u8', b'#EXTM3U\n'),
+            ('videos/hls/1/segment_0_000.ts', b'\x47' * 188),
+            ('videos/hls/1/my clip.mp4', b'mp4'),
+            ('thumbnails/1_thumb.jpg', b'jpeg'),
+            ('videos/originals/a.mp4', b'mp4'),
+            ('videos/originals/b.mp4', b'mp4'),
+            ('videos/uploads/abc.part', b'partial'),
+        ]:
+            path = os.path.join(MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+
+    def test_accel_redirect_hands_file_to_proxy(self):
+        """Test an authorized request gets an empty response pointing nginx at the internal location"""
+        response = self.client.get("/media/videos/hls/1/segment_0_000.ts", HTTP_ACCEPT="video/mp2t")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/videos/hls/1/segment_0_000.ts")
+        self.assertEqual(response["Content-Type"], "video/mp2t")
+        self.assertEqual(response.content, b"")
+
+        playlist = self.client.get("/media/videos/hls/1/master.m3u8")
+        self.assertEqual(playlist["Content-Type"], "application/vnd.apple.mpegurl")
+        self.assertEqual(self.client.get("/media/videos/hls/1/my clip.mp4")["X-Accel-Redirect"],
+                         "/protected-media/videos/hls/1/my%20clip.mp4")
+
+    @override_settings(MEDIA_DELIVERY='x-sendfile')
+    def test_sendfile_header(self):
+        """Test X-Sendfile mode passes the absolute file path"""
+        response = self.client.get("/media/videos/hls/1/master.m3u8")
+        self.assertEqual(response["X-Sendfile"], os.path.join(MEDIA_ROOT, "videos/hls/1/master.m3u8"))
+
+    @override_settings(MEDIA_DELIVERY='django')
+    def test_django_fallback_streams_file(self):
+        """Test development mode streams the file from Django with the streaming content type"""
+        response = self.client.get("/media/videos/hls/1/segment_0_000.ts")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"\x47" * 188)
+        self.assertEqual(response["Content-Type"], "video/mp2t")
+        self.assertNotIn("X-Accel-Redirect", response)
+
+    @override_settings(MEDIA_DELIVERY='django')
+    def test_range_request_gets_partial_content(self):
+        """Test a byte range is answered with 206, the matching slice and its Content-Range"""
+        segment = self.client.get("/media/videos/hls/1/segment_0_000.ts")
+        self.assertEqual(segment["Accept-Ranges"], "bytes")
+        self.assertEqual(segment["Content-Length"], "188")
+
+        for header, content_range, body in [
+            ("bytes=0-9", "bytes 0-9/188", b"\x47" * 10),
+            ("bytes=180-", "bytes 180-187/188", b"\x47" * 8),
+            ("bytes=-4", "bytes 184-187/188", b"\x47" * 4),
+            ("bytes=100-500", "bytes 100-187/188", b"\x47" * 88),
+        ]:
+            response = self.client.get("/media/videos/hls/1/segment_0_000.ts", HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT, header)
+            self.assertEqual(response["Content-Range"], content_range)
+            self.assertEqual(response["Content-Length"], str(len(body)))
+            self.assertEqual(b"".join(response.streaming_content), body)
+
+        response = self.client.get("/media/videos/hls/1/my clip.mp4", HTTP_RANGE="bytes=1-1")
+        self.assertEqual(b"".join(response.streaming_content), b"p")
+
+    @override_settings(MEDIA_DELIVERY='django')
+    def test_unsatisfiable_and_ignored_ranges(self):
+        """Test a range past the end gets 416 while multiple ranges or a stale If-Range get the whole file"""
+        response = self.client.get("/media/videos/hls/1/segment_0_000.ts", HTTP_RANGE="bytes=188-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], "bytes */188")
+
+        for headers in [{"HTTP_RANGE": "bytes=0-1,5-6"}, {"HTTP_RANGE": "bytes=0-1", "HTTP_IF_RANGE": "stale"}]:
+            response = self.client.get("/media/videos/hls/1/segment_0_000.ts", **headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(b"".join(response.streaming_content)), 188)
+
+        last_modified = response["Last-Modified"]
+        response = self.client.get("/media/videos/hls/1/segment_0_000.ts", HTTP_RANGE="bytes=0-1",
+                                   HTTP_IF_RANGE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        response = self.client.get("/media/videos/hls/1/segment_0_000.ts", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(MEDIA_DELIVERY='django')
+    def test_head_request_sends_headers_only(self):
+        """Test HEAD reports the size and range support without opening the file"""
+        with patch("video_app.views.open") as mock_open:
+            response = self.client.head("/media/videos/hls/1/segment_0_000.ts", HTTP_RANGE="bytes=0-99")
+
+        mock_open.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Length"], "100")
+        self.assertEqual(response["Content-Type"], "video/mp2t")
+        self.assertEqual(response.content, b"")
+
+    def test_cache_headers(self):
+        """Test segments are cached as immutable, playlists are revalidated and only signed files are shared"""
+        segment = self.client.get("/media/videos/hls/1/segment_0_000.ts")
+        self.assertEqual(segment["Cache-Control"], "private, max-age=31536000, immutable")
+        self.assertEqual(self.client.get("/media/videos/hls/1/master.m3u8")["Cache-Control"], "private, no-cache")
+        self.assertEqual(self.client.get("/media/thumbnails/1_thumb.jpg")["Cache-Control"], "public, no-cache")
+
+        self.client.force_authenticate(user=None)
+        with patch("video_app.media_signing.time.time", return_value=7200.5), \
+                patch("video_app.views.time.time", return_value=9000.5), override_settings(MEDIA_URL_TTL=3600):
+            signed, _ = self.signed_get("videos/hls/1/segment_0_000.ts")
+        # Signed at 7200 the URL expires at 14400, so shared caches may keep it for the 5400 s left.
+        self.assertEqual(signed["Cache-Control"], "public, max-age=5400")
+
+    def test_anonymous_access(self):
+        """Test video files need a logged-in user while thumbnails stay public"""
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get("/media/videos/hls/1/master.m3u8").status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get("/media/thumbnails/1_thumb.jpg").status_code, status.HTTP_200_OK)
+
+    def test_hidden_missing_and_outside_paths(self):
+        """Test partial uploads, missing files and paths leaving MEDIA_ROOT are not found"""
+        for url in ("/media/videos/uploads/abc.part", "/media/videos/hls/1/missing.ts",
+                    "/media/videos/../../etc/passwd", "/media/videos/hls/../uploads/abc.part"):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND, url)
+
+    def signed_get(self, path, signed_path=None):
+        query = sign_media_path(signed_path or path)
+        return self.client.get(f"/media/{path}?{query}"), query
+
+    def test_signed_segment_needs_no_token_or_database(self):
+        """Test a signed segment URL is checked by HMAC alone, without authentication or queries"""
+        self.client.force_authenticate(user=None)
+        with self.assertNumQueries(0):
+            response, _ = self.signed_get("videos/hls/1/segment_0_000.ts")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/videos/hls/1/segment_0_000.ts")
+
+    def test_signed_playlist_passes_signature_on(self):
+        """Test a signed playlist is rewritten so its variant URIs carry the same signature"""
+        self.client.force_authenticate(user=None)
+        response, query = self.signed_get("videos/hls/1/master.m3u8")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content.decode().splitlines()[-1], f"variant_0.m3u8?{query}")
+        self.assertNotIn("X-Accel-Redirect", response)
+
+        storyboard, query = self.signed_get("videos/hls/1/storyboard.vtt")
+        self.assertIn(f"storyboard_001.jpg?{query}#xywh=0,0,160,90", storyboard.content.decode())
+
+        manifest, query = self.signed_get("videos/hls/1/manifest.mpd")
+        self.assertIn(f"<BaseURL>variant_0.mp4?{query.replace('&', '&amp;')}</BaseURL>", manifest.content.decode())
+        self.assertEqual(manifest["Content-Type"], "application/dash+xml")
+
+    def test_signature_is_bound_to_directory_and_expiry(self):
+        """Test a signature does not open another video's files and stops working once expired"""
+        self.client.force_authenticate(user=None)
+        response, _ = self.signed_get("videos/hls/2/master.m3u8", signed_path="videos/hls/1/master.m3u8")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        url = urlsplit(signed_media_url("videos/hls/1/segment_0_000.ts"))
+        with patch("video_app.media_signing.time.time", return_value=int(parse_qs(url.query)["expires"][0]) + 1):
+            response = self.client.get(f"{url.path}?{url.query}")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_original_signature_opens_only_that_file(self):
+        """Test a signed original is not a key to every other original in the same directory"""
+        self.client.force_authenticate(user=None)
+        response, _ = self.signed_get("videos/originals/a.mp4")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, _ = self.signed_get("videos/originals/b.mp4", signed_path="videos/originals/a.mp4")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_api_media_urls_open_without_a_token(self):
+        """Test every media URL in the list and detail payloads can be fetched by a player that sends no token"""
+        video = Video.objects.create(title="Signed", file="videos/originals/a.mp4", thumbnail="thumbnails/1_thumb.jpg")
+        # The detail payload builds the playlist path from the video id.
+        video.hls_master_playlist = f"videos/hls/{video.id}/master.m3u8"
+        video.save()
+        playlist = os.path.join(MEDIA_ROOT, video.hls_master_playlist.name)
+        if not os.path.exists(playlist):
+            os.makedirs(os.path.dirname(playlist), exist_ok=True)
+            with open(playlist, 'w') as f:
+                f.write('#EXTM3U\n')
+        item = self.client.get("/videoflix/api/videos/").data["results"][0]
+        detail = self.client.get(f"/videoflix/api/videos/{video.id}/").data
+        urls = [item["file"], item["thumbnail"], item["hls_master_playlist"],
+                detail["file"], detail["thumbnail"], detail["hls_master_playlist_url"]]
+
+        player = APIClient()
+        for url in urls:
+            url = urlsplit(url)
+            self.assertEqual(player.get(f"{url.path}?{url.query}").status_code, status.HTTP_200_OK, url.path)
+
+
+class MediaSigningTestCase(SimpleTestCase):
+    @override_settings(MEDIA_BASE_URL="https://cdn.example.com/media/", MEDIA_URL_TTL=3600)
+    def test_signed_url_uses_base_url_and_shared_window(self):
+        """Test URLs come from MEDIA_BASE_URL and expire one to two windows from now, the same within a window"""
+        with patch("video_app.media_signing.time.time", return_value=7200.5):
+            url = signed_media_url("videos/hls/1/master.m3u8")
+            self.assertEqual(url, signed_media_url("videos/hls/1/master.m3u8"))
+
+        self.assertTrue(url.startswith("https://cdn.example.com/media/videos/hls/1/master.m3u8?expires=14400&signature="))
+
+    def test_sign_playlist_covers_uri_lines_and_attributes(self):
+        """Test segment lines and URI attributes get the query while absolute URIs are left alone"""
+        playlist = (
+            '#EXTM3U\n#EXT-X-MAP:URI="variant_0.mp4",BYTERANGE="1000@0"\n#EXTINF:5.0,\n'
+            '#EXT-X-BYTERANGE:250000@1000\nvariant_0.mp4\n#EXTINF:5.0,\nhttps://other.example.com/seg.ts\n'
+        )
+        signed = sign_playlist(playlist, "expires=1&signature=ab").splitlines()
+
+        self.assertEqual(signed[1], '#EXT-X-MAP:URI="variant_0.mp4?expires=1&signature=ab",BYTERANGE="1000@0"')
+        self.assertEqual(signed[4], "variant_0.mp4?expires=1&signature=ab")
+        self.assertEqual(signed[6], "https://other.example.com/seg.ts")
+
+    def test_sign_dash_manifest_covers_base_urls(self):
+        """Test relative BaseURLs get the query escaped for XML while absolute ones are left alone"""
+        manifest = (
+            '<Representation id="0"><BaseURL>variant_0.mp4</BaseURL></Representation>'
+            '<Representation id="1"><BaseURL>https://other.example.com/variant_1.mp4</BaseURL></Representation>'
+        )
+        signed = sign_dash_manifest(manifest, "expires=1&signature=ab")
+
+        self.assertIn('<BaseURL>variant_0.mp4?expires=1&amp;signature=ab</BaseURL>', signed)
+        self.assertIn('<BaseURL>https://other.example.com/variant_1.mp4</BaseURL>', signed)
@@ -0,0 +1,80 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from video_app.models import Video
+from datetime import timedelta
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, PROGRESS_WRITE_BEHIND=False)
+class VideoCursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        """Set up 25 videos where several share an upload time"""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        videos = Video.objects.bulk_create(
+            Video(title=f"Video {i}", file=f"videos/originals/video_{i}.mp4") for i in range(25)
+        )
+        now = timezone.now()
+        for i, video in enumerate(videos):
+            Video.objects.filter(id=video.id).update(uploaded_at=now - timedelta(minutes=i // 3))
+        self.expected = list(Video.objects.order_by('-uploaded_at', '-id').values_list('id', flat=True))
+
+    def walk(self, url, link):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [item["id"] for item in response.data["results"]]
+            url = response.data[link]
+            pages += 1
+        return ids, pages
+
+    def test_pages_cover_catalog_once_in_order(self):
+        """Test following next links returns every video once, newest first, across equal upload times"""
+        ids, pages = self.walk("/videoflix/api/videos/?page_size=4", "next")
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(pages, 7)
+
+    def test_previous_links_walk_back(self):
+        """Test previous links lead back through the same pages"""
+        url = "/videoflix/api/videos/?page_size=4"
+        for _ in range(7):
+            response = self.client.get(url)
+            url = response.data["next"]
+        last_page = [item["id"] for item in response.data["results"]]
+        self.assertIsNone(response.data["next"])
+
+        ids, _ = self.walk(response.data["previous"], "previous")
+
+        self.assertEqual(last_page, self.expected[24:])
+        self.assertEqual(ids, self.expected[20:24] + self.expected[16:20] + self.expected[12:16]
+                         + self.expected[8:12] + self.expected[4:8] + self.expected[:4])
+        response = self.client.get("/videoflix/api/videos/?page_size=4")
+        self.assertIsNone(response.data["previous"])
+
+    def test_deep_page_does_not_use_offset(self):
+        """Test a page after the first is fetched with a keyset condition instead of OFFSET"""
+        next_url = self.client.get("/videoflix/api/videos/?page_size=10").data["next"]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(next_url)
+        video_query = next(q["sql"] for q in queries if 'FROM "video_app_video"' in q["sql"])
+        self.assertNotIn("OFFSET", video_query)
+        self.assertIn('ORDER BY "video_app_video"."uploaded_at" DESC, "video_app_video"."id" DESC', video_query)
+
+    def test_page_size_is_capped(self):
+        """Test the default page size applies and requested sizes are clamped to the maximum"""
+        with self.settings(VIDEO_CATALOG_PAGE_SIZE=5, VIDEO_CATALOG_MAX_PAGE_SIZE=10):
+            self.assertEqual(len(self.client.get("/videoflix/api/videos/").data["results"]), 5)
+            self.assertEqual(len(self.client.get("/videoflix/api/videos/?page_size=50").data["results"]), 10)
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is answered with 404"""
+        response = self.client.get("/videoflix/api/videos/?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
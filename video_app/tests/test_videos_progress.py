@@ -0,0 +1,170 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+from datetime import timedelta
+from unittest.mock import patch
+from video_app.models import Video, UserVideoProgress
+from video_app.progress_buffer import PROGRESS_DIRTY_KEY, PROGRESS_FLUSHING_KEY, flush_progress_buffer, get_redis
+from video_app.tasks import flush_progress
+
+
+def clear_buffer():
+    redis = get_redis()
+    for key in redis.scan_iter('progress*'):
+        redis.delete(key)
+
+
+@override_settings(PROGRESS_WRITE_BEHIND=True)
+class ProgressBufferTestCase(APITestCase):
+    def setUp(self):
+        """Set up a user, two videos and an empty progress buffer"""
+        clear_buffer()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.video, self.other = Video.objects.bulk_create([
+            Video(title="Buffered", file="videos/originals/1.mp4"),
+            Video(title="Other", file="videos/originals/2.mp4"),
+        ])
+        UserVideoProgress.objects.create(user=self.user, video=self.other, last_viewed_position=5, viewed=True)
+
+    def tearDown(self):
+        clear_buffer()
+
+    def heartbeat(self, video, data):
+        return self.client.patch(f"/videoflix/api/video/{video.id}/progress/", data, format="json")
+
+    def test_heartbeats_do_not_write_to_the_database(self):
+        """Test only the first heartbeat of a video reads the database and none writes to it"""
+        with self.assertNumQueries(2):
+            response = self.heartbeat(self.video, {"last_viewed_position": 10})
+        self.assertEqual(response.data, {"last_viewed_position": 10.0, "viewed": False})
+
+        with self.assertNumQueries(0):
+            response = self.heartbeat(self.video, {"viewed": True})
+        self.assertEqual(response.data, {"last_viewed_position": 10.0, "viewed": True})
+        self.assertFalse(UserVideoProgress.objects.filter(video=self.video).exists())
+
+    def test_partial_heartbeat_keeps_stored_state(self):
+        """Test a heartbeat for an already stored row starts from that row"""
+        response = self.heartbeat(self.other, {"last_viewed_position": 7})
+        self.assertEqual(response.data, {"last_viewed_position": 7.0, "viewed": True})
+
+    def test_flush_upserts_buffered_progress_in_bulk(self):
+        """Test one flush creates new rows, updates existing ones and empties the dirty set"""
+        self.heartbeat(self.video, {"last_viewed_position": 10})
+        self.heartbeat(self.other, {"last_viewed_position": 20, "viewed": False})
+
+        with self.assertNumQueries(3):
+            self.assertEqual(flush_progress.delay().get(), 2)
+
+        stored = {p.video_id: (p.last_viewed_position, p.viewed) for p in UserVideoProgress.objects.filter(user=self.user)}
+        self.assertEqual(stored, {self.video.id: (10, False), self.other.id: (20, False)})
+        self.assertFalse(get_redis().exists(PROGRESS_DIRTY_KEY, PROGRESS_FLUSHING_KEY))
+        self.assertEqual(flush_progress_buffer(), 0)
+
+    def test_flush_keeps_the_time_of_the_heartbeat(self):
+        """Test flushed rows record when the heartbeat arrived, not when the flush ran"""
+        sent_at = timezone.now() - timedelta(minutes=10)
+        with patch("video_app.progress_buffer.time.time", return_value=sent_at.timestamp()):
+            self.heartbeat(self.video, {"last_viewed_position": 10})
+            self.heartbeat(self.other, {"last_viewed_position": 20})
+        flush_progress_buffer()
+
+        for progress in UserVideoProgress.objects.filter(user=self.user):
+            self.assertEqual(progress.last_viewed_at, sent_at)
+
+    def test_heartbeat_during_flush_is_flushed_next_time(self):
+        """Test an entry updated after a flush took the dirty set is written by the following flush"""
+        self.heartbeat(self.video, {"last_viewed_position": 10})
+        get_redis().rename(PROGRESS_DIRTY_KEY, PROGRESS_FLUSHING_KEY)
+        self.heartbeat(self.video, {"last_viewed_position": 30})
+
+        flush_progress_buffer()
+        flush_progress_buffer()
+
+        self.assertEqual(UserVideoProgress.objects.get(user=self.user, video=self.video).last_viewed_position, 30)
+
+    def test_flush_skips_deleted_videos(self):
+        """Test progress buffered for a video deleted before the flush does not fail the batch"""
+        self.heartbeat(self.video, {"last_viewed_position": 10})
+        self.heartbeat(self.other, {"last_viewed_position": 20})
+        Video.objects.filter(id=self.video.id).delete()
+
+        self.assertEqual(flush_progress_buffer(), 1)
+        self.assertEqual(UserVideoProgress.objects.get(user=self.user).last_viewed_position, 20)
+
+    def test_heartbeat_for_unknown_video(self):
+        """Test a heartbeat for a video that does not exist is rejected and not buffered"""
+        response = self.client.patch("/videoflix/api/video/999999/progress/", {"last_viewed_position": 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(get_redis().exists(PROGRESS_DIRTY_KEY))
+
+    def test_reads_see_buffered_progress(self):
+        """Test the catalog shows buffered progress before it is flushed and revalidates after a heartbeat"""
+        url = f"/videoflix/api/videos/{self.other.id}/"
+        first = self.client.get(url)
+        self.assertEqual(first.data["user_progress"]["last_viewed_position"], 5)
+
+        self.heartbeat(self.other, {"last_viewed_position": 42})
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["user_progress"]["last_viewed_position"], 42)
+
+
+@override_settings(PROGRESS_WRITE_BEHIND=True, CONTINUE_WATCHING_SIZE=3)
+class ContinueWatchingTestCase(APITestCase):
+    def setUp(self):
+        """Set up stored progress on videos watched at different times"""
+        clear_buffer()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.videos = Video.objects.bulk_create([
+            Video(title=f"Video {n}", file=f"videos/originals/{n}.mp4", duration=200.0) for n in range(5)
+        ])
+        Video.objects.filter(id=self.videos[4].id).update(duration=None)
+        now = timezone.now()
+        for n, (position, viewed) in enumerate([(50, False), (100, False), (10, True), (0, False), (30, False)]):
+            UserVideoProgress.objects.create(user=self.user, video=self.videos[n], last_viewed_position=position, viewed=viewed)
+        for n, minutes in enumerate([30, 10, 5, 1, 20]):
+            UserVideoProgress.objects.filter(video=self.videos[n]).update(last_viewed_at=now - timedelta(minutes=minutes))
+
+    def tearDown(self):
+        clear_buffer()
+
+    def titles(self, response):
+        return [item["title"] for item in response.data["results"]]
+
+    def test_lists_unfinished_videos_most_recent_first(self):
+        """Test finished and unstarted videos are left out and the rest come newest first with percent watched"""
+        with self.assertNumQueries(3):
+            response = self.client.get("/videoflix/api/videos/continue-watching/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.titles(response), ["Video 1", "Video 4", "Video 0"])
+        first = response.data["results"][0]
+        self.assertEqual(first["percent_watched"], 50.0)
+        self.assertEqual(first["user_progress"], {"last_viewed_position": 100.0, "viewed": False})
+        self.assertTrue(first["last_viewed_at"].endswith("Z"))
+        self.assertIsNone(response.data["results"][1]["percent_watched"])
+
+    def test_buffered_heartbeats_reorder_before_flush(self):
+        """Test a heartbeat moves its video to the front and finishing a video removes it, before any flush"""
+        self.client.patch(f"/videoflix/api/video/{self.videos[0].id}/progress/", {"last_viewed_position": 60}, format="json")
+        self.client.patch(f"/videoflix/api/video/{self.videos[1].id}/progress/", {"viewed": True}, format="json")
+        self.client.patch(f"/videoflix/api/video/{self.videos[3].id}/progress/", {"last_viewed_position": 5}, format="json")
+
+        response = self.client.get("/videoflix/api/videos/continue-watching/")
+
+        self.assertEqual(self.titles(response), ["Video 3", "Video 0", "Video 4"])
+        self.assertEqual(response.data["results"][1]["percent_watched"], 30.0)
+
+    @override_settings(PROGRESS_WRITE_BEHIND=False)
+    def test_without_write_behind_reads_the_database(self):
+        """Test the list comes from the stored rows alone when heartbeats are written directly"""
+        response = self.client.get("/videoflix/api/videos/continue-watching/")
+        self.assertEqual(self.titles(response), ["Video 1", "Video 4", "Video 0"])
@@ -0,0 +1,76 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from django.utils import timezone
+from unittest.mock import patch
+from video_app.models import Video, UserVideoProgress
+from video_app.catalog_cache import get_catalog_version
+from video_app.rails import HOME_RAILS_KEY, build_home_rails
+from datetime import timedelta
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, PROGRESS_WRITE_BEHIND=False, HOME_RAIL_SIZE=2)
+class HomeRailsTestCase(APITestCase):
+    def setUp(self):
+        """Set up flagged videos in two genres with distinct upload times"""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        specs = [
+            ("Old Action", "Action", {'is_featured': True}),
+            ("Mid Action", "Action", {'is_featured': True, 'is_trending': True}),
+            ("New Action", "Action", {'is_featured': True, 'is_new': True}),
+            ("Drama", "Drama", {'is_trending': True}),
+            ("No Genre", "", {}),
+        ]
+        now = timezone.now()
+        self.videos = {}
+        for age, (title, genre, flags) in enumerate(reversed(specs)):
+            video = Video.objects.create(title=title, file="videos/originals/x.mp4", genre=genre, **flags)
+            Video.objects.filter(id=video.id).update(uploaded_at=now - timedelta(hours=age))
+            self.videos[title] = video.id
+        UserVideoProgress.objects.create(user=self.user, video_id=self.videos["Drama"], last_viewed_position=42)
+
+    def titles(self, items):
+        return [item["title"] for item in items]
+
+    def test_build_home_rails_caps_and_orders_each_rail(self):
+        """Test every rail is newest first and capped, and videos without a genre get no genre row"""
+        rails = build_home_rails(2)
+        ids = {v: k for k, v in self.videos.items()}
+        self.assertEqual([ids[i] for i in rails["featured"]], ["New Action", "Mid Action"])
+        self.assertEqual([ids[i] for i in rails["trending"]], ["Drama", "Mid Action"])
+        self.assertEqual([ids[i] for i in rails["new"]], ["New Action"])
+        self.assertEqual([(genre, [ids[i] for i in genre_ids]) for genre, genre_ids in rails["genres"]],
+                         [("Action", ["New Action", "Mid Action"]), ("Drama", ["Drama"])])
+
+    def test_rails_endpoint(self):
+        """Test the endpoint returns all rails in one response with the viewer's progress"""
+        response = self.client.get("/videoflix/api/videos/rails/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.titles(response.data["featured"]), ["New Action", "Mid Action"])
+        self.assertEqual(response.data["genres"][1]["genre"], "Drama")
+        self.assertEqual(response.data["trending"][0]["user_progress"]["last_viewed_position"], 42)
+        self.assertEqual(response.data["genres"][1]["videos"][0]["user_progress"]["last_viewed_position"], 42)
+
+    def test_rails_are_served_from_cache(self):
+        """Test a repeated request only runs the validator and progress queries"""
+        self.client.get("/videoflix/api/videos/rails/")
+        with self.assertNumQueries(2):
+            response = self.client.get("/videoflix/api/videos/rails/")
+        self.assertEqual(len(response.data["featured"]), 2)
+
+    @patch("video_app.signals.submit_transcode")
+    def test_change_materializes_rails_for_new_version(self, mock_submit):
+        """Test a committed change rebuilds the rails for the new catalog version in the background"""
+        with self.captureOnCommitCallbacks(execute=True):
+            video = Video.objects.create(title="Newest", file="videos/originals/y.mp4", genre="Drama", is_new=True)
+
+        rails = cache.get(HOME_RAILS_KEY.format(get_catalog_version()))
+        self.assertEqual(rails["new"][0], video.id)
+        response = self.client.get("/videoflix/api/videos/rails/")
+        self.assertEqual(self.titles(response.data["new"]), ["Newest", "New Action"])
@@ -0,0 +1,83 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.test import override_settings
+from video_app.models import Video, UserVideoProgress
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, PROGRESS_WRITE_BEHIND=False)
+class VideoSearchTestCase(APITestCase):
+    def setUp(self):
+        """Set up a small catalog where the same word appears in different fields"""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        Video.objects.bulk_create([
+            Video(title="The Matrix", description="A hacker learns the truth.", genre="Scifi", file="videos/originals/1.mp4"),
+            Video(title="Documentary", description="How the matrix effects were made.", genre="Docs", file="videos/originals/2.mp4"),
+            Video(title="Space Journey", description="Astronauts on a long mission.", genre="Scifi", file="videos/originals/3.mp4"),
+            Video(title="Cooking Basics", description="Learn to cook pasta.", genre="Food", file="videos/originals/4.mp4"),
+        ])
+        self.matrix = Video.objects.get(title="The Matrix")
+
+    def search(self, **params):
+        return self.client.get("/videoflix/api/videos/search/", params)
+
+    def test_title_match_ranks_above_description_match(self):
+        """Test videos are ranked by where the terms appear, title first"""
+        response = self.search(q="matrix")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v["title"] for v in response.data["results"]], ["The Matrix", "Documentary"])
+        self.assertEqual(response.data["count"], 2)
+
+    def test_search_tolerates_typos_in_titles(self):
+        """Test a misspelled title still finds the video through trigram similarity"""
+        response = self.search(q="matrx")
+        self.assertEqual([v["title"] for v in response.data["results"]], ["The Matrix"])
+
+    def test_search_covers_genre_and_stems_words(self):
+        """Test genre is searchable and description words match their stemmed forms"""
+        self.assertEqual(sorted(v["title"] for v in self.search(q="scifi").data["results"]), ["Space Journey", "The Matrix"])
+        self.assertEqual([v["title"] for v in self.search(q="astronaut missions").data["results"]], ["Space Journey"])
+
+    def test_search_is_paginated_and_carries_progress(self):
+        """Test results come in pages of page_size and include the viewer's progress"""
+        UserVideoProgress.objects.create(user=self.user, video=self.matrix, last_viewed_position=12)
+
+        first = self.search(q="matrix", page_size=1)
+        self.assertEqual(len(first.data["results"]), 1)
+        self.assertEqual(first.data["results"][0]["user_progress"]["last_viewed_position"], 12)
+        second = self.client.get(first.data["next"])
+        self.assertEqual([v["title"] for v in second.data["results"]], ["Documentary"])
+        self.assertIsNone(second.data["next"])
+
+    def test_search_requires_terms(self):
+        """Test a missing, blank or oversized query is rejected"""
+        self.assertEqual(self.search().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.search(q="  ").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.search(q="x" * 201).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_admin_search_uses_search_filter(self):
+        """Test the admin changelist search finds videos through the search indexes, typos included"""
+        admin = User.objects.create_superuser(username='admin', password='adminpass')
+        self.client.force_login(admin)
+
+        response = self.client.get("/videoflix/admin/video_app/video/", {"q": "matrx"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v.title for v in response.context["cl"].result_list], ["The Matrix"])
+
+        response = self.client.get("/videoflix/admin/video_app/video/", {"q": "atri"})
+        self.assertEqual([v.title for v in response.context["cl"].result_list], ["The Matrix"])
+
+    def test_admin_substring_search_uses_index(self):
+        """Test the admin's icontains lookup can be answered from the uppercase trigram index"""
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = Video.objects.filter(Q(title__icontains="atri")).explain()
+        self.assertIn("video_title_upper_trgm_idx", plan)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from unittest.mock import patch
+from video_app.media_signing import sign_media_path
+from video_app.segment_cache import cached_media_path, evict_segments, flush_segment_cache_stats
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   MEDIA_DELIVERY='django', SEGMENT_CACHE_SIZE=800, SEGMENT_CACHE_PIN_SIZE=100,
+                   SEGMENT_CACHE_MAX_FILE_SIZE=500)
+class SegmentCacheTestCase(APITestCase):
+    def setUp(self):
+        """Set up a temporary media root and cache directory with one video's HLS output"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.cache_dir = os.path.join(self.media_root, 'segment-cache')
+        media_override = override_settings(MEDIA_ROOT=self.media_root, SEGMENT_CACHE_DIR=self.cache_dir)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        # Counts other tests left pending in this process go out before the counters are reset.
+        flush_segment_cache_stats(force=True)
+        cache.clear()
+
+        self.write('videos/hls/1/master.m3u8', b'#EXTM3U\n')
+        for index in range(4):
+            self.write(f'videos/hls/1/segment_0_00{index}.ts', bytes([index]) * 300)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+
+    def write(self, name, content):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def stats(self):
+        admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        self.client.force_authenticate(user=admin)
+        return self.client.get('/videoflix/api/media/cache-stats/').data
+
+    def test_hit_serves_cached_copy_and_counts_it(self):
+        """Test the second request for a segment is a hit and the bytes it sent are counted"""
+        for _ in range(2):
+            response = self.client.get('/media/videos/hls/1/segment_0_000.ts', HTTP_ACCEPT='video/mp2t')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), b'\x00' * 300)
+
+        response = self.client.get('/media/videos/hls/1/segment_0_000.ts', HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(self.client.get('/videoflix/api/media/cache-stats/').status_code, status.HTTP_403_FORBIDDEN)
+        stats = self.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio']), (2, 1, 0.667))
+        self.assertEqual(stats['bytes_served'], 700)
+        self.assertEqual(stats['bytes_cached'], 300)
+
+    def test_lru_eviction_keeps_pinned_playlist(self):
+        """Test going over the byte budget evicts the least recently used segments but not the playlist"""
+        playlist = cached_media_path('videos/hls/1/master.m3u8')
+        first = cached_media_path('videos/hls/1/segment_0_000.ts')
+        second = cached_media_path('videos/hls/1/segment_0_001.ts')
+        # The playlist is the oldest entry and the first segment was used after the second one.
+        past = time.time() - 60
+        os.utime(playlist, (past - 10, past - 10))
+        os.utime(second, (past, past))
+        cached_media_path('videos/hls/1/segment_0_000.ts')
+        third = cached_media_path('videos/hls/1/segment_0_002.ts')
+        self.assertTrue(os.path.exists(third))
+
+        self.assertTrue(os.path.exists(playlist))
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertEqual(self.stats()['evictions'], 1)
+        self.assertEqual(cache.get(f'segment-cache:{socket.gethostname()}:bytes'), 608)
+        self.assertEqual(evict_segments(), 0)
+
+    def test_changed_or_large_files_are_not_served_stale(self):
+        """Test a rewritten file gets a fresh copy and files over the size limit bypass the cache"""
+        before = cached_media_path('videos/hls/1/master.m3u8')
+        self.write('videos/hls/1/master.m3u8', b'#EXTM3U\n#EXT-X-VERSION:3\n')
+        after = cached_media_path('videos/hls/1/master.m3u8')
+        self.assertNotEqual(before, after)
+        with open(after, 'rb') as f:
+            self.assertEqual(f.read(), b'#EXTM3U\n#EXT-X-VERSION:3\n')
+
+        self.write('videos/hls/1/segment_0_009.ts', b'x' * 501)
+        self.assertIsNone(cached_media_path('videos/hls/1/segment_0_009.ts'))
+        self.assertIsNone(cached_media_path('videos/hls/1/missing.ts'))
+        self.assertIsNone(cached_media_path('thumbnails/1_thumb.jpg'))
+        with override_settings(SEGMENT_CACHE_SIZE=0):
+            self.assertIsNone(cached_media_path('videos/hls/1/segment_0_000.ts'))
+
+    @override_settings(SEGMENT_CACHE_STATS_INTERVAL=60)
+    def test_hits_are_counted_in_process(self):
+        """Test hits only reach the shared counters when the process flushes them"""
+        cached_media_path('videos/hls/1/segment_0_000.ts')
+        flush_segment_cache_stats(force=True)
+        with patch("video_app.segment_cache.count") as mock_count:
+            for _ in range(3):
+                cached_media_path('videos/hls/1/segment_0_000.ts')
+        mock_count.assert_not_called()
+        self.assertEqual(cache.get('segment-cache:hits'), None)
+        self.assertEqual(self.stats()['hits'], 3)
+
+    def test_evicted_copy_falls_back_to_stored_file(self):
+        """Test a copy evicted between lookup and open is served from the stored file instead"""
+        evicted = os.path.join(self.cache_dir, 'evicted.ts')
+        with patch("video_app.views.cached_media_path", return_value=evicted):
+            response = self.client.get('/media/videos/hls/1/segment_0_001.ts', HTTP_ACCEPT='video/mp2t')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), b'\x01' * 300)
+
+            query = sign_media_path('videos/hls/1/master.m3u8')
+            playlist = APIClient().get(f'/media/videos/hls/1/master.m3u8?{query}')
+            self.assertEqual(playlist.status_code, status.HTTP_200_OK)
+            self.assertEqual(playlist.content, b'#EXTM3U\n')
@@ -1,7 +1,11 @@
 from django.test import TestCase, RequestFactory
 from django.contrib.auth.models import User
 from video_app.models import Video, UserVideoProgress
-from video_app.api.serializers import VideoListSerializer, VideoDetailSerializer, UserVideoProgressSerializer
+from video_app.api.serializers import (
+    VIDEO_LIST_VALUES, VideoListSerializer, VideoDetailSerializer, UserVideoProgressSerializer, video_list_data,
+)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
@@ -73,9 +77,38 @@ class VideoSerializerTestCase(TestCase):
         expected_progress = UserVideoProgressSerializer(self.progress).data
 
         self.assertEqual(data["title"], self.video_with_hls.title)
-        self.assertEqual(data["hls_master_playlist_url"], expected_url)
+        url, query = data["hls_master_playlist_url"].split("?")
+        self.assertEqual(url, expected_url)
+        self.assertRegex(query, r"^expires=\d+&signature=[0-9a-f]{64}$")
         self.assertEqual(data["user_progress"], expected_progress)
 
+    def test_video_detail_serializer_storyboard_url(self):
+        """Test VideoDetailSerializer exposes the storyboard track as a signed URL once it exists"""
+        request = self.factory.get("/")
+        request.user = self.user
+        self.assertIsNone(VideoDetailSerializer(instance=self.video_with_hls, context={"request": request}).data["storyboard_vtt_url"])
+
+        self.video_with_hls.storyboard_vtt = f"videos/hls/{self.video_with_hls.id}/storyboard.vtt"
+        data = VideoDetailSerializer(instance=self.video_with_hls, context={"request": request}).data
+
+        expected_url = f"{settings.MEDIA_BASE_URL}videos/hls/{self.video_with_hls.id}/storyboard.vtt?"
+        self.assertTrue(data["storyboard_vtt_url"].startswith(expected_url))
+        self.assertIn("signature=", data["storyboard_vtt_url"])
+
+    def test_video_list_data_matches_serializer_bytes(self):
+        """Test the values() fast path renders exactly the bytes VideoListSerializer renders"""
+        Video.objects.create(title="Ünïcode & spaces", file="videos/originals/my clip (1) ü.mp4",
+                             thumbnail=None, description="", genre="", hls_master_playlist="videos/hls/9/master.m3u8")
+        request = Request(self.factory.get("/videoflix/api/videos/", secure=True))
+        request.user = self.user
+        videos = Video.objects.order_by("id")
+
+        expected = VideoListSerializer(videos, many=True, context={"request": request, "omit_user_progress": True}).data
+        data = video_list_data(videos.values(*VIDEO_LIST_VALUES), request)
+
+        self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+        self.assertEqual(video_list_data(videos.values(*VIDEO_LIST_VALUES), None),
+                         VideoListSerializer(videos, many=True, context={"omit_user_progress": True}).data)
 
     def tearDown(self):
         """Cleanup created files"""
@@ -1,22 +1,80 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.conf import settings
 from unittest.mock import patch
 from video_app.models import Video
-from video_app.tasks import convert_to_hls
+from django.core.cache import cache
+from video_app.tasks import TRANSCODE_LOCK_KEY, dispatch_transcode, submit_transcode
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
 class VideoSignalTestCase(TestCase):
-    @patch("video_app.tasks.convert_to_hls.delay")
+    @patch("video_app.tasks.convert_to_hls.apply_async")
     def test_hls_conversion_signal(self, mock_convert_to_hls):
-        """Test that the signal triggers HLS conversion when a video is created"""
+        """Test that the signal triggers HLS conversion once the transaction creating a video commits"""
         video_file = SimpleUploadedFile("test_video.mp4", b"dummy_video_data", content_type="video/mp4")
         thumbnail_file = SimpleUploadedFile("thumbnail.jpg", b"image_data", content_type="image/jpeg")
 
-        video = Video.objects.create(
-            title="Test Video",
-            file=video_file,
-            thumbnail=thumbnail_file,
-            description="Test Description",
-            genre="Action"
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            video = Video.objects.create(
+                title="Test Video",
+                file=video_file,
+                thumbnail=thumbnail_file,
+                description="Test Description",
+                genre="Action"
+            )
+        mock_convert_to_hls.assert_not_called()
+        for callback in callbacks:
+            callback()
+        mock_convert_to_hls.assert_called_once_with(
+            (video.id,), task_id=video.transcode_task_id, soft_time_limit=settings.TRANSCODE_TIME_LIMIT_MAX,
+            time_limit=settings.TRANSCODE_TIME_LIMIT_MAX + settings.TRANSCODE_TIME_LIMIT_GRACE
         )
-        mock_convert_to_hls.assert_called_once_with(video.id)
+
+    @override_settings(TRANSCODE_TIME_LIMIT_BASE=600, TRANSCODE_TIME_LIMIT_FACTOR=4, TRANSCODE_TIME_LIMIT_GRACE=300)
+    @patch("video_app.tasks.probe_source", return_value={
+        'width': 1280, 'height': 720, 'frame_rate': 25.0, 'duration': 900.0, 'audio_channels': 2, 'audio_layout': 'stereo'
+    })
+    @patch("video_app.tasks.convert_to_hls.apply_async")
+    def test_hls_conversion_time_limits_follow_duration(self, mock_convert_to_hls, mock_probe):
+        """Test the source is probed before queueing and its length sets the task time limits"""
+        video_file = SimpleUploadedFile("test_video.mp4", b"dummy_video_data", content_type="video/mp4")
+        with self.captureOnCommitCallbacks(execute=True):
+            video = Video.objects.create(title="Test Video", file=video_file)
+
+        options = mock_convert_to_hls.call_args[1]
+        self.assertEqual((options['soft_time_limit'], options['time_limit']), (4200, 4500))
+        video.refresh_from_db()
+        self.assertEqual(video.duration, 900.0)
+
+    @patch("video_app.tasks.convert_to_hls.apply_async")
+    def test_hls_conversion_submitted_once(self, mock_convert_to_hls):
+        """Test that submitting a video that is already queued returns the queued task instead of a new one"""
+        video_file = SimpleUploadedFile("test_video.mp4", b"dummy_video_data", content_type="video/mp4")
+        with self.captureOnCommitCallbacks(execute=True):
+            video = Video.objects.create(title="Test Video", file=video_file)
+
+        self.assertEqual(submit_transcode(video.id), video.transcode_task_id)
+        mock_convert_to_hls.assert_called_once()
+
+    @patch("video_app.tasks.probe_source")
+    @patch("video_app.tasks.dispatch_transcode.delay")
+    def test_source_is_probed_on_the_worker(self, mock_dispatch, mock_probe):
+        """Test saving a video only takes the lock and queues the dispatch task, which does the probing"""
+        video_file = SimpleUploadedFile("test_video.mp4", b"dummy_video_data", content_type="video/mp4")
+        with self.captureOnCommitCallbacks(execute=True):
+            video = Video.objects.create(title="Test Video", file=video_file)
+
+        mock_dispatch.assert_called_once_with(video.id, video.transcode_task_id)
+        mock_probe.assert_not_called()
+        self.assertEqual(cache.get(TRANSCODE_LOCK_KEY.format(video.id)), video.transcode_task_id)
+
+    @patch("video_app.tasks.convert_to_hls.apply_async")
+    def test_dispatch_for_deleted_video_releases_lock(self, mock_convert_to_hls):
+        """Test a video deleted before its dispatch runs frees the lock and queues no encode"""
+        cache.set(TRANSCODE_LOCK_KEY.format(999), "task-1")
+
+        dispatch_transcode(999, "task-1")
+
+        mock_convert_to_hls.assert_not_called()
+        self.assertIsNone(cache.get(TRANSCODE_LOCK_KEY.format(999)))
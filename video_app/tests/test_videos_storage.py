@@ -0,0 +1,273 @@
+import boto3
+import os
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from moto import mock_aws
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest.mock import patch
+from video_app.media_signing import sign_media_path
+from video_app.media_storage import local_media_path, store_directory
+from video_app.models import UploadSession, Video
+from video_app.s3_storage import S3MediaStorage
+from video_app.tasks import convert_to_hls
+from video_app.uploads import partial_upload_path
+
+BUCKET = 'videoflix-test'
+S3_STORAGES = {
+    'default': {
+        'BACKEND': 'video_app.s3_storage.S3MediaStorage',
+        'OPTIONS': {'bucket_name': BUCKET, 'region_name': 'us-east-1'},
+    },
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+SOURCE_INFO = {
+    'width': 640, 'height': 360, 'frame_rate': 25.0, 'duration': 12.0,
+    'audio_channels': 2, 'audio_layout': 'stereo',
+}
+
+
+def fake_encode(input_file, output_dir, thumbnail_path, variants, progress=None, tile_size=None):
+    """Stand-in for ffmpeg that writes the files of a two-segment TS encode"""
+    with open(input_file, 'rb') as f:
+        assert f.read() == b"dummy_video_data"
+    for variant in variants:
+        name = variant['variant']
+        with open(os.path.join(output_dir, f'variant_{name}.m3u8'), 'w') as f:
+            f.write(f'#EXTM3U\n#EXTINF:6.0,\nsegment_{name}_000.ts\n#EXTINF:6.0,\nsegment_{name}_001.ts\n')
+        for segment in range(2):
+            with open(os.path.join(output_dir, f'segment_{name}_{segment:03d}.ts'), 'wb') as f:
+                f.write(b'\x47' * 188)
+    with open(thumbnail_path, 'wb') as f:
+        f.write(b'jpeg')
+
+
+@override_settings(
+    STORAGES=S3_STORAGES,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    MEDIA_MULTIPART_THRESHOLD=5 * 1024 * 1024,
+    MEDIA_MULTIPART_CHUNK_SIZE=5 * 1024 * 1024,
+)
+class S3MediaStorageTestCase(TestCase):
+    def setUp(self):
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+
+        self.work_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_root, True)
+        work_override = override_settings(MEDIA_WORK_ROOT=self.work_root,
+                                          SEGMENT_CACHE_DIR=os.path.join(self.work_root, 'segment-cache'))
+        work_override.enable()
+        self.addCleanup(work_override.disable)
+
+    def keys(self, prefix=''):
+        response = self.s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+        return sorted(obj['Key'] for obj in response.get('Contents', []))
+
+    def create_video(self):
+        with patch("video_app.signals.submit_transcode", return_value="task"):
+            return Video.objects.create(
+                title="Stored Video",
+                file=SimpleUploadedFile("stored.mp4", b"dummy_video_data", content_type="video/mp4"),
+            )
+
+    def test_store_directory_uploads_in_parallel_with_multipart(self):
+        """Test a directory is moved into the bucket with HLS content types and large files in parts"""
+        local_dir = os.path.join(self.work_root, 'out')
+        os.makedirs(os.path.join(local_dir, 'sub'))
+        with open(os.path.join(local_dir, 'master.m3u8'), 'w') as f:
+            f.write('#EXTM3U\n')
+        with open(os.path.join(local_dir, 'sub', 'segment_0_000.ts'), 'wb') as f:
+            f.write(b'\x47' * (11 * 1024 * 1024))
+
+        with patch("video_app.media_storage.ThreadPoolExecutor", wraps=ThreadPoolExecutor) as pool:
+            self.assertEqual(store_directory(local_dir, 'videos/hls/7/'), 2)
+
+        pool.assert_called_once_with(max_workers=settings.MEDIA_UPLOAD_WORKERS)
+        self.assertEqual(self.keys(), ['videos/hls/7/master.m3u8', 'videos/hls/7/sub/segment_0_000.ts'])
+        segment = self.s3.head_object(Bucket=BUCKET, Key='videos/hls/7/sub/segment_0_000.ts')
+        self.assertEqual(segment['ContentType'], 'video/mp2t')
+        self.assertTrue(segment['ETag'].endswith('-3"'))
+        playlist = self.s3.head_object(Bucket=BUCKET, Key='videos/hls/7/master.m3u8')
+        self.assertEqual(playlist['ContentType'], 'application/vnd.apple.mpegurl')
+        self.assertFalse(os.path.exists(os.path.join(local_dir, 'master.m3u8')))
+
+    @patch("video_app.transcoding.measure_variant", return_value=(1000, 800))
+    @patch("video_app.tasks.probe_source", return_value=SOURCE_INFO)
+    def test_convert_to_hls_stores_output_in_bucket(self, mock_probe, mock_measure):
+        """Test a worker downloads the source, encodes into its work directory and uploads the result"""
+        video = self.create_video()
+        self.assertEqual(self.keys(), [video.file.name])
+
+        with patch.dict("video_app.tasks.ENCODERS", {settings.HLS_ENCODE_MODE: fake_encode}):
+            convert_to_hls(video.id)
+
+        video.refresh_from_db()
+        self.assertEqual(video.hls_master_playlist.name, f"videos/hls/{video.id}/master.m3u8")
+        hls_keys = self.keys(f"videos/hls/{video.id}/")
+        self.assertIn(video.hls_master_playlist.name, hls_keys)
+        self.assertIn(f"videos/hls/{video.id}/segment_1_001.ts", hls_keys)
+        self.assertIn(f"videos/hls/{video.id}/storyboard.vtt", hls_keys)
+        self.assertEqual(self.keys('thumbnails/'), [f"thumbnails/{video.id}_thumb.jpg"])
+        self.assertEqual(os.listdir(os.path.join(self.work_root, 'videos', 'hls')), [])
+        self.assertFalse(os.path.exists(os.path.join(self.work_root, video.file.name)))
+        # ffprobe reads the headers from a presigned URL instead of downloading the source.
+        self.assertTrue(mock_probe.call_args[0][0].startswith(f"https://{BUCKET}.s3.amazonaws.com/"))
+
+    def test_reuse_and_delete_stay_inside_the_bucket(self):
+        """Test deleting a video removes its original, HLS folder and thumbnail from the bucket"""
+        video = self.create_video()
+        for key in ('master.m3u8', 'segment_0_000.ts'):
+            self.s3.put_object(Bucket=BUCKET, Key=f"videos/hls/{video.id}/{key}", Body=b'x')
+        default_storage.copy_prefix(f"videos/hls/{video.id}/", "videos/hls/999/")
+        self.assertEqual(self.keys("videos/hls/999/"), ["videos/hls/999/master.m3u8", "videos/hls/999/segment_0_000.ts"])
+
+        Video.objects.filter(id=video.id).update(thumbnail=f"thumbnails/{video.id}_thumb.jpg")
+        self.s3.put_object(Bucket=BUCKET, Key=f"thumbnails/{video.id}_thumb.jpg", Body=b'jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            Video.objects.get(id=video.id).delete()
+
+        self.assertEqual(self.keys(), ["videos/hls/999/master.m3u8", "videos/hls/999/segment_0_000.ts"])
+
+    def test_collect_media_garbage_deletes_in_batches(self):
+        """Test the garbage sweep streams the bucket listing and deletes orphans one batch at a time"""
+        video = self.create_video()
+        for key in (f"videos/hls/{video.id}/master.m3u8", "videos/hls/999/master.m3u8",
+                    "videos/hls/999/segment_0_000.ts", "thumbnails/999_thumb.jpg"):
+            self.s3.put_object(Bucket=BUCKET, Key=key, Body=b'xx')
+
+        out = StringIO()
+        with patch.object(type(default_storage._wrapped), "delete_many", autospec=True,
+                          side_effect=type(default_storage._wrapped).delete_many) as mock_delete:
+            call_command("collect_media_garbage", "--min-age", "0", "--batch-size", "2", stdout=out)
+
+        self.assertIn("Freed 6 bytes in 3 files.", out.getvalue())
+        self.assertEqual(mock_delete.call_count, 3)
+        self.assertEqual(self.keys(), sorted([video.file.name, f"videos/hls/{video.id}/master.m3u8"]))
+
+    def test_local_media_path_downloads_once(self):
+        """Test a stored file is downloaded into the work directory once and reused afterwards"""
+        video = self.create_video()
+        path = local_media_path(video.file.name)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b"dummy_video_data")
+
+        with patch.object(type(default_storage._wrapped), "download") as mock_download:
+            self.assertEqual(local_media_path(video.file.name), path)
+        mock_download.assert_not_called()
+
+    def test_concurrent_downloads_use_their_own_partial_file(self):
+        """Test tasks that fetch the same source at once neither clash over nor leave a partial download"""
+        video = self.create_video()
+        storage_class = type(default_storage._wrapped)
+        download = storage_class.download
+        both_started = threading.Barrier(2)
+        both_downloaded = threading.Barrier(2)
+
+        def download_together(storage, name, local_path):
+            both_started.wait(timeout=10)
+            download(storage, name, local_path)
+            both_downloaded.wait(timeout=10)
+
+        with patch.object(storage_class, "download", autospec=True, side_effect=download_together):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                paths = list(pool.map(local_media_path, [video.file.name] * 2))
+
+        self.assertEqual(paths[0], paths[1])
+        with open(paths[0], 'rb') as f:
+            self.assertEqual(f.read(), b"dummy_video_data")
+        self.assertEqual(os.listdir(os.path.dirname(paths[0])), [os.path.basename(paths[0])])
+
+    @override_settings(MEDIA_DELIVERY='django')
+    def test_media_view_reads_from_bucket(self):
+        """Test media requests redirect to a presigned bucket URL, or are served from the segment cache, and signed
+        playlists are read from the bucket"""
+        self.s3.put_object(Bucket=BUCKET, Key="videos/hls/5/master.m3u8", Body=b'#EXTM3U\nvariant_0.m3u8\n')
+        self.s3.put_object(Bucket=BUCKET, Key="videos/hls/5/segment_0_000.ts", Body=b'\x47')
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='viewer', password='secret'))
+
+        with override_settings(SEGMENT_CACHE_SIZE=0):
+            response = client.get("/media/videos/hls/5/segment_0_000.ts")
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertIn(f"{BUCKET}", response["Location"])
+        self.assertIn("Signature", response["Location"])
+        with override_settings(SEGMENT_CACHE_SIZE=1024 * 1024):
+            response = client.get("/media/videos/hls/5/segment_0_000.ts")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'\x47')
+
+        query = sign_media_path("videos/hls/5/master.m3u8")
+        playlist = APIClient().get(f"/media/videos/hls/5/master.m3u8?{query}")
+        self.assertEqual(playlist.content.decode().splitlines()[-1], f"variant_0.m3u8?{query}")
+        missing = APIClient().get(f"/media/videos/hls/5/missing.m3u8?{query}")
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(STORAGES=S3_STORAGES, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class S3UploadFinalizeTestCase(TransactionTestCase):
+    def setUp(self):
+        """Set up a mocked bucket and a finished upload session with its partial file"""
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        self.partial_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.partial_root, True)
+        partial_override = override_settings(UPLOAD_PARTIAL_ROOT=self.partial_root)
+        partial_override.enable()
+        self.addCleanup(partial_override.disable)
+
+        admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        self.session = UploadSession.objects.create(created_by=admin, title="Big Master", filename="master.mp4",
+                                                    size=16, offset=16)
+        with open(partial_upload_path(self.session), 'wb') as f:
+            f.write(b"dummy_video_data")
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+    def row_is_locked(self):
+        """Try to lock the session row from another connection without waiting"""
+        def lock():
+            try:
+                with transaction.atomic():
+                    UploadSession.objects.select_for_update(nowait=True).get(id=self.session.id)
+                return False
+            except DatabaseError:
+                return True
+            finally:
+                connection.close()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(lock).result()
+
+    @patch("video_app.signals.submit_transcode")
+    def test_bucket_upload_runs_outside_the_request_transaction(self, mock_submit):
+        """Test the original is stored in the bucket with no transaction open and the session row unlocked"""
+        seen = []
+        save_local_file = S3MediaStorage.save_local_file
+
+        def record(storage, local_path, name):
+            seen.append((connection.in_atomic_block, self.row_is_locked()))
+            return save_local_file(storage, local_path, name)
+
+        with patch.object(S3MediaStorage, "save_local_file", autospec=True, side_effect=record):
+            response = self.client.post(f"/videoflix/api/videos/uploads/{self.session.id}/complete/")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(seen, [(False, False)])
+        self.session.refresh_from_db()
+        self.assertEqual(default_storage.open(self.session.video.file.name).read(), b"dummy_video_data")
+        mock_submit.assert_called_once()
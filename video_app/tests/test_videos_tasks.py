@@ -1,28 +1,57 @@
 from django.test import TestCase
 from unittest.mock import patch, MagicMock
-from video_app.models import Video
-from video_app.tasks import convert_to_hls, test_celery_task
+from video_app.models import Video, TranscodeJob
+from video_app.tasks import (
+    TRANSCODE_LOCK_KEY, convert_to_hls, finalize_hls, get_transcode_progress, test_celery_task, transcode_time_limits,
+)
+from video_app.transcoding import VARIANTS, file_sha256, write_master_playlist
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 import os
+import shutil
+import tempfile
 from unittest.mock import call
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 
+SOURCE_INFO = {
+    'width': 1280, 'height': 720, 'frame_rate': 25.0, 'duration': 12.0,
+    'audio_channels': 2, 'audio_layout': 'stereo',
+}
+
+
+
+def ffmpeg_process(*args, **kwargs):
+    """Stand-in for an ffmpeg Popen that reports half the source encoded, then exits cleanly"""
+    process = MagicMock(returncode=0)
+    process.stdout = ['frame=150\n', 'out_time_us=6000000\n', 'progress=end\n']
+    return process
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
 class CeleryTasksTestCase(TestCase):
     def setUp(self):
         """Set up test data for Celery tasks"""
         self.video_file = SimpleUploadedFile("test_video.mp4", b"dummy_video_data", content_type="video/mp4")
-        self.video = Video.objects.create(
-            title="Test Video",
-            file=self.video_file,
-            description="This is a test video",
-            genre="Action"
-        )
+        with patch("video_app.signals.submit_transcode"):
+            self.video = Video.objects.create(
+                title="Test Video",
+                file=self.video_file,
+                description="This is a test video",
+                genre="Action"
+            )
 
+    @patch("video_app.tasks.file_sha256", return_value="a" * 64)
+    @patch("video_app.transcoding.measure_variant", return_value=(1000, 800))
+    @patch("video_app.tasks.probe_source", return_value=SOURCE_INFO)
+    @patch("video_app.tasks.subprocess.Popen", side_effect=ffmpeg_process)
     @patch("video_app.tasks.subprocess.run")
     @patch("os.makedirs") 
     @patch("builtins.open", new_callable=MagicMock) 
     @patch("video_app.tasks.logger")  
-    def test_convert_to_hls(self, mock_logger, mock_open, mock_makedirs, mock_subprocess):
+    def test_convert_to_hls(self, mock_logger, mock_open, mock_makedirs, mock_subprocess, mock_popen, mock_probe,
+                            mock_measure, mock_sha256):
         """Test HLS conversion task with all dependencies mocked"""
         mock_subprocess.return_value = MagicMock()
         
@@ -33,14 +62,198 @@ class CeleryTasksTestCase(TestCase):
         ], any_order=True)
 
         self.assertEqual(mock_makedirs.call_count, 2) 
-        mock_open.assert_called_once_with(
-            os.path.join(settings.MEDIA_ROOT, 'videos', 'hls', str(self.video.id), 'master.m3u8'), 'w'
-        )
+        hls_dir = os.path.join(settings.MEDIA_ROOT, 'videos', 'hls', str(self.video.id))
+        mock_open.assert_has_calls([
+            call(os.path.join(hls_dir, 'master.m3u8'), 'w'),
+            call(os.path.join(hls_dir, 'storyboard.vtt'), 'w'),
+        ], any_order=True)
         mock_logger.info.assert_any_call(f"Starting HLS conversion for video ID: {self.video.id}")
         mock_logger.info.assert_any_call(f"Successfully completed HLS conversion for video ID: {self.video.id}")
 
         self.video.refresh_from_db()
         self.assertIsNotNone(self.video.hls_master_playlist)
+        self.assertEqual(self.video.height, 720)
+        self.assertEqual(self.video.content_hash, "a" * 64)
+        self.assertEqual(mock_measure.call_count, 3)
+
+        job = TranscodeJob.objects.get(video=self.video)
+        self.assertEqual(job.state, TranscodeJob.SUCCESS)
+        self.assertEqual(set(job.stage_timings), {'hash', 'probe', 'encode', 'playlist'})
+        self.assertEqual(get_transcode_progress(job.task_id), 100)
+
+    @patch("video_app.transcoding.measure_variant", return_value=(1000, 800))
+    @patch("video_app.tasks.probe_source")
+    @patch("video_app.tasks.subprocess.Popen", side_effect=ffmpeg_process)
+    @patch("video_app.tasks.subprocess.run")
+    @patch("builtins.open", new_callable=MagicMock)
+    def test_convert_to_hls_reuses_probe(self, mock_open, mock_subprocess, mock_popen, mock_probe, mock_measure):
+        """Test a video that was already probed is not probed again"""
+        Video.objects.filter(id=self.video.id).update(content_hash="a" * 64, **SOURCE_INFO)
+        convert_to_hls(self.video.id)
+        mock_probe.assert_not_called()
+
+    @patch("video_app.tasks.probe_source")
+    @patch("video_app.tasks.subprocess.run")
+    def test_convert_to_hls_reuses_identical_upload(self, mock_subprocess, mock_probe):
+        """Test a byte-identical re-upload links the existing HLS output instead of encoding again"""
+        source_dir = os.path.join(settings.MEDIA_ROOT, 'videos', 'hls', str(self.video.id))
+        os.makedirs(source_dir, exist_ok=True)
+        self.addCleanup(shutil.rmtree, source_dir, True)
+        with open(os.path.join(source_dir, 'master.m3u8'), 'w') as f:
+            f.write('#EXTM3U')
+        Video.objects.filter(id=self.video.id).update(
+            hls_master_playlist=f"videos/hls/{self.video.id}/master.m3u8",
+            content_hash=file_sha256(self.video.file.path),
+            **SOURCE_INFO
+        )
+        with patch("video_app.signals.submit_transcode"):
+            duplicate = Video.objects.create(
+                title="Re-upload",
+                file=SimpleUploadedFile("again.mp4", b"dummy_video_data", content_type="video/mp4"),
+            )
+        self.addCleanup(duplicate.delete)
+        self.video.refresh_from_db()
+
+        convert_to_hls(duplicate.id)
+
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.content_hash, self.video.content_hash)
+        self.assertEqual(duplicate.hls_master_playlist.name, f"videos/hls/{duplicate.id}/master.m3u8")
+        self.assertEqual(duplicate.height, 720)
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, duplicate.hls_master_playlist.name)))
+        mock_subprocess.assert_not_called()
+        mock_probe.assert_not_called()
+
+    @patch("video_app.transcoding.measure_variant", return_value=(1000, 800))
+    @patch("video_app.tasks.probe_source")
+    @patch("video_app.tasks.subprocess.Popen", side_effect=ffmpeg_process)
+    @patch("video_app.tasks.subprocess.run")
+    @patch("builtins.open", new_callable=MagicMock)
+    def test_duplicate_without_files_is_encoded(self, mock_open, mock_subprocess, mock_popen, mock_probe, mock_measure):
+        """Test a duplicate whose HLS files are gone, or fail to copy, is encoded instead of failing the job"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        Video.objects.filter(id=self.video.id).update(
+            hls_master_playlist=f"videos/hls/{self.video.id}/master.m3u8", content_hash="a" * 64, **SOURCE_INFO
+        )
+        with patch("video_app.signals.submit_transcode"):
+            duplicate = Video.objects.create(title="Re-upload", file="videos/originals/again.mp4",
+                                             content_hash="a" * 64, **SOURCE_INFO)
+
+        convert_to_hls(duplicate.id)
+
+        job = TranscodeJob.objects.get(video=duplicate)
+        self.assertEqual(job.state, TranscodeJob.SUCCESS)
+        self.assertIn('encode', job.stage_timings)
+        mock_popen.assert_called()
+
+        with patch("video_app.tasks.default_storage.exists", return_value=True), \
+                patch("video_app.tasks.default_storage.copy_prefix", side_effect=FileNotFoundError("gone")), \
+                patch("video_app.tasks.default_storage.delete_prefix") as mock_delete:
+            convert_to_hls(duplicate.id)
+        mock_delete.assert_called_once_with(f"videos/hls/{duplicate.id}/")
+        self.assertEqual(TranscodeJob.objects.filter(video=duplicate, state=TranscodeJob.SUCCESS).count(), 2)
+
+    @patch("video_app.tasks.file_sha256", return_value="a" * 64)
+    @patch("video_app.tasks.probe_source", return_value=SOURCE_INFO)
+    @patch("video_app.tasks.subprocess.Popen", side_effect=OSError("ffmpeg not found"))
+    def test_convert_to_hls_failure(self, mock_popen, mock_probe, mock_sha256):
+        """Test a failing encode is recorded on the job, re-raised and releases the transcode lock"""
+        cache.set(TRANSCODE_LOCK_KEY.format(self.video.id), 'task-id')
+        with self.assertRaises(OSError):
+            convert_to_hls(self.video.id)
+
+        self.assertIsNone(cache.get(TRANSCODE_LOCK_KEY.format(self.video.id)))
+        job = TranscodeJob.objects.get(video=self.video)
+        self.assertEqual(job.state, TranscodeJob.FAILURE)
+        self.assertIn("ffmpeg not found", job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    @patch("video_app.tasks.file_sha256", return_value="a" * 64)
+    @patch("video_app.transcoding.measure_variant", return_value=(1000, 800))
+    @patch("video_app.tasks.probe_source", return_value=SOURCE_INFO)
+    @patch("builtins.open", new_callable=MagicMock)
+    def test_convert_to_hls_retries_ffmpeg_failure(self, mock_open, mock_probe, mock_measure, mock_sha256):
+        """Test a failed ffmpeg run is retried and the transcode lock is kept until the retry finishes"""
+        cache.set(TRANSCODE_LOCK_KEY.format(self.video.id), 'task-id')
+        locks_seen = []
+
+        def flaky_ffmpeg(*args, **kwargs):
+            locks_seen.append(cache.get(TRANSCODE_LOCK_KEY.format(self.video.id)))
+            process = ffmpeg_process()
+            process.returncode = 1 if len(locks_seen) == 1 else 0
+            return process
+
+        with patch("video_app.tasks.subprocess.Popen", side_effect=flaky_ffmpeg), patch("os.makedirs"):
+            convert_to_hls.apply((self.video.id,))
+
+        self.assertEqual(locks_seen, ['task-id', 'task-id'])
+        self.assertIsNone(cache.get(TRANSCODE_LOCK_KEY.format(self.video.id)))
+        self.assertEqual(TranscodeJob.objects.get(video=self.video).state, TranscodeJob.SUCCESS)
+
+    @override_settings(TRANSCODE_TIME_LIMIT_BASE=600, TRANSCODE_TIME_LIMIT_FACTOR=4, TRANSCODE_TIME_LIMIT_MAX=7200,
+                       TRANSCODE_TIME_LIMIT_GRACE=300)
+    def test_time_limits_scale_with_duration(self):
+        """Test time limits grow with the source length up to the configured maximum"""
+        self.assertEqual(transcode_time_limits(60.0), (840, 1140))
+        self.assertEqual(transcode_time_limits(3 * 60 * 60), (7200, 7500))
+        self.assertEqual(transcode_time_limits(None), (7200, 7500))
+
+    @override_settings(HLS_ENCODE_MODE='chord')
+    @patch("video_app.tasks.chord")
+    @patch("video_app.tasks.probe_source", return_value=dict(SOURCE_INFO, height=1080))
+    @patch("video_app.tasks.subprocess.run")
+    @patch("os.makedirs")
+    def test_convert_to_hls_chord_mode(self, mock_makedirs, mock_subprocess, mock_probe, mock_chord):
+        """Test chord mode dispatches one subtask per rendition plus the thumbnail and encodes nothing itself"""
+        cache.set(TRANSCODE_LOCK_KEY.format(self.video.id), 'task-id')
+        convert_to_hls(self.video.id)
+
+        header = mock_chord.call_args[0][0]
+        self.assertEqual(len(header.tasks), len(VARIANTS) + 1)
+        callback = mock_chord.return_value.call_args[0][0]
+        self.assertEqual(callback.task, "video_app.tasks.finalize_hls")
+        mock_subprocess.assert_not_called()
+        self.assertEqual(cache.get(TRANSCODE_LOCK_KEY.format(self.video.id)), 'task-id')
+
+    @patch("video_app.transcoding.measure_variant", return_value=(1000, 800))
+    @patch("builtins.open", new_callable=MagicMock)
+    def test_finalize_hls(self, mock_open, mock_measure):
+        """Test the chord callback writes the master playlist and saves the video"""
+        Video.objects.filter(id=self.video.id).update(**SOURCE_INFO)
+        job = TranscodeJob.objects.create(video=self.video, task_id='task-id', state=TranscodeJob.RUNNING,
+                                          started_at=timezone.now(), stage_timings={'probe': 0.1})
+        finalize_hls(['0', '1', '2', None], self.video.id, job.task_id)
+
+        hls_dir = os.path.join(settings.MEDIA_ROOT, 'videos', 'hls', str(self.video.id))
+        mock_open.assert_has_calls([
+            call(os.path.join(hls_dir, 'master.m3u8'), 'w'),
+            call(os.path.join(hls_dir, 'storyboard.vtt'), 'w'),
+        ], any_order=True)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.hls_master_playlist.name, f"videos/hls/{self.video.id}/master.m3u8")
+        self.assertEqual(self.video.thumbnail.name, f"thumbnails/{self.video.id}_thumb.jpg")
+        self.assertEqual(self.video.storyboard_vtt.name, f"videos/hls/{self.video.id}/storyboard.vtt")
+        job.refresh_from_db()
+        self.assertEqual(job.state, TranscodeJob.SUCCESS)
+        self.assertIn('encode', job.stage_timings)
+
+    @patch("video_app.transcoding.measure_variant", return_value=(5400000, 4800000))
+    def test_master_playlist_attributes(self, mock_measure):
+        """Test the master playlist lists measured bitrates, codecs and frame rate for each rendition"""
+        output_dir = os.path.join(settings.MEDIA_ROOT, 'videos', 'hls', str(self.video.id))
+        os.makedirs(output_dir, exist_ok=True)
+        master_playlist = write_master_playlist(output_dir, VARIANTS[2:], frame_rate=29.97, has_audio=True)
+
+        with open(master_playlist) as f:
+            content = f.read()
+        self.assertIn('#EXT-X-STREAM-INF:BANDWIDTH=5400000,AVERAGE-BANDWIDTH=4800000,RESOLUTION=1280x720,'
+                      'CODECS="avc1.4d401f,mp4a.40.2",FRAME-RATE=29.970', content)
+        self.assertIn('CODECS="avc1.4d4028,mp4a.40.2"', content)
+        self.assertNotIn('variant_0.m3u8', content)
 
     def test_test_celery_task(self):
         """Test a simple Celery task"""
@@ -0,0 +1,246 @@
+from django.test import SimpleTestCase
+from unittest import skipUnless
+from unittest.mock import patch
+from video_app.transcoding import (
+    VARIANTS, Progress, build_single_pass_command, build_thumbnail_command, build_variant_command, encode_chunk,
+    encode_chunked, encode_multi_pass, encode_single_pass, measure_variant, read_media_playlist, select_variants,
+    stitch_variant, storyboard_tile_size, write_dash_manifest, write_storyboard_vtt,
+)
+from django.test import override_settings
+import os
+import shutil
+import subprocess
+import tempfile
+
+CLIP_DURATION = 24
+
+
+class TranscodingTestCase(SimpleTestCase):
+    def test_single_pass_command_decodes_once(self):
+        """Test the single-pass command reads the input once and writes every rendition plus the thumbnail"""
+        cmd = build_single_pass_command('ffmpeg', 'in.mp4', '/out', VARIANTS, '/thumbs/1_thumb.jpg')
+
+        self.assertEqual(cmd.count('-i'), 1)
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        self.assertIn(f'split={len(VARIANTS) + 1}', graph)
+        for v in VARIANTS:
+            self.assertIn(f'scale={v["scale"]}', graph)
+            self.assertIn(f'/out/variant_{v["variant"]}.m3u8', cmd)
+        self.assertEqual(cmd[-1], '/thumbs/1_thumb.jpg')
+
+    def test_single_pass_command_adds_storyboard_branch(self):
+        """Test the storyboard sprites come from the same decode as the renditions and the thumbnail"""
+        cmd = build_single_pass_command('ffmpeg', 'in.mp4', '/out', VARIANTS, '/thumbs/1_thumb.jpg', (160, 90))
+
+        self.assertEqual(cmd.count('-i'), 1)
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        self.assertIn(f'split={len(VARIANTS) + 2}', graph)
+        self.assertIn('[sprites]fps=1/10,scale=160:90,tile=5x5[storyboard]', graph)
+        self.assertEqual(cmd[-1], '/out/storyboard_%03d.jpg')
+
+    def test_thumbnail_command_with_storyboard_decodes_once(self):
+        """Test the standalone thumbnail command also writes the storyboard when a tile size is given"""
+        self.assertIn('-ss', build_thumbnail_command('ffmpeg', 'in.mp4', '/thumbs/1_thumb.jpg'))
+
+        cmd = build_thumbnail_command('ffmpeg', 'in.mp4', '/thumbs/1_thumb.jpg', '/out', (160, 90))
+
+        self.assertNotIn('-ss', cmd)
+        self.assertEqual(cmd.count('-i'), 1)
+        self.assertIn('/thumbs/1_thumb.jpg', cmd)
+        self.assertEqual(cmd[-1], '/out/storyboard_%03d.jpg')
+
+    def test_storyboard_tile_keeps_aspect_ratio(self):
+        """Test tiles are a fixed width with an even height matching the source aspect ratio"""
+        self.assertEqual(storyboard_tile_size(1920, 1080), (160, 90))
+        self.assertEqual(storyboard_tile_size(720, 576), (160, 128))
+        self.assertIsNone(storyboard_tile_size(None, None))
+
+    def test_storyboard_vtt_maps_time_to_tiles(self):
+        """Test each cue points at the sprite sheet and tile shown for its interval"""
+        with tempfile.TemporaryDirectory() as output_dir:
+            with open(write_storyboard_vtt(output_dir, 255.5, (160, 90))) as f:
+                cues = f.read().strip().split('\n\n')
+
+        self.assertEqual(cues[0], 'WEBVTT')
+        self.assertEqual(cues[1], '00:00:00.000 --> 00:00:10.000\nstoryboard_001.jpg#xywh=0,0,160,90')
+        self.assertEqual(cues[7], '00:01:00.000 --> 00:01:10.000\nstoryboard_001.jpg#xywh=160,90,160,90')
+        self.assertEqual(cues[26], '00:04:10.000 --> 00:04:15.500\nstoryboard_002.jpg#xywh=0,0,160,90')
+        self.assertEqual(len(cues), 27)
+
+    def test_select_variants_never_upscales(self):
+        """Test only renditions at or below the source size are picked"""
+        self.assertEqual([v['scale'] for v in select_variants(854, 480)], ['426x240', '640x360'])
+        self.assertEqual(select_variants(3840, 2160), VARIANTS)
+        self.assertEqual(select_variants(256, 144), VARIANTS[:1])
+
+    def test_select_variants_keeps_source_shape(self):
+        """Test portrait, 4:3 and ultra-wide sources get renditions of their own aspect ratio"""
+        portrait = select_variants(1080, 1920)
+        self.assertEqual([v['scale'] for v in portrait], ['240x426', '360x640', '720x1280', '1080x1920'])
+        self.assertEqual([v['bitrate'] for v in portrait], [v['bitrate'] for v in VARIANTS])
+        self.assertEqual([v['scale'] for v in select_variants(640, 480)], ['320x240', '480x360'])
+        self.assertEqual([v['scale'] for v in select_variants(2560, 1080)][-1], '1920x810')
+        self.assertEqual([v['scale'] for v in select_variants(720, 1280)], ['240x426', '360x640', '720x1280'])
+
+    @patch("video_app.transcoding.subprocess.run")
+    def test_single_pass_runs_one_process(self, mock_run):
+        """Test single-pass mode spawns one ffmpeg process instead of one per rendition"""
+        encode_single_pass('in.mp4', '/out', '/thumbs/1_thumb.jpg')
+        self.assertEqual(mock_run.call_count, 1)
+
+    @patch("video_app.transcoding.subprocess.run")
+    def test_multi_pass_runs_one_process_per_rendition(self, mock_run):
+        """Test multi-pass mode spawns one ffmpeg process per rendition and one for the thumbnail"""
+        encode_multi_pass('in.mp4', '/out', '/thumbs/1_thumb.jpg')
+        self.assertEqual(mock_run.call_count, len(VARIANTS) + 1)
+
+    @patch("video_app.transcoding.subprocess.run")
+    def test_chunk_keeps_source_timestamps(self, mock_run):
+        """Test a chunk is encoded on the source timeline with every frame passed through once"""
+        encode_chunk('chunk_0001.ts', '/out', VARIANTS[0])
+        cmd = mock_run.call_args[0][0]
+        self.assertLess(cmd.index('-copyts'), cmd.index('-i'))
+        self.assertEqual(cmd[cmd.index('-fps_mode') + 1], 'passthrough')
+        self.assertLess(cmd.index('-fps_mode'), cmd.index('-f'))
+
+    def test_stitch_variant_numbers_segments_continuously(self):
+        """Test per-chunk playlists are merged into one playlist with a single segment sequence"""
+        with tempfile.TemporaryDirectory() as output_dir:
+            chunk_dirs = []
+            for chunk in range(2):
+                chunk_dir = os.path.join(output_dir, f'chunk_{chunk}')
+                os.makedirs(chunk_dir)
+                with open(os.path.join(chunk_dir, 'variant_0.m3u8'), 'w') as f:
+                    f.write('#EXTM3U\n#EXTINF:5.000000,\nsegment_0_000.ts\n#EXTINF:2.500000,\nsegment_0_001.ts\n')
+                for segment in ('segment_0_000.ts', 'segment_0_001.ts'):
+                    open(os.path.join(chunk_dir, segment), 'w').close()
+                chunk_dirs.append(chunk_dir)
+
+            stitch_variant(chunk_dirs, output_dir, VARIANTS[0])
+
+            entries = read_media_playlist(os.path.join(output_dir, 'variant_0.m3u8'))
+            self.assertEqual([uri for _, uri in entries],
+                             ['segment_0_000.ts', 'segment_0_001.ts', 'segment_0_002.ts', 'segment_0_003.ts'])
+            self.assertEqual(sum(d for d, _ in entries), 15.0)
+            for _, uri in entries:
+                self.assertTrue(os.path.exists(os.path.join(output_dir, uri)))
+
+    def test_progress_reports_each_percent_once(self):
+        """Test progress is only reported when the whole-number percentage changes"""
+        reports = []
+        progress = Progress(100.0, reports.append)
+        for out_time in (0.2, 0.4, 1.0, 1.5, 50.0, 120.0):
+            progress.update(out_time)
+        self.assertEqual(reports, [0, 1, 50, 100])
+
+    def test_progress_parts_cover_the_whole_range(self):
+        """Test the steps of a multi-process encode are mapped onto consecutive slices of 0-100"""
+        reports = []
+        progress = Progress(10.0, reports.append)
+        progress.part(1, 4).update(5.0)
+        progress.part(3, 4).done()
+        self.assertEqual(reports, [37, 100])
+
+    @override_settings(HLS_SEGMENT_FORMAT='fmp4')
+    def test_fmp4_writes_one_file_per_rendition(self):
+        """Test fMP4 mode writes each rendition into a single byte-range addressed file"""
+        cmd = build_variant_command('ffmpeg', 'in.mp4', '/out', VARIANTS[0])
+        self.assertEqual(cmd[cmd.index('-hls_segment_type') + 1], 'fmp4')
+        self.assertEqual(cmd[cmd.index('-hls_flags') + 1], 'single_file')
+        self.assertEqual(cmd[cmd.index('-hls_segment_filename') + 1], '/out/variant_0.mp4')
+
+    @override_settings(HLS_SEGMENT_FORMAT='fmp4')
+    @patch("video_app.transcoding.subprocess.run")
+    def test_chunks_stay_mpegts_in_fmp4_mode(self, mock_run):
+        """Test chunked encodes keep per-segment TS files so they can be stitched"""
+        encode_chunk('chunk_0000.ts', '/out', VARIANTS[0])
+        cmd = mock_run.call_args[0][0]
+        self.assertNotIn('-hls_segment_type', cmd)
+
+    def test_byte_range_playlist_is_measured_and_described_as_dash(self):
+        """Test byte-range segments are measured by range length and listed in the DASH manifest"""
+        with tempfile.TemporaryDirectory() as output_dir:
+            with open(os.path.join(output_dir, 'variant_0.m3u8'), 'w') as f:
+                f.write(
+                    '#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-MAP:URI="variant_0.mp4",BYTERANGE="1000@0"\n'
+                    '#EXTINF:5.000000,\n#EXT-X-BYTERANGE:250000@1000\nvariant_0.mp4\n'
+                    '#EXTINF:2.500000,\n#EXT-X-BYTERANGE:50000@251000\nvariant_0.mp4\n#EXT-X-ENDLIST\n'
+                )
+
+            self.assertEqual(measure_variant(output_dir, VARIANTS[0]), (400000, 320000))
+
+            with open(write_dash_manifest(output_dir, VARIANTS[:1], 7.5, 25.0, True)) as f:
+                manifest = f.read()
+            self.assertIn('<BaseURL>variant_0.mp4</BaseURL>', manifest)
+            self.assertIn('<Initialization range="0-999"/>', manifest)
+            self.assertIn('<SegmentURL mediaRange="1000-250999"/><SegmentURL mediaRange="251000-300999"/>', manifest)
+            self.assertIn('<S d="5000"/><S d="2500"/>', manifest)
+            self.assertIn('mediaPresentationDuration="PT7.500S"', manifest)
+            self.assertIn('<ContentComponent id="1" contentType="video"/><ContentComponent id="2" contentType="audio"/>'
+                          '<Representation', manifest)
+
+            with open(write_dash_manifest(output_dir, VARIANTS[:1], 7.5, 25.0, False)) as f:
+                self.assertNotIn('contentType="audio"', f.read())
+
+
+@skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'needs ffmpeg and ffprobe')
+@override_settings(HLS_SEGMENT_FORMAT='ts')
+class FfmpegTranscodingTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Generate a short test clip with a tone and x264's default keyframe interval of 250 frames"""
+        super().setUpClass()
+        cls.work_dir = tempfile.mkdtemp()
+        cls.clip = os.path.join(cls.work_dir, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'testsrc=size=320x180:rate=30',
+            '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+            '-t', str(CLIP_DURATION), '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+            cls.clip,
+        ], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(dir=self.work_dir)
+
+    def packet_times(self, path, stream):
+        result = subprocess.run([
+            'ffprobe', '-v', 'error', '-select_streams', stream,
+            '-show_entries', 'packet=pts_time', '-of', 'csv=p=0', path,
+        ], check=True, capture_output=True, text=True)
+        return sorted(float(line.strip(',')) for line in result.stdout.split() if line.strip(','))
+
+    def test_single_pass_with_storyboard_keeps_audio_in_every_segment(self):
+        """Test the storyboard branch does not push audio ahead of video in the single-pass renditions"""
+        encode_single_pass(self.clip, self.output_dir, os.path.join(self.output_dir, 'thumb.jpg'), VARIANTS[:1],
+                           tile_size=(160, 90))
+
+        segments = read_media_playlist(os.path.join(self.output_dir, 'variant_0.m3u8'))
+        self.assertGreater(len(segments), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'storyboard_001.jpg')))
+        for _, uri in segments:
+            path = os.path.join(self.output_dir, uri)
+            video, audio = self.packet_times(path, 'v'), self.packet_times(path, 'a')
+            self.assertTrue(audio, uri)
+            self.assertLess(abs(audio[-1] - video[-1]), 1, uri)
+
+    def test_chunked_segments_continue_across_chunk_seams(self):
+        """Test stitched chunk encodes have no sub-second segments and video timestamps that only move forward"""
+        encode_chunked(self.clip, self.output_dir, os.path.join(self.output_dir, 'thumb.jpg'), VARIANTS[:1],
+                       chunk_duration=5, workers=2)
+
+        segments = read_media_playlist(os.path.join(self.output_dir, 'variant_0.m3u8'))
+        self.assertGreater(len(segments), 2)
+        self.assertAlmostEqual(sum(d for d, _ in segments), CLIP_DURATION, delta=0.1)
+        previous = None
+        for duration, uri in segments:
+            self.assertGreaterEqual(duration, 1, uri)
+            video = self.packet_times(os.path.join(self.output_dir, uri), 'v')
+            if previous is not None:
+                self.assertGreater(video[0], previous, uri)
+            previous = video[-1]
@@ -0,0 +1,184 @@
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+from datetime import timedelta
+from unittest.mock import patch
+from video_app.models import Video, UploadSession
+from video_app import uploads
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+
+class UploadSessionAPITestCase(APITestCase):
+    def setUp(self):
+        """Set up an admin client and a temporary media root"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='adminuser', password='adminpassword')
+        self.client.force_authenticate(user=self.admin)
+        self.payload = os.urandom(3000)
+
+    def start_upload(self):
+        response = self.client.post("/videoflix/api/videos/uploads/", {
+            "title": "Big Master", "filename": "master.mp4", "size": len(self.payload), "genre": "Drama"
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return f"/videoflix/api/videos/uploads/{response.data['id']}/"
+
+    def complete(self, url):
+        """Finish an upload, run the storage task it queues and return the video it created"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url + "complete/")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        return Video.objects.get(id=self.client.get(url).data["video"])
+
+    def put_chunk(self, url, start, end, offset=None):
+        return self.client.generic("PUT", url, self.payload[start:end], content_type="application/offset+octet-stream",
+                                   HTTP_UPLOAD_OFFSET=str(start if offset is None else offset))
+
+    @patch("video_app.signals.submit_transcode", return_value="task-1")
+    def test_chunked_upload_creates_video_with_hash(self, mock_submit):
+        """Test chunks are appended in order and finalize creates the video with its content hash"""
+        url = self.start_upload()
+        for start in range(0, len(self.payload), 1000):
+            response = self.put_chunk(url, start, start + 1000)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["offset"], len(self.payload))
+        mock_submit.assert_not_called()
+
+        video = self.complete(url)
+
+        self.assertEqual(video.content_hash, hashlib.sha256(self.payload).hexdigest())
+        with open(video.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertEqual(mock_submit.call_args[0][0], video.id)
+        self.assertFalse(UploadSession.objects.get().finalizing)
+        self.assertEqual(self.client.post(url + "complete/").status_code, status.HTTP_409_CONFLICT)
+
+    def test_wrong_offset_returns_current_offset(self):
+        """Test a chunk sent at the wrong offset is rejected with the offset to resume from"""
+        url = self.start_upload()
+        self.put_chunk(url, 0, 1000)
+
+        response = self.put_chunk(url, 2000, 3000)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["offset"], 1000)
+        self.assertEqual(self.client.get(url).data["offset"], 1000)
+
+    def test_chunk_past_declared_size_is_rejected(self):
+        """Test a chunk that would grow the file past the declared size is refused"""
+        url = self.start_upload()
+        response = self.client.generic("PUT", url, self.payload + b"extra", content_type="application/offset+octet-stream",
+                                       HTTP_UPLOAD_OFFSET="0")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    @patch("video_app.signals.submit_transcode")
+    def test_incomplete_upload_cannot_be_finalized(self, mock_submit):
+        """Test finalize refuses an upload that is missing bytes and queues nothing"""
+        url = self.start_upload()
+        self.put_chunk(url, 0, 1000)
+
+        response = self.client.post(url + "complete/")
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Video.objects.exists())
+        mock_submit.assert_not_called()
+
+    @patch("video_app.signals.submit_transcode", return_value="task-1")
+    def test_hash_catches_up_after_worker_restart(self, mock_submit):
+        """Test the hash is rebuilt from the partial file when another process received earlier chunks"""
+        url = self.start_upload()
+        self.put_chunk(url, 0, 2000)
+        uploads._hashers.clear()
+        self.put_chunk(url, 2000, 3000)
+
+        video = self.complete(url)
+        self.assertEqual(video.content_hash, hashlib.sha256(self.payload).hexdigest())
+
+    def test_chunk_is_refused_while_another_holds_the_lease(self):
+        """Test a second chunk is turned away while one streams, and admitted once that lease has lapsed"""
+        url = self.start_upload()
+        session = UploadSession.objects.get()
+        session.writing_until = timezone.now() + timedelta(seconds=30)
+        session.save()
+
+        response = self.put_chunk(url, 0, 1000)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["offset"], 0)
+
+        UploadSession.objects.update(writing_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.put_chunk(url, 0, 1000).status_code, status.HTTP_200_OK)
+        self.assertIsNone(UploadSession.objects.get().writing_until)
+
+    @override_settings(UPLOAD_LEASE_TIMEOUT=0)
+    def test_chunk_stops_when_its_lease_was_taken_over(self):
+        """Test a chunk whose lease lapsed and was claimed by another writes nothing more and records nothing"""
+        self.start_upload()
+        session = UploadSession.objects.get()
+        uploads.claim_upload(session, 0)
+        UploadSession.objects.update(writing_until=timezone.now() + timedelta(seconds=30))
+
+        with self.assertRaises(uploads.UploadBusy):
+            uploads.write_chunk(session, io.BytesIO(self.payload))
+
+        self.assertEqual(session.offset, 0)
+        self.assertEqual(os.path.getsize(uploads.partial_upload_path(session)), 0)
+
+    def test_hash_states_are_bounded(self):
+        """Test only the most recently used hash states are kept in memory"""
+        uploads._hashers.clear()
+        sessions = [UploadSession(id=f"00000000-0000-0000-0000-00000000000{n}", offset=0) for n in range(3)]
+        with patch.object(uploads, "MAX_CACHED_HASHERS", 2):
+            for session in sessions:
+                uploads.store_hasher(session, hashlib.sha256())
+        self.assertEqual(list(uploads._hashers), [sessions[1].id, sessions[2].id])
+
+    @patch("video_app.signals.submit_transcode")
+    def test_partial_file_lives_in_upload_partial_root(self, mock_submit):
+        """Test chunks go to UPLOAD_PARTIAL_ROOT and the finished file still lands in media storage"""
+        partial_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, partial_root, ignore_errors=True)
+        with override_settings(UPLOAD_PARTIAL_ROOT=partial_root):
+            url = self.start_upload()
+            self.put_chunk(url, 0, len(self.payload))
+            session = UploadSession.objects.get()
+            self.assertTrue(os.path.exists(os.path.join(partial_root, f"{session.id}.part")))
+
+            video = self.complete(url)
+
+        with open(video.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertEqual(os.listdir(partial_root), [])
+
+    def test_delete_removes_partial_file(self):
+        """Test aborting an upload deletes its session and partial file"""
+        url = self.start_upload()
+        self.put_chunk(url, 0, 1000)
+        session = UploadSession.objects.get()
+        path = uploads.partial_upload_path(session)
+        self.assertTrue(os.path.exists(path))
+
+        response = self.client.delete(url)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_upload_requires_admin(self):
+        """Test regular users cannot start an upload"""
+        self.client.force_authenticate(user=User.objects.create_user(username='viewer', password='pw'))
+        response = self.client.post("/videoflix/api/videos/uploads/", {
+            "title": "x", "filename": "x.mp4", "size": 10
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
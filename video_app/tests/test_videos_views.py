@@ -1,13 +1,18 @@
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.contrib.auth.models import User
-from video_app.models import Video, UserVideoProgress
+from video_app.models import Video, UserVideoProgress, TranscodeJob
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.test import override_settings
+from video_app.catalog_cache import bump_catalog_version
 import os
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, PROGRESS_WRITE_BEHIND=False)
 class VideoAPITestCase(APITestCase):
     def setUp(self):
         """Set up test data for API views"""
+        cache.clear()
         self.client = APIClient()
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.client.force_authenticate(user=self.user)
@@ -52,6 +57,28 @@ class VideoAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreater(len(response.data), 0)
 
+    def test_list_videos_query_count_is_constant(self):
+        """Test the catalog list needs the same number of queries for 2 and for 50 videos"""
+        url = "/videoflix/api/videos/?page_size=100"
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.data["results"][0]["user_progress"]["last_viewed_position"], 30)
+
+        videos = Video.objects.bulk_create(
+            Video(title=f"Video {i}", file=f"videos/originals/video_{i}.mp4") for i in range(50)
+        )
+        UserVideoProgress.objects.bulk_create(
+            UserVideoProgress(user=self.user, video=video, last_viewed_position=i) for i, video in enumerate(videos[::2])
+        )
+        bump_catalog_version()
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+
+        self.assertEqual(len(response.data["results"]), 51)
+        progress = {item["id"]: item["user_progress"] for item in response.data["results"]}
+        self.assertEqual(progress[videos[2].id]["last_viewed_position"], 1)
+        self.assertIsNone(progress[videos[1].id])
+
     def test_list_videos_unauthenticated(self):
         """Test retrieving a list of videos fails when unauthenticated"""
         self.client.logout()
@@ -103,6 +130,28 @@ class VideoAPITestCase(APITestCase):
         self.assertIn("file", response.data)
 
 
+    def test_transcode_status_by_video_and_task(self):
+        """Test admins can look up the latest transcode job by video id or by task id"""
+        admin_user = User.objects.create_superuser(username='adminuser3', password='adminpassword3')
+        self.client.force_authenticate(user=admin_user)
+        TranscodeJob.objects.filter(video=self.video).delete()
+        job = TranscodeJob.objects.create(video=self.video, task_id='abc-123', state=TranscodeJob.FAILURE,
+                                          error='ffmpeg exited with 1')
+
+        response = self.client.get(f"/videoflix/api/videos/{self.video.id}/status/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["task_id"], job.task_id)
+        self.assertEqual(response.data["state"], TranscodeJob.FAILURE)
+        self.assertEqual(response.data["error"], 'ffmpeg exited with 1')
+
+        response = self.client.get("/videoflix/api/transcode/abc-123/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["video"], self.video.id)
+
+    def test_transcode_status_requires_admin(self):
+        """Test regular users cannot read transcode status"""
+        response = self.client.get(f"/videoflix/api/videos/{self.video.id}/status/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
     
     
     
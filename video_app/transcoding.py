@@ -0,0 +1,534 @@
+import csv
+import hashlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from video_app.media_storage import media_work_root
+import logging
+logger = logging.getLogger(__name__)
+
+VARIANTS = [
+    {'scale': '426x240', 'bitrate': '500k', 'variant': '0', 'level': '3.0'},
+    {'scale': '640x360', 'bitrate': '1000k', 'variant': '1', 'level': '3.0'},
+    {'scale': '1280x720', 'bitrate': '2500k', 'variant': '2', 'level': '3.1'},
+    {'scale': '1920x1080', 'bitrate': '5000k', 'variant': '3', 'level': '4.0'}
+]
+
+AUDIO_CODEC = 'mp4a.40.2'
+
+THUMBNAIL_OFFSET = 5
+
+STORYBOARD_INTERVAL = 10
+STORYBOARD_TILE_WIDTH = 160
+STORYBOARD_COLUMNS = 5
+STORYBOARD_ROWS = 5
+
+# Shortest stretch of a rendition the BANDWIDTH peak is measured over, in seconds.
+PEAK_WINDOW = 1.0
+
+
+def hls_output_dir(video_id):
+    return os.path.join(media_work_root(), 'videos', 'hls', str(video_id))
+
+
+def thumbnail_output_path(video_id):
+    return os.path.join(media_work_root(), 'thumbnails', f"{video_id}_thumb.jpg")
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_ffmpeg_path():
+    return shutil.which("ffmpeg") or "ffmpeg"
+
+
+def get_ffprobe_path():
+    return shutil.which("ffprobe") or "ffprobe"
+
+
+def parse_frame_rate(rate):
+    num, _, den = rate.partition('/')
+    den = float(den or 1)
+    return float(num) / den if den else 0.0
+
+
+def probe_source(input_file):
+    """Read resolution, frame rate, duration and audio layout of a media file with ffprobe."""
+    result = subprocess.run([
+        get_ffprobe_path(), '-v', 'error',
+        '-print_format', 'json',
+        '-show_streams', '-show_format',
+        input_file
+    ], check=True, capture_output=True, text=True)
+    data = json.loads(result.stdout)
+    video = next(s for s in data['streams'] if s['codec_type'] == 'video')
+    audio = next((s for s in data['streams'] if s['codec_type'] == 'audio'), None)
+    return {
+        'width': video['width'],
+        'height': video['height'],
+        'frame_rate': round(parse_frame_rate(video.get('avg_frame_rate') or video['r_frame_rate']), 3),
+        'duration': float(data['format']['duration']),
+        'audio_channels': audio['channels'] if audio else None,
+        'audio_layout': audio.get('channel_layout', '') if audio else '',
+    }
+
+
+def even(value):
+    return max(2, round(value / 2) * 2)
+
+
+def fit_variant(variant, source_width, source_height):
+    """Return the variant scaled to fit its ladder box, turned to the source orientation, at the source aspect ratio.
+
+    The second item is the scale factor, above 1 when the rendition would upscale the source. Fitting
+    inside the box keeps the pixel count, and so the bitrate and H.264 level, within the rung's.
+    """
+    box_width, box_height = (int(side) for side in variant['scale'].split('x'))
+    if source_height > source_width:
+        box_width, box_height = box_height, box_width
+    factor = min(box_width / source_width, box_height / source_height)
+    scale = f'{even(source_width * factor)}x{even(source_height * factor)}'
+    return dict(variant, scale=scale), factor
+
+
+def select_variants(source_width, source_height):
+    """Return the renditions that do not upscale the source in either dimension, keeping at least the smallest one.
+
+    Portrait and non-16:9 sources get renditions of their own shape, so nothing is stretched.
+    """
+    fitted = [fit_variant(v, source_width, source_height) for v in VARIANTS]
+    variants = [variant for variant, factor in fitted if factor <= 1]
+    return variants or [fitted[0][0]]
+
+
+def video_codec(variant):
+    # Main profile as written by x264: profile_idc 0x4d, constraint_set1 0x40.
+    level = int(round(float(variant['level']) * 10))
+    return f'avc1.4d40{level:02x}'
+
+
+class Progress:
+    """Maps the -progress output of one or more ffmpeg runs onto a single 0-100 percentage.
+
+    ``report`` is only called when the whole-number percentage changes, so a
+    long encode produces at most ~100 writes.
+    """
+
+    def __init__(self, duration, report, start=0.0, span=1.0):
+        self.duration = duration
+        self.report = report
+        self.start = start
+        self.span = span
+        self.last = None
+
+    def part(self, index, count):
+        """Return a Progress for step ``index`` of ``count`` equally weighted steps."""
+        return Progress(self.duration, self.report, self.start + self.span * index / count, self.span / count)
+
+    def update(self, out_time):
+        fraction = min(out_time / self.duration, 1.0) if self.duration else 0.0
+        percent = int((self.start + self.span * fraction) * 100)
+        if percent != self.last:
+            self.last = percent
+            self.report(percent)
+
+    def done(self):
+        self.update(self.duration or 0)
+
+
+def run_command(cmd, progress=None):
+    logger.info(f"Running command: {' '.join(cmd)}")
+    if progress is None:
+        subprocess.run(cmd, check=True)
+        return
+
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    with process:
+        try:
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'out_time_us' and value.isdigit():
+                    progress.update(int(value) / 1000000)
+        except BaseException:
+            # Do not leave ffmpeg running when the task is interrupted, e.g. by its soft time limit.
+            process.kill()
+            raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    progress.done()
+
+
+def segment_args(output_dir, variant, segment_format):
+    if segment_format == 'fmp4':
+        # One fragmented MP4 per rendition, addressed through EXT-X-BYTERANGE.
+        return [
+            '-hls_segment_type', 'fmp4',
+            '-hls_flags', 'single_file',
+            '-hls_segment_filename', os.path.join(output_dir, f'variant_{variant["variant"]}.mp4'),
+        ]
+    return ['-hls_segment_filename', os.path.join(output_dir, f'segment_{variant["variant"]}_%03d.ts')]
+
+
+def hls_output_args(output_dir, variant, segment_format=None):
+    return [
+        '-b:v', variant['bitrate'], '-c:v', 'h264', '-preset', 'fast',
+        '-profile:v', 'main', '-level:v', variant['level'],
+        '-c:a', 'aac', '-b:a', '128k',
+        # Wait for video instead of flushing audio ahead of it when another branch of a shared filter graph,
+        # such as the storyboard's tile filter, holds frames back; otherwise early segments lose their audio.
+        '-max_interleave_delta', '0',
+        '-f', 'hls',
+        '-hls_time', '5',
+        '-hls_list_size', '0',
+    ] + segment_args(output_dir, variant, segment_format or settings.HLS_SEGMENT_FORMAT) + [
+        os.path.join(output_dir, f'variant_{variant["variant"]}.m3u8')
+    ]
+
+
+def build_variant_command(ffmpeg_path, input_file, output_dir, variant, segment_format=None):
+    return [
+        ffmpeg_path, '-y',
+        '-i', input_file,
+        '-vf', f'scale={variant["scale"]}',
+    ] + hls_output_args(output_dir, variant, segment_format)
+
+
+def storyboard_tile_size(width, height):
+    """Return the (width, height) of one preview tile, keeping the source aspect ratio at an even height."""
+    if not width or not height:
+        return None
+    return STORYBOARD_TILE_WIDTH, max(2, round(STORYBOARD_TILE_WIDTH * height / width / 2) * 2)
+
+
+def storyboard_filter(label, tile_size):
+    width, height = tile_size
+    return (f'{label}fps=1/{STORYBOARD_INTERVAL},scale={width}:{height},'
+            f'tile={STORYBOARD_COLUMNS}x{STORYBOARD_ROWS}[storyboard]')
+
+
+def storyboard_output_args(output_dir):
+    return ['-map', '[storyboard]', '-q:v', '5', os.path.join(output_dir, 'storyboard_%03d.jpg')]
+
+
+def build_thumbnail_command(ffmpeg_path, input_file, thumbnail_path, output_dir=None, tile_size=None):
+    if not tile_size:
+        return [
+            ffmpeg_path, '-y',
+            '-ss', f'00:00:{THUMBNAIL_OFFSET:02d}',
+            '-i', input_file,
+            '-vframes', '1',
+            '-q:v', '2',
+            thumbnail_path
+        ]
+    # The storyboard needs every second of the source, so the thumbnail is picked from the same decode.
+    filters = [
+        '[0:v]split=2[thumb][sprites]',
+        f"[thumb]select='gte(t,{THUMBNAIL_OFFSET})'[thumbout]",
+        storyboard_filter('[sprites]', tile_size),
+    ]
+    return [
+        ffmpeg_path, '-y', '-i', input_file, '-filter_complex', ';'.join(filters),
+        '-map', '[thumbout]', '-frames:v', '1', '-q:v', '2', thumbnail_path,
+    ] + storyboard_output_args(output_dir)
+
+
+def build_single_pass_command(ffmpeg_path, input_file, output_dir, variants, thumbnail_path, tile_size=None):
+    """Decode the source once and fan the frames out to every rendition, the thumbnail and the storyboard."""
+    branches = ''.join(f'[v{v["variant"]}]' for v in variants) + '[thumb]' + ('[sprites]' if tile_size else '')
+    filters = [f'[0:v]split={len(variants) + 1 + bool(tile_size)}{branches}']
+    for v in variants:
+        filters.append(f'[v{v["variant"]}]scale={v["scale"]}[out{v["variant"]}]')
+    filters.append(f"[thumb]select='gte(t,{THUMBNAIL_OFFSET})'[thumbout]")
+    if tile_size:
+        filters.append(storyboard_filter('[sprites]', tile_size))
+
+    cmd = [ffmpeg_path, '-y', '-i', input_file, '-filter_complex', ';'.join(filters)]
+    for v in variants:
+        cmd += ['-map', f'[out{v["variant"]}]', '-map', '0:a:0?'] + hls_output_args(output_dir, v)
+    cmd += ['-map', '[thumbout]', '-frames:v', '1', '-q:v', '2', thumbnail_path]
+    if tile_size:
+        cmd += storyboard_output_args(output_dir)
+    return cmd
+
+
+def encode_variant(input_file, output_dir, variant, progress=None):
+    run_command(build_variant_command(get_ffmpeg_path(), input_file, output_dir, variant), progress)
+
+
+def encode_thumbnail(input_file, thumbnail_path, output_dir=None, tile_size=None):
+    run_command(build_thumbnail_command(get_ffmpeg_path(), input_file, thumbnail_path, output_dir, tile_size))
+
+
+def encode_multi_pass(input_file, output_dir, thumbnail_path, variants=VARIANTS, progress=None, tile_size=None):
+    for index, v in enumerate(variants):
+        encode_variant(input_file, output_dir, v, progress and progress.part(index, len(variants)))
+    encode_thumbnail(input_file, thumbnail_path, output_dir, tile_size)
+
+
+def encode_single_pass(input_file, output_dir, thumbnail_path, variants=VARIANTS, progress=None, tile_size=None):
+    ffmpeg_path = get_ffmpeg_path()
+    cmd = build_single_pass_command(ffmpeg_path, input_file, output_dir, variants, thumbnail_path, tile_size)
+    run_command(cmd, progress)
+
+
+def split_into_chunks(input_file, work_dir, chunk_duration):
+    """Cut the source on keyframes into chunks of roughly chunk_duration seconds without re-encoding.
+
+    The chunks are MPEG-TS files that keep the source timestamps at 90 kHz, so each chunk already
+    knows where it sits in the source. Returns the chunk paths in playback order.
+    """
+    chunk_list = os.path.join(work_dir, 'chunks.csv')
+    run_command([
+        get_ffmpeg_path(), '-y',
+        '-i', input_file,
+        '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', str(chunk_duration),
+        '-segment_format_options', 'mpegts_copyts=1',
+        '-segment_list', chunk_list, '-segment_list_type', 'csv',
+        os.path.join(work_dir, 'chunk_%04d.ts')
+    ])
+    with open(chunk_list, newline='') as f:
+        return [os.path.join(work_dir, row[0]) for row in csv.reader(f)]
+
+
+def encode_chunk(input_file, output_dir, variant):
+    """Encode one chunk on the source timeline, so the stitched segments continue where the last chunk ended.
+
+    The chunk's timestamps are kept as they are and every frame is passed through once: shifting
+    chunks by their start time, or letting ffmpeg pad them to a constant frame rate, leaves a
+    one-frame segment at every seam whose timestamps run backwards into the next chunk. Chunks are
+    always written as MPEG-TS because stitching renumbers individual segment files.
+    """
+    cmd = build_variant_command(get_ffmpeg_path(), input_file, output_dir, variant, segment_format='ts')
+    cmd[1:1] = ['-copyts']
+    output_args = cmd.index('-f')
+    cmd[output_args:output_args] = ['-fps_mode', 'passthrough']
+    run_command(cmd)
+
+
+def parse_byterange(value):
+    length, _, offset = value.strip('"').partition('@')
+    return int(length), int(offset or 0)
+
+
+def read_media_segments(playlist_path):
+    """Return the init section and the (duration, uri, byterange) segments of an HLS media playlist.
+
+    byterange is a (length, offset) pair, or None for segments stored in their own file.
+    """
+    init = None
+    entries = []
+    with open(playlist_path) as f:
+        duration = byterange = None
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXT-X-MAP:'):
+                attributes = dict(a.split('=', 1) for a in line[len('#EXT-X-MAP:'):].split(','))
+                init = (attributes['URI'].strip('"'), parse_byterange(attributes['BYTERANGE']))
+            elif line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line.startswith('#EXT-X-BYTERANGE:'):
+                byterange = parse_byterange(line[len('#EXT-X-BYTERANGE:'):])
+            elif line and not line.startswith('#'):
+                entries.append((duration, line, byterange))
+                byterange = None
+    return init, entries
+
+
+def read_media_playlist(playlist_path):
+    """Return the (duration, uri) pairs listed in an HLS media playlist."""
+    return [(duration, uri) for duration, uri, _ in read_media_segments(playlist_path)[1]]
+
+
+def stitch_variant(chunk_dirs, output_dir, variant):
+    """Join the per-chunk playlists of one rendition into a single continuously numbered playlist."""
+    entries = []
+    for chunk_dir in chunk_dirs:
+        for duration, uri in read_media_playlist(os.path.join(chunk_dir, f'variant_{variant["variant"]}.m3u8')):
+            segment_name = f'segment_{variant["variant"]}_{len(entries):03d}.ts'
+            os.replace(os.path.join(chunk_dir, uri), os.path.join(output_dir, segment_name))
+            entries.append((duration, segment_name))
+
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{math.ceil(max(d for d, _ in entries))}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+    ]
+    for duration, segment_name in entries:
+        lines += [f'#EXTINF:{duration:.6f},', segment_name]
+    lines.append('#EXT-X-ENDLIST')
+    with open(os.path.join(output_dir, f'variant_{variant["variant"]}.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def encode_chunked(input_file, output_dir, thumbnail_path, variants=VARIANTS, progress=None, chunk_duration=None,
+                   workers=None, tile_size=None):
+    """Encode keyframe-aligned chunks of the source in parallel ffmpeg processes and stitch the results.
+
+    Progress is reported per finished chunk encode rather than from ffmpeg's output.
+    """
+    chunk_duration = chunk_duration or settings.HLS_CHUNK_DURATION
+    workers = workers or settings.HLS_CHUNK_WORKERS
+    work_dir = tempfile.mkdtemp(prefix='chunks-', dir=output_dir)
+    try:
+        chunks = split_into_chunks(input_file, work_dir, chunk_duration)
+        chunk_dirs = [f'{chunk_path}.hls' for chunk_path in chunks]
+        for chunk_dir in chunk_dirs:
+            os.makedirs(chunk_dir)
+
+        # Each job is its own ffmpeg process, so threads are enough to keep every core busy.
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(encode_thumbnail, input_file, thumbnail_path, output_dir, tile_size)]
+            for chunk_path, chunk_dir in zip(chunks, chunk_dirs):
+                jobs += [pool.submit(encode_chunk, chunk_path, chunk_dir, v) for v in variants]
+            try:
+                for index, job in enumerate(jobs):
+                    job.result()
+                    if progress:
+                        progress.part(index, len(jobs)).done()
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+
+        for v in variants:
+            stitch_variant(chunk_dirs, output_dir, v)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+ENCODERS = {
+    'multi_pass': encode_multi_pass,
+    'single_pass': encode_single_pass,
+    'chunked': encode_chunked,
+}
+
+
+def measure_variant(output_dir, variant):
+    """Return the (peak, average) bitrate in bits per second of an encoded rendition.
+
+    The peak is taken over runs of at least PEAK_WINDOW seconds: a short segment left at a chunk seam
+    or at the end is mostly keyframe and would otherwise set a BANDWIDTH the rendition never needs.
+    """
+    peak = total_bits = total_duration = window_bits = window_duration = 0
+    _, segments = read_media_segments(os.path.join(output_dir, f'variant_{variant["variant"]}.m3u8'))
+    for duration, uri, byterange in segments:
+        size = byterange[0] if byterange else os.path.getsize(os.path.join(output_dir, uri))
+        bits = size * 8
+        total_bits += bits
+        total_duration += duration
+        window_bits += bits
+        window_duration += duration
+        if window_duration >= PEAK_WINDOW:
+            peak = max(peak, window_bits / window_duration)
+            window_bits = window_duration = 0
+    if not peak:
+        peak = total_bits / total_duration
+    return int(peak), int(total_bits / total_duration)
+
+
+def write_master_playlist(output_dir, variants=VARIANTS, frame_rate=None, has_audio=True):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for v in variants:
+        peak, average = measure_variant(output_dir, v)
+        codecs = video_codec(v) + (f',{AUDIO_CODEC}' if has_audio else '')
+        attributes = [
+            f'BANDWIDTH={peak}',
+            f'AVERAGE-BANDWIDTH={average}',
+            f'RESOLUTION={v["scale"]}',
+            f'CODECS="{codecs}"',
+        ]
+        if frame_rate:
+            attributes.append(f'FRAME-RATE={frame_rate:.3f}')
+        lines.append(f'#EXT-X-STREAM-INF:{",".join(attributes)}')
+        lines.append(f'variant_{v["variant"]}.m3u8')
+    master_playlist = os.path.join(output_dir, 'master.m3u8')
+    with open(master_playlist, 'w') as f:
+        f.write('\n'.join(lines))
+    return master_playlist
+
+
+def format_vtt_time(seconds):
+    hours, rest = divmod(round(seconds * 1000), 3600000)
+    minutes, rest = divmod(rest, 60000)
+    return f'{hours:02d}:{minutes:02d}:{rest // 1000:02d}.{rest % 1000:03d}'
+
+
+def write_storyboard_vtt(output_dir, duration, tile_size):
+    """Write a WebVTT track that maps every STORYBOARD_INTERVAL of playback to its tile in the sprite sheets."""
+    width, height = tile_size
+    per_sheet = STORYBOARD_COLUMNS * STORYBOARD_ROWS
+    lines = ['WEBVTT', '']
+    for index in range(math.ceil(duration / STORYBOARD_INTERVAL)):
+        start = index * STORYBOARD_INTERVAL
+        end = min(start + STORYBOARD_INTERVAL, duration)
+        sheet, position = divmod(index, per_sheet)
+        row, column = divmod(position, STORYBOARD_COLUMNS)
+        lines += [
+            f'{format_vtt_time(start)} --> {format_vtt_time(end)}',
+            f'storyboard_{sheet + 1:03d}.jpg#xywh={column * width},{row * height},{width},{height}',
+            '',
+        ]
+    storyboard_vtt = os.path.join(output_dir, 'storyboard.vtt')
+    with open(storyboard_vtt, 'w') as f:
+        f.write('\n'.join(lines))
+    return storyboard_vtt
+
+
+def write_dash_manifest(output_dir, variants=VARIANTS, duration=None, frame_rate=None, has_audio=True):
+    """Describe the fMP4 renditions as a static DASH manifest over the same files the HLS playlists use.
+
+    Every rendition carries its audio muxed in, as the HLS variants need, so the manifest has a single
+    video AdaptationSet whose ContentComponents declare both tracks. Players that only handle
+    demuxed DASH, such as dash.js, cannot play it; that would need a separate audio-only rendition.
+    """
+    representations = []
+    for v in variants:
+        init, segments = read_media_segments(os.path.join(output_dir, f'variant_{v["variant"]}.m3u8'))
+        _, average = measure_variant(output_dir, v)
+        width, height = v['scale'].split('x')
+        codecs = video_codec(v) + (f',{AUDIO_CODEC}' if has_audio else '')
+        init_uri, (init_length, init_offset) = init
+        timeline = ''.join(f'<S d="{round(d * 1000)}"/>' for d, _, _ in segments)
+        ranges = ''.join(
+            f'<SegmentURL mediaRange="{offset}-{offset + length - 1}"/>' for _, _, (length, offset) in segments
+        )
+        frame_rate_attr = f' frameRate="{frame_rate:g}"' if frame_rate else ''
+        representations.append(
+            f'<Representation id="{v["variant"]}" bandwidth="{average}" width="{width}" height="{height}"'
+            f'{frame_rate_attr} codecs="{codecs}">'
+            f'<BaseURL>{init_uri}</BaseURL>'
+            f'<SegmentList timescale="1000">'
+            f'<Initialization range="{init_offset}-{init_offset + init_length - 1}"/>'
+            f'<SegmentTimeline>{timeline}</SegmentTimeline>{ranges}'
+            f'</SegmentList></Representation>'
+        )
+        duration = duration or sum(d for d, _, _ in segments)
+
+    components = '<ContentComponent id="1" contentType="video"/>'
+    if has_audio:
+        components += '<ContentComponent id="2" contentType="audio"/>'
+    manifest = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" profiles="urn:mpeg:dash:profile:isoff-main:2011" '
+        f'type="static" mediaPresentationDuration="PT{duration:.3f}S" minBufferTime="PT5S">'
+        '<Period><AdaptationSet mimeType="video/mp4" segmentAlignment="true">'
+        + components + ''.join(representations) +
+        '</AdaptationSet></Period></MPD>\n'
+    )
+    manifest_path = os.path.join(output_dir, 'manifest.mpd')
+    with open(manifest_path, 'w') as f:
+        f.write(manifest)
+    return manifest_path
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from video_app.models import UploadSession, Video
+import logging
+logger = logging.getLogger(__name__)
+
+UPLOAD_READ_SIZE = 1024 * 1024
+# Hash states kept in memory, least recently used first; an evicted one is rebuilt from the partial file.
+MAX_CACHED_HASHERS = 256
+
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class UploadOffsetMismatch(Exception):
+    pass
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadBusy(Exception):
+    pass
+
+
+def partial_upload_path(session):
+    """Return where the chunks of a session are appended, which every web node taking chunks must share."""
+    root = settings.UPLOAD_PARTIAL_ROOT or os.path.join(settings.MEDIA_ROOT, 'videos', 'uploads')
+    return os.path.join(root, f'{session.id}.part')
+
+
+def get_hasher(session, path):
+    """Return a sha256 of the first session.offset bytes of the partial file.
+
+    The hash state of a session lives in the process that received its last chunk. When a chunk
+    lands on another worker, or after a restart, the missing bytes are read back from disk once.
+    """
+    with _hashers_lock:
+        hasher, position = _hashers.pop(session.id, (None, 0))
+    if hasher is None or position > session.offset:
+        hasher, position = hashlib.sha256(), 0
+    if position < session.offset:
+        logger.info(f"Catching up upload hash of session {session.id} from byte {position}")
+        with open(path, 'rb') as f:
+            f.seek(position)
+            remaining = session.offset - position
+            while remaining:
+                block = f.read(min(UPLOAD_READ_SIZE, remaining))
+                if not block:
+                    raise OSError(f"Partial upload {path} is shorter than its recorded offset")
+                hasher.update(block)
+                remaining -= len(block)
+    return hasher
+
+
+def store_hasher(session, hasher):
+    with _hashers_lock:
+        _hashers[session.id] = (hasher, session.offset)
+        _hashers.move_to_end(session.id)
+        while len(_hashers) > MAX_CACHED_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def discard_upload(session):
+    with _hashers_lock:
+        _hashers.pop(session.id, None)
+    path = partial_upload_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.UPLOAD_LEASE_TIMEOUT)
+
+
+def claim_upload(session, offset):
+    """Lease the session to one chunk starting at offset.
+
+    The caller holds a row lock on the session only for this call. The chunk is streamed after
+    that transaction commits, and the lease keeps other chunks out in the meantime. A lease left
+    behind by a crashed worker lapses after UPLOAD_LEASE_TIMEOUT.
+    """
+    if session.finalizing or session.video_id:
+        raise UploadBusy()
+    if offset != session.offset:
+        raise UploadOffsetMismatch()
+    if session.writing_until and session.writing_until > timezone.now():
+        raise UploadBusy()
+    session.writing_until = lease_expiry()
+    session.save(update_fields=['writing_until', 'updated_at'])
+
+
+def update_leased(session, writing_until, **fields):
+    """Write fields and the new lease expiry, unless another chunk took the session over after our lease lapsed."""
+    updated = UploadSession.objects.filter(id=session.id, writing_until=session.writing_until).update(
+        writing_until=writing_until, updated_at=timezone.now(), **fields)
+    session.writing_until = writing_until
+    return bool(updated)
+
+
+def write_chunk(session, stream):
+    """Append the request body to the partial file without holding it in memory.
+
+    The caller must have claimed the session with claim_upload. The lease is renewed while the body
+    streams, and released with whatever reached the disk recorded as the new offset, even if the
+    client drops mid-chunk, so the next PUT can resume from there.
+    """
+    path = partial_upload_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        open(path, 'wb').close()
+    hasher = get_hasher(session, path)
+    remaining = session.size - session.offset
+    renew_at = time.monotonic() + settings.UPLOAD_LEASE_TIMEOUT / 2
+    leased = True
+
+    try:
+        with open(path, 'r+b') as f:
+            f.truncate(session.offset)
+            f.seek(session.offset)
+            while True:
+                block = stream.read(UPLOAD_READ_SIZE)
+                if not block:
+                    break
+                if len(block) > remaining:
+                    raise UploadTooLarge()
+                if time.monotonic() >= renew_at:
+                    leased = update_leased(session, lease_expiry())
+                    if not leased:
+                        raise UploadBusy()
+                    renew_at = time.monotonic() + settings.UPLOAD_LEASE_TIMEOUT / 2
+                f.write(block)
+                hasher.update(block)
+                session.offset += len(block)
+                remaining -= len(block)
+    finally:
+        if leased:
+            store_hasher(session, hasher)
+            update_leased(session, None, offset=session.offset)
+        else:
+            logger.warning(f"Upload {session.id} was taken over by another chunk after its lease lapsed")
+            session.refresh_from_db(fields=['offset', 'writing_until'])
+
+
+def claim_finalize(session):
+    """Mark a finished upload as being stored, so no chunk, second completion or abort touches it meanwhile.
+
+    The caller holds a row lock on the session for this call only; the store_upload task moves the
+    file once that transaction has committed. Returns the content hash if this process still has it
+    in memory, so the worker does not have to read the whole file again.
+    """
+    if not session.is_complete:
+        raise UploadOffsetMismatch()
+    if session.finalizing or session.video_id or (session.writing_until and session.writing_until > timezone.now()):
+        raise UploadBusy()
+    session.finalizing = True
+    session.save(update_fields=['finalizing', 'updated_at'])
+    with _hashers_lock:
+        hasher, position = _hashers.get(session.id, (None, 0))
+    return hasher.hexdigest() if hasher is not None and position == session.offset else None
+
+
+def finalize_upload(session, content_hash=None):
+    """Move the finished upload into the originals in media storage and return the unsaved Video for it."""
+    if not session.is_complete:
+        raise UploadOffsetMismatch()
+    path = partial_upload_path(session)
+    content_hash = content_hash or get_hasher(session, path).hexdigest()
+
+    file_field = Video._meta.get_field('file')
+    name = file_field.storage.get_available_name(file_field.generate_filename(None, session.filename))
+    file_field.storage.save_local_file(path, name)
+    with _hashers_lock:
+        _hashers.pop(session.id, None)
+
+    return Video(
+        title=session.title,
+        description=session.description,
+        genre=session.genre,
+        file=name,
+        content_hash=content_hash,
+    )
@@ -0,0 +1,236 @@
+import os
+import posixpath
+import re
+import time
+from urllib.parse import quote, urlencode
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
+from video_app.media_signing import sign_dash_manifest, sign_playlist, sign_storyboard, verify_media_signature
+from video_app.media_storage import is_local_storage, media_content_type
+from video_app.segment_cache import cached_media_path, count_served
+
+# Thumbnails are shown in <img> tags, which cannot send a token.
+PUBLIC_MEDIA_PREFIXES = ('thumbnails/',)
+# Partial uploads are never served, not even to their uploader.
+HIDDEN_MEDIA_PREFIXES = ('videos/uploads/',)
+# Text manifests whose relative URIs need the signature of the request that fetched them.
+SIGNED_MANIFESTS = {
+    '.m3u8': sign_playlist,
+    '.mpd': sign_dash_manifest,
+    '.vtt': sign_storyboard,
+}
+# Segments and originals are never rewritten under the same name, so players may keep them without asking again.
+IMMUTABLE_MEDIA_PREFIXES = ('videos/hls/', 'videos/originals/')
+IMMUTABLE_MEDIA_EXTENSIONS = ('.ts', '.m4s', '.mp4')
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Read size when the server has no wsgi.file_wrapper; FileResponse defaults to 4 KiB.
+MEDIA_BLOCK_SIZE = 64 * 1024
+
+
+def media_response(request, path):
+    """Answer with the media file at path, relative to MEDIA_ROOT, the way settings.MEDIA_DELIVERY says.
+
+    With 'x-accel' or 'x-sendfile' the response carries no body: the front proxy reads the header and
+    streams the file itself with sendfile, so no worker is held while the bytes go out. With remote
+    storage 'x-accel' works the same, with the internal location proxying to the bucket, and the other
+    modes redirect to a presigned bucket URL. Only with 'django' are HLS files sent from the node's
+    segment cache, so hot segments are read from memory rather than disk or bucket; the other modes
+    leave the bytes to the proxy or the bucket.
+    """
+    local = is_local_storage()
+    full_path = os.path.join(settings.MEDIA_ROOT, path)
+    # A missing object in a bucket is reported by the bucket; a HEAD request per file would cost more.
+    if local and not os.path.isfile(full_path):
+        raise Http404
+    content_type = media_content_type(path)
+    if settings.MEDIA_DELIVERY == 'django' and (response := cached_file_response(request, path, content_type)):
+        return response
+    if settings.MEDIA_DELIVERY == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+    elif not local:
+        response = HttpResponseRedirect(default_storage.url(path))
+    elif settings.MEDIA_DELIVERY == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = os.path.abspath(full_path)
+    else:
+        response = file_response(request, full_path, content_type)
+    return response
+
+
+def cached_file_response(request, path, content_type):
+    """Stream path from the segment cache, or return None if it is not cached or its copy was just evicted."""
+    if request.method != 'GET' or not (cached := cached_media_path(path)):
+        return None
+    try:
+        response = file_response(request, cached, content_type)
+    except FileNotFoundError:
+        return None
+    count_served(response)
+    return response
+
+
+def read_media_file(path):
+    """Return the bytes of a stored file, from the segment cache when it holds a copy."""
+    cached = cached_media_path(path)
+    if cached:
+        try:
+            with open(cached, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted since the lookup; the stored file is still there.
+            pass
+    with default_storage.open(path) as f:
+        return f.read()
+
+
+def parse_range(header, size):
+    """Return the inclusive (start, end) bytes a Range header asks for, or None to send the whole file.
+
+    Only a single range is honoured, which is all players ask for; anything else gets the full file,
+    as RFC 9110 allows. A start at or past size means the range cannot be satisfied.
+    """
+    match = RANGE_HEADER.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        return max(size - int(last), 0) if int(last) else size, size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+class FileRange:
+    """A file limited to length bytes from start.
+
+    It keeps fileno(), so a wsgi.file_wrapper that uses sendfile, like gunicorn's, sends the bytes
+    straight from the page cache: it starts at the file offset and stops at Content-Length.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(request, full_path, content_type):
+    """Stream a file from Django, answering Range requests with 206 and HEAD requests without opening it."""
+    stat = os.stat(full_path)
+    last_modified = http_date(stat.st_mtime)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    size = stat.st_size
+    byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if byte_range is not None and if_range is not None and if_range != last_modified:
+        byte_range = None
+    if byte_range is not None and byte_range[0] >= size:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    else:
+        response = FileResponse(FileRange(open(full_path, 'rb'), start, length), content_type=content_type)
+        response.block_size = MEDIA_BLOCK_SIZE
+    if byte_range is not None:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = last_modified
+    return response
+
+
+def media_cache_control(path, public, expires=None):
+    """Return the Cache-Control of a media file; only responses that need no credentials may be shared.
+
+    A response to a signed URL is kept no longer than the signature is valid, so a CDN stops serving
+    it once the URL has expired.
+    """
+    scope = 'public' if public else 'private'
+    extension = os.path.splitext(path)[1].lower()
+    if path.startswith(IMMUTABLE_MEDIA_PREFIXES) and extension in IMMUTABLE_MEDIA_EXTENSIONS:
+        if expires is not None:
+            return f'{scope}, max-age={max(0, min(settings.MEDIA_SEGMENT_MAX_AGE, expires - int(time.time())))}'
+        return f'{scope}, max-age={settings.MEDIA_SEGMENT_MAX_AGE}, immutable'
+    # Playlists and thumbnails are rewritten when a video is transcoded again.
+    return f'{scope}, no-cache'
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    # Players ask for media types like video/mp2t; only error responses are rendered, always as JSON.
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def signed_manifest_response(path, sign, query):
+    try:
+        content = sign(read_media_file(path).decode('utf-8'), query)
+    except FileNotFoundError:
+        raise Http404
+    return HttpResponse(content, content_type=media_content_type(path))
+
+
+class MediaView(APIView):
+    permission_classes = [AllowAny]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def perform_authentication(self, request):
+        # request.user is resolved on first use, so signed requests never look up a token or session.
+        pass
+
+    def get(self, request, path, *args, **kwargs):
+        path = posixpath.normpath(path).lstrip('/')
+        if path.startswith('..') or path.startswith(HIDDEN_MEDIA_PREFIXES):
+            raise Http404
+
+        signature = request.query_params.get('signature')
+        sign = None
+        if signature is not None:
+            expires = request.query_params.get('expires')
+            if not verify_media_signature(path, expires, signature):
+                raise PermissionDenied("Invalid or expired media signature.")
+            sign = SIGNED_MANIFESTS.get(os.path.splitext(path)[1].lower())
+        elif not path.startswith(PUBLIC_MEDIA_PREFIXES) and not request.user.is_authenticated:
+            raise NotAuthenticated()
+
+        if sign is not None:
+            response = signed_manifest_response(path, sign, urlencode({'expires': expires, 'signature': signature}))
+        else:
+            response = media_response(request, path)
+        public = signature is not None or path.startswith(PUBLIC_MEDIA_PREFIXES)
+        response['Cache-Control'] = media_cache_control(path, public, int(expires) if signature is not None else None)
+        return response
@@ -0,0 +1,27 @@
+import os
+from celery import Celery
+from kombu import Queue
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'videoflix.settings')
+
+app = Celery('videoflix')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Encodes run for minutes to hours, so they get their own queue and workers
+# (celery -A videoflix worker -Q transcode --concurrency=1) and can never hold
+# up the short tasks on the default queue (celery -A videoflix worker -Q default).
+# dispatch_transcode, which only probes the source, stays on the default queue.
+app.conf.task_queues = (
+    Queue('default'),
+    Queue('transcode'),
+)
+app.conf.task_routes = {
+    'video_app.tasks.convert_to_hls': {'queue': 'transcode'},
+    'video_app.tasks.encode_rendition': {'queue': 'transcode'},
+    'video_app.tasks.generate_thumbnail': {'queue': 'transcode'},
+}
+# Each worker process reserves only the task it is running, so a queued encode
+# waits for a free worker instead of sitting behind a busy one.
+app.conf.worker_prefetch_multiplier = 1
+
+app.autodiscover_tasks()
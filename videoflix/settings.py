@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 import os
 from urllib.parse import urlparse
@@ -28,6 +29,76 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv("DEBUG") == "True"
 
+# How /media/ files reach the client once MediaView has checked access. 'x-accel'
+# hands them to nginx with an X-Accel-Redirect into the internal
+# MEDIA_ACCEL_PREFIX location, 'x-sendfile' sets X-Sendfile for Apache or
+# lighttpd, and 'django' streams them from Python with Range support, which is
+# meant for development.
+MEDIA_DELIVERY = os.getenv('MEDIA_DELIVERY') or ('django' if DEBUG else 'x-accel')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# How long players may keep segments and originals, which never change under their name.
+MEDIA_SEGMENT_MAX_AGE = int(os.getenv('MEDIA_SEGMENT_MAX_AGE', 365 * 24 * 60 * 60))
+# Video, playlist and storyboard URLs in API responses point at MEDIA_BASE_URL and
+# carry an HMAC signature that grants access for at least MEDIA_URL_TTL seconds,
+# without a token: to the whole HLS directory of a video, or to a single original.
+# Thumbnail URLs are not signed, since thumbnails are public.
+MEDIA_BASE_URL = os.getenv('MEDIA_BASE_URL', 'http://127.0.0.1:8000/media/')
+MEDIA_SIGNING_KEY = os.getenv('MEDIA_SIGNING_KEY') or SECRET_KEY
+MEDIA_URL_TTL = int(os.getenv('MEDIA_URL_TTL', 6 * 60 * 60))
+# Where media files are stored. 'local' keeps them under MEDIA_ROOT. 's3' keeps
+# them in an S3-compatible bucket, so web and worker nodes share no disk:
+# workers download sources to MEDIA_WORK_ROOT, encode there and upload the
+# output with at most MEDIA_UPLOAD_WORKERS files in flight, each as a multipart
+# upload above MEDIA_MULTIPART_THRESHOLD. In 'chord' mode the workers of one
+# video still need a shared MEDIA_WORK_ROOT.
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'local')
+MEDIA_WORK_ROOT = os.getenv('MEDIA_WORK_ROOT', '/tmp/videoflix')
+MEDIA_UPLOAD_WORKERS = int(os.getenv('MEDIA_UPLOAD_WORKERS', 8))
+MEDIA_MULTIPART_THRESHOLD = int(os.getenv('MEDIA_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+MEDIA_MULTIPART_CHUNK_SIZE = int(os.getenv('MEDIA_MULTIPART_CHUNK_SIZE', 16 * 1024 * 1024))
+MEDIA_MULTIPART_CONCURRENCY = int(os.getenv('MEDIA_MULTIPART_CONCURRENCY', 4))
+# Resumable uploads append their chunks to a partial file in UPLOAD_PARTIAL_ROOT,
+# MEDIA_ROOT/videos/uploads when empty. Once complete, the store_upload task on
+# the default queue moves it into media storage. Every web node that may receive
+# a chunk and every default-queue worker must see that directory: with
+# MEDIA_STORAGE=s3 and separate nodes, point it at a shared volume. A chunk leases its session for
+# UPLOAD_LEASE_TIMEOUT seconds, renewed while it streams, so a worker that dies
+# mid-chunk blocks the upload for at most that long.
+UPLOAD_PARTIAL_ROOT = os.getenv('UPLOAD_PARTIAL_ROOT', '')
+UPLOAD_LEASE_TIMEOUT = int(os.getenv('UPLOAD_LEASE_TIMEOUT', 60))
+MEDIA_STORAGE_BACKENDS = {
+    'local': {'BACKEND': 'video_app.media_storage.LocalMediaStorage'},
+    's3': {
+        'BACKEND': 'video_app.s3_storage.S3MediaStorage',
+        'OPTIONS': {
+            'bucket_name': os.getenv('MEDIA_S3_BUCKET'),
+            'endpoint_url': os.getenv('MEDIA_S3_ENDPOINT_URL'),
+            'region_name': os.getenv('MEDIA_S3_REGION'),
+            'access_key': os.getenv('MEDIA_S3_ACCESS_KEY'),
+            'secret_key': os.getenv('MEDIA_S3_SECRET_KEY'),
+            'querystring_expire': MEDIA_URL_TTL,
+        },
+    },
+}
+STORAGES = {
+    'default': MEDIA_STORAGE_BACKENDS[MEDIA_STORAGE],
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# With MEDIA_DELIVERY 'django', HLS files are served from copies in
+# SEGMENT_CACHE_DIR, a tmpfs shared by every worker process of a node. At most
+# SEGMENT_CACHE_SIZE bytes are kept, least recently used first out; playlists up
+# to SEGMENT_CACHE_PIN_SIZE stay until no segment is left. 0 turns it off. With
+# the default 'x-accel' nginx sends the files and only signed playlists are read
+# through the cache, so it does little there.
+SEGMENT_CACHE_DIR = os.getenv('SEGMENT_CACHE_DIR', '/dev/shm/videoflix-segments')
+SEGMENT_CACHE_SIZE = int(os.getenv('SEGMENT_CACHE_SIZE', 256 * 1024 * 1024 if os.path.isdir('/dev/shm') else 0))
+SEGMENT_CACHE_PIN_SIZE = int(os.getenv('SEGMENT_CACHE_PIN_SIZE', 64 * 1024))
+SEGMENT_CACHE_MAX_FILE_SIZE = int(os.getenv('SEGMENT_CACHE_MAX_FILE_SIZE', 16 * 1024 * 1024))
+# How long a playlist copied from a bucket is served before it is fetched again.
+SEGMENT_CACHE_PLAYLIST_TTL = int(os.getenv('SEGMENT_CACHE_PLAYLIST_TTL', 60))
+# How often each process adds its hit, miss and bytes-served counts to the shared counters.
+SEGMENT_CACHE_STATS_INTERVAL = int(os.getenv('SEGMENT_CACHE_STATS_INTERVAL', 10))
+
 ALLOWED_HOSTS = ['127.0.0.1', 'localhost', 'vm.ogulcan-erdag.com',
  'videoflix.ogulcan-erdag.com', 'ogulcan-erdag.developerakademie.net', 
  'videoflx.ogulcan-erdag.com', '2.59.134.5']
@@ -44,6 +115,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'corsheaders',
     'rest_framework',
     'rest_framework.authtoken',
@@ -131,10 +203,44 @@ CELERY_BROKER_URL = REDIS_URL
 
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', REDIS_URL)
 
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', REDIS_URL)
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_TASK_DEFAULT_QUEUE = 'default'
 CELERY_TASK_SERIALIZER = 'json'
 
+# HLS transcoding: 'single_pass' decodes the source once for all renditions,
+# 'multi_pass' runs one ffmpeg process per rendition, 'chord' fans the
+# renditions out as separate Celery tasks across workers and 'chunked' cuts
+# the source into keyframe-aligned chunks that are encoded in parallel.
+HLS_ENCODE_MODE = os.getenv('HLS_ENCODE_MODE', 'single_pass')
+HLS_CHUNK_DURATION = int(os.getenv('HLS_CHUNK_DURATION', 60))
+HLS_CHUNK_WORKERS = int(os.getenv('HLS_CHUNK_WORKERS') or os.cpu_count())
+# 'ts' writes one MPEG-TS file per segment, 'fmp4' one fragmented MP4 per
+# rendition with byte-range playlists and a DASH manifest over the same files.
+# Audio stays muxed into every rendition, so the DASH manifest needs a player
+# that accepts muxed representations; dash.js, for one, does not.
+# 'chunked' stitches per-segment MPEG-TS files, so it only supports 'ts'.
+HLS_SEGMENT_FORMAT = os.getenv('HLS_SEGMENT_FORMAT', 'ts')
+if HLS_ENCODE_MODE == 'chunked' and HLS_SEGMENT_FORMAT != 'ts':
+    raise ImproperlyConfigured("HLS_ENCODE_MODE 'chunked' requires HLS_SEGMENT_FORMAT 'ts'.")
+# How long a queued transcode blocks a second submission for the same video.
+TRANSCODE_LOCK_TIMEOUT = int(os.getenv('TRANSCODE_LOCK_TIMEOUT', 6 * 60 * 60))
+# Soft time limit of a transcode task: a fixed allowance plus a number of seconds
+# per second of source, capped at TRANSCODE_TIME_LIMIT_MAX. The hard limit kills
+# the worker process TRANSCODE_TIME_LIMIT_GRACE seconds after the soft one.
+TRANSCODE_TIME_LIMIT_BASE = int(os.getenv('TRANSCODE_TIME_LIMIT_BASE', 10 * 60))
+TRANSCODE_TIME_LIMIT_FACTOR = float(os.getenv('TRANSCODE_TIME_LIMIT_FACTOR', 4))
+TRANSCODE_TIME_LIMIT_MAX = int(os.getenv('TRANSCODE_TIME_LIMIT_MAX', 6 * 60 * 60))
+TRANSCODE_TIME_LIMIT_GRACE = int(os.getenv('TRANSCODE_TIME_LIMIT_GRACE', 5 * 60))
+TRANSCODE_MAX_RETRIES = int(os.getenv('TRANSCODE_MAX_RETRIES', 3))
+
+# Transcode tasks are acknowledged only after they finish. Redis hands an
+# unacknowledged message to another worker once the visibility timeout passes,
+# so it has to outlast the longest possible encode.
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': TRANSCODE_TIME_LIMIT_MAX + TRANSCODE_TIME_LIMIT_GRACE + 60 * 60,
+}
+
 # Redis Cache Setup
 CACHES = {
     'default': {
@@ -200,6 +306,32 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 
 
 
+# Videos per page of the catalog list; clients may ask for up to the maximum with ?page_size=.
+VIDEO_CATALOG_PAGE_SIZE = int(os.getenv('VIDEO_CATALOG_PAGE_SIZE', 24))
+VIDEO_CATALOG_MAX_PAGE_SIZE = int(os.getenv('VIDEO_CATALOG_MAX_PAGE_SIZE', 100))
+# Catalog responses are cached per catalog version, which every video save or
+# delete bumps. The timeout only bounds how long bulk updates that skip the
+# signals (queryset.update, bulk_create) can stay invisible.
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 5 * 60))
+# Videos per row of the home-screen rails endpoint.
+HOME_RAIL_SIZE = int(os.getenv('HOME_RAIL_SIZE', 20))
+
+# Playback progress heartbeats are buffered in Redis and upserted into Postgres
+# in bulk every PROGRESS_FLUSH_INTERVAL seconds by Celery beat. Entries stay in
+# Redis for PROGRESS_BUFFER_TTL seconds after the last heartbeat so reads keep
+# being served from the buffer. Turning PROGRESS_WRITE_BEHIND off writes every
+# heartbeat straight to the database, for setups without a Redis cache.
+PROGRESS_WRITE_BEHIND = os.getenv('PROGRESS_WRITE_BEHIND', 'True') == 'True'
+PROGRESS_FLUSH_INTERVAL = int(os.getenv('PROGRESS_FLUSH_INTERVAL', 10))
+PROGRESS_BUFFER_TTL = int(os.getenv('PROGRESS_BUFFER_TTL', 24 * 60 * 60))
+CONTINUE_WATCHING_SIZE = int(os.getenv('CONTINUE_WATCHING_SIZE', 20))
+CELERY_BEAT_SCHEDULE = {
+    'flush-progress-buffer': {
+        'task': 'video_app.tasks.flush_progress',
+        'schedule': PROGRESS_FLUSH_INTERVAL,
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -28,3 +28,18 @@ class CeleryConfigTestCase(TestCase):
             app.broker_connection().connect()
 
         self.assertIn("Forced Redis connection failure", str(context.exception), "Exception message not triggered.")
+
+    def test_transcode_tasks_use_their_own_queue(self):
+        """Test encode tasks are routed to the transcode queue and light tasks stay on the default queue."""
+        router = app.amqp.router
+        for name in ('video_app.tasks.convert_to_hls', 'video_app.tasks.encode_rendition',
+                     'video_app.tasks.generate_thumbnail'):
+            self.assertEqual(router.route({}, name)['queue'].name, 'transcode')
+        self.assertEqual(router.route({}, 'video_app.tasks.finalize_hls')['queue'].name, 'default')
+        self.assertEqual(app.conf.worker_prefetch_multiplier, 1)
+
+    def test_beat_flushes_progress_buffer(self):
+        """Test Celery beat schedules the progress flush on the default queue."""
+        entry = app.conf.beat_schedule['flush-progress-buffer']
+        self.assertEqual(entry['task'], 'video_app.tasks.flush_progress')
+        self.assertEqual(app.amqp.router.route({}, entry['task'])['queue'].name, 'default')
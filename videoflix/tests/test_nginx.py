@@ -0,0 +1,43 @@
+import os
+import re
+import shutil
+import subprocess
+import unittest
+from django.conf import settings
+from django.test import SimpleTestCase
+
+NGINX_CONF = os.path.join(os.path.dirname(__file__), 'fixtures', 'nginx.conf')
+
+
+def read_locations():
+    with open(NGINX_CONF) as f:
+        config = f.read()
+    return dict(re.findall(r'location\s+(\S+)\s*\{([^}]*)\}', config))
+
+
+class NginxConfigTestCase(SimpleTestCase):
+    """Test the local nginx fixture matches the X-Accel-Redirect settings"""
+
+    def test_protected_location_is_internal(self):
+        """Test the X-Accel-Redirect target exists and cannot be requested directly"""
+        locations = read_locations()
+        self.assertIn(settings.MEDIA_ACCEL_PREFIX, locations)
+        body = locations[settings.MEDIA_ACCEL_PREFIX]
+        self.assertRegex(body, r'\binternal;')
+        self.assertRegex(body, r'\balias\s+\S+/;')
+
+    def test_media_is_not_served_around_django(self):
+        """Test no public location serves MEDIA_URL from disk, which would skip the access check"""
+        for location, body in read_locations().items():
+            if location == settings.MEDIA_ACCEL_PREFIX:
+                continue
+            if settings.MEDIA_URL.startswith(location):
+                self.assertIn('proxy_pass', body)
+                self.assertNotRegex(body, r'\b(alias|root)\b')
+
+    @unittest.skipUnless(shutil.which('nginx'), 'nginx is not installed')
+    def test_config_is_valid(self):
+        """Test nginx accepts the fixture"""
+        result = subprocess.run(['nginx', '-t', '-p', os.path.dirname(NGINX_CONF), '-c', NGINX_CONF],
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
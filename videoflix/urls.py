@@ -17,7 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from video_app.views import MediaView
 
 urlpatterns = [
     path('videoflix/admin/', admin.site.urls),
@@ -25,4 +25,7 @@ urlpatterns = [
     path('videoflix/api/', include ('video_app.api.urls')),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Every media request passes the access check in MediaView, which then hands the file to the front proxy.
+urlpatterns += [
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:path>", MediaView.as_view(), name='media'),
+]